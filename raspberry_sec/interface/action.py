@@ -2,12 +2,14 @@ class ActionMessage:
 	"""
 	Class for holding Action alert details
 	"""
-	def __init__(self, data):
+	def __init__(self, data, key: str=None):
 		"""
 		Constructor
 		:param data: alert detail
+		:param key: idempotency key of the alert the message belongs to (see ActionOutbox)
 		"""
 		self.data = data
+		self.key = key
 
 
 class Action:
@@ -29,7 +31,8 @@ class Action:
 
 	def fire(self, msg: list):
 		"""
-		Alert functionality
+		Alert functionality, failures are signalled by raising an exception
+		(or by returning a concurrent.futures.Future that fails), the alert is retried then
 		:param msg: list of ActionMessage instances
 		"""
 		pass
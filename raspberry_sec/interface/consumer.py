@@ -12,6 +12,12 @@ class ConsumerContext:
 		self.data = _data
 		self.alert = _alert
 		self.alert_data = _alert_data
+		# derivatives of the data computed by the consumers (see FrameCache)
+		self.cache = dict()
+		# regions of interest (x, y, w, h) on the original sample, None if unknown (whole sample)
+		self.regions = None
+		# stable ids of the regions (e.g. tracked faces), None if not tracked
+		self.region_ids = None
 
 
 class Consumer:
@@ -31,6 +37,21 @@ class Consumer:
 		"""
 		pass
 
+	def initialize(self):
+		"""
+		Prepares the component (e.g. loads models). The stream calls it once in its
+		own process before the first sample arrives, so the first alert does not pay for it.
+		"""
+		pass
+
+	def get_services(self):
+		"""
+		Services the consumer relies on, PCASystem runs each of them
+		in a separate process (before the streams are started)
+		:return: list of ProcessReady instances
+		"""
+		return []
+
 	def run(self, context: ConsumerContext):
 		"""
 		:param context: contains session data
@@ -44,6 +65,27 @@ class Consumer:
 		"""
 		pass
 
+	def is_gate(self):
+		"""
+		A gate only decides about the alert flag (and sets the fields in get_outputs):
+		it neither modifies context.data nor needs to see every sample, so it can be
+		reordered with the other gates it does not depend on (see get_inputs).
+		:return: True or False
+		"""
+		return False
+
+	def get_inputs(self):
+		"""
+		:return: names of the ConsumerContext fields (e.g. 'regions') the consumer reads
+		"""
+		return set()
+
+	def get_outputs(self):
+		"""
+		:return: names of the ConsumerContext fields (e.g. 'regions') the consumer sets
+		"""
+		return set()
+
 	def __eq__(self, other):
 		"""
 		:param other: other object
@@ -1,4 +1,6 @@
+import time
 from enum import Enum
+from threading import Condition
 from multiprocessing.managers import BaseManager
 
 from raspberry_sec.system.util import ProcessContext, ProcessReady
@@ -19,6 +21,22 @@ class ProducerDataManager(BaseManager):
 	pass
 
 
+class ProducerSample:
+	"""
+	Class for holding a sample together with its frame id and capture time
+	"""
+	def __init__(self, _seq: int, _timestamp: float, _data):
+		"""
+		Constructor
+		:param _seq: monotonically increasing id of the sample (starts from 1)
+		:param _timestamp: time of publishing (seconds since the epoch)
+		:param _data: sample data
+		"""
+		self.seq = _seq
+		self.timestamp = _timestamp
+		self.data = _data
+
+
 class ProducerDataProxy(object):
 	"""
 	Data proxy for shared data
@@ -28,13 +46,20 @@ class ProducerDataProxy(object):
 		Constructor
 		"""
 		self.data = None
+		self.seq = 0
+		self.timestamp = None
+		self.condition = Condition()
 
 	def set_data(self, new):
 		"""
-		Sets shared data
+		Sets shared data and wakes up the waiting readers
 		:param new: new data
 		"""
-		self.data = new
+		with self.condition:
+			self.data = new
+			self.seq += 1
+			self.timestamp = time.time()
+			self.condition.notify_all()
 
 	def get_data(self):
 		"""
@@ -42,6 +67,20 @@ class ProducerDataProxy(object):
 		"""
 		return self.data
 
+	def get_next(self, after_seq: int, timeout: float, copy: bool=False):
+		"""
+		Blocks until a sample newer than after_seq is available
+		:param after_seq: id of the last sample the caller has seen (0 if none)
+		:param timeout: in seconds
+		:param copy: True if the caller keeps the data while newer samples arrive
+		(the data is always a copy here, it is pickled by the manager)
+		:return: ProducerSample or None if nothing new arrived in time
+		"""
+		with self.condition:
+			if not self.condition.wait_for(lambda: self.seq > after_seq, timeout):
+				return None
+			return ProducerSample(self.seq, self.timestamp, self.data)
+
 
 class Producer(ProcessReady):
 	"""
@@ -89,6 +128,18 @@ class Producer(ProcessReady):
 		"""
 		pass
 
+	def get_next(self, data_proxy: ProducerDataProxy, after_seq: int, timeout: float, copy: bool=False):
+		"""
+		Waits for a sample that is newer than the one the caller has already seen
+		:param data_proxy: the producing Producer process stores the sample here
+		:param after_seq: id of the last sample seen (0 if none)
+		:param timeout: in seconds
+		:param copy: True if the sample is used for longer than the producer's
+		next few frames (otherwise it may be a view overwritten in the meantime)
+		:return: ProducerSample or None in case of timeout
+		"""
+		return data_proxy.get_next(after_seq, timeout, copy)
+
 	def get_type(self):
 		"""
 		:return: Producer.Type
@@ -3,13 +3,22 @@ import time
 import cv2
 from raspberry_sec.interface.producer import Type
 from raspberry_sec.interface.consumer import Consumer, ConsumerContext
+from raspberry_sec.system.framecache import FrameCache
 
 
 class BodydetectorConsumer(Consumer):
 	"""
-	Consumer class for detecting human body in an image
+	Consumer class for detecting human body in an image.
+	If the regions of interest are known (context.regions set by an upstream consumer,
+	e.g. the motion detector, or the static 'regions' parameter) only padded crops
+	around them are scanned. Nearby crops are merged, so small regions are
+	processed together. Every 'full_scan_interval'-th frame is scanned entirely,
+	just like the frames where the crops would cover most of the image anyway.
 	"""
 	LOGGER = logging.getLogger('BodydetectorConsumer')
+	# size of the default people detector window (width, height)
+	WINDOW_SIZE = (64, 128)
+	FULL_SCAN_RATIO = 0.6
 
 	def __init__(self, parameters: dict):
 		"""
@@ -19,6 +28,10 @@ class BodydetectorConsumer(Consumer):
 		super().__init__(parameters)
 		self.initialized = False
 		self.hog = None
+		self.roi_padding = self.parameters.get('roi_padding', 16)
+		self.full_scan_interval = self.parameters.get('full_scan_interval', 30)
+		self.static_regions = self.parameters.get('regions')
+		self.frames = 0
 
 	def get_name(self):
 		return 'BodydetectorConsumer'
@@ -33,6 +46,92 @@ class BodydetectorConsumer(Consumer):
 
 		self.initialized = True
 
+	@staticmethod
+	def expand_box(box: tuple, padding: int, width: int, height: int):
+		"""
+		Pads the box and grows it to at least the detector window, clipped to the image
+		:param box: (x, y, w, h)
+		:param padding: in pixels
+		:param width: of the image
+		:param height: of the image
+		:return: (x1, y1, x2, y2)
+		"""
+		x, y, w, h = box
+		x1, y1, x2, y2 = x - padding, y - padding, x + w + padding, y + h + padding
+		min_w, min_h = BodydetectorConsumer.WINDOW_SIZE
+		if x2 - x1 < min_w:
+			x1 -= (min_w - (x2 - x1)) // 2
+			x2 = x1 + min_w
+		if y2 - y1 < min_h:
+			y1 -= (min_h - (y2 - y1)) // 2
+			y2 = y1 + min_h
+		# shift the box back into the image instead of shrinking it
+		x1, x2 = max(0, x1 - max(0, x2 - width)), min(width, x2 - min(0, x1))
+		y1, y2 = max(0, y1 - max(0, y2 - height)), min(height, y2 - min(0, y1))
+		return x1, y1, x2, y2
+
+	@staticmethod
+	def merge_boxes(boxes: list):
+		"""
+		Merges the overlapping boxes until none of them overlap
+		:param boxes: list of (x1, y1, x2, y2)
+		:return: list of (x1, y1, x2, y2)
+		"""
+		merged = []
+		for box in sorted(boxes):
+			box = list(box)
+			i = 0
+			while i < len(merged):
+				other = merged[i]
+				if box[0] <= other[2] and other[0] <= box[2] and box[1] <= other[3] and other[1] <= box[3]:
+					box = [min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3])]
+					merged.pop(i)
+					i = 0
+				else:
+					i += 1
+			merged.append(box)
+		return [tuple(box) for box in merged]
+
+	def get_crops(self, context: ConsumerContext, width: int, height: int):
+		"""
+		:param context: ConsumerContext
+		:param width: of the resized image
+		:param height: of the resized image
+		:return: list of (x1, y1, x2, y2) crops of the resized image or None for a full scan
+		"""
+		self.frames += 1
+		if self.full_scan_interval and self.frames % self.full_scan_interval == 0:
+			return None
+
+		regions = context.regions if context.regions is not None else self.static_regions
+		if regions is None:
+			return None
+
+		scale_x = width / context.data.shape[1]
+		scale_y = height / context.data.shape[0]
+		boxes = []
+		for x, y, w, h in regions:
+			box = (int(x * scale_x), int(y * scale_y), int(w * scale_x), int(h * scale_y))
+			boxes.append(BodydetectorConsumer.expand_box(box, self.roi_padding, width, height))
+		crops = BodydetectorConsumer.merge_boxes(boxes)
+
+		area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in crops)
+		if area >= BodydetectorConsumer.FULL_SCAN_RATIO * width * height:
+			return None
+		return crops
+
+	def detect(self, img):
+		"""
+		:param img: grayscale image
+		:return: list of the detected bodies
+		"""
+		found, _ = self.hog.detectMultiScale(
+			img,
+			winStride=(self.parameters['win_stride_x'], self.parameters['win_stride_y']),
+			padding=(self.parameters['padding_x'], self.parameters['padding_y']),
+			scale=self.parameters['scale'])
+		return found
+
 	def run(self, context: ConsumerContext):
 		if not self.initialized:
 			self.initialize()
@@ -41,15 +140,17 @@ class BodydetectorConsumer(Consumer):
 		context.alert = False
 
 		if img is not None:
-			img = cv2.resize(img, (self.parameters['resize_width'], self.parameters['resize_height']))
-			img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-			found, _ = self.hog.detectMultiScale(
-				img,
-				winStride=(self.parameters['win_stride_x'], self.parameters['win_stride_y']),
-				padding=(self.parameters['padding_x'], self.parameters['padding_y']),
-				scale=self.parameters['scale'])
-
-			if len(found) > 0:
+			size = (self.parameters['resize_width'], self.parameters['resize_height'])
+			img = FrameCache.get(context, size, gray=True)
+			crops = self.get_crops(context, img.shape[1], img.shape[0])
+
+			if crops is None:
+				found = len(self.detect(img)) > 0
+			else:
+				BodydetectorConsumer.LOGGER.debug('Scanning ' + str(len(crops)) + ' regions')
+				found = any(len(self.detect(img[y1:y2, x1:x2])) > 0 for x1, y1, x2, y2 in crops)
+
+			if found:
 				context.alert = True
 				context.alert_data = 'Body detected'
 				BodydetectorConsumer.LOGGER.info(context.alert_data)
@@ -61,3 +162,9 @@ class BodydetectorConsumer(Consumer):
 
 	def get_type(self):
 		return Type.CAMERA
+
+	def is_gate(self):
+		return True
+
+	def get_inputs(self):
+		return {'regions'}
@@ -1,21 +1,17 @@
 import logging
 import cv2
 from raspberry_sec.interface.producer import Producer, ProducerDataManager, ProducerDataProxy, Type
+from raspberry_sec.system.framebuffer import SharedFrameDataProxy
 from raspberry_sec.system.util import ProcessContext
 
 
-class CameraProducerDataProxy(ProducerDataProxy):
-	"""
-	For storing shared camera data
-	"""
-	pass
-
-
 class CameraProducer(Producer):
 	"""
 	Class for producing camera sample data
 	"""
 	LOGGER = logging.getLogger('CameraProducer')
+	FRAME_BUFFER_SIZE = 640 * 480 * 3
+	FRAME_SLOTS = 4
 
 	def __init__(self, parameters: dict):
 		"""
@@ -25,12 +21,22 @@ class CameraProducer(Producer):
 		super().__init__(parameters)
 
 	def register_shared_data_proxy(self):
-		ProducerDataManager.register('CameraProducerDataProxy', CameraProducerDataProxy)
+		"""
+		Frames are shared through shared memory, nothing to register in the manager
+		"""
+		pass
 
 	def create_shared_data_proxy(self, manager: ProducerDataManager):
-		return manager.CameraProducerDataProxy()
+		"""
+		:param manager: not used, the frames bypass the manager process
+		:return: SharedFrameDataProxy sized by the frame_buffer_size and frame_slots parameters
+		"""
+		return SharedFrameDataProxy(
+			slot_size=self.parameters.get('frame_buffer_size', CameraProducer.FRAME_BUFFER_SIZE),
+			slots=self.parameters.get('frame_slots', CameraProducer.FRAME_SLOTS))
 
 	def run(self, context: ProcessContext):
+		clip_buffer = None
 		try:
 			cam = cv2.VideoCapture(self.parameters['device'])
 			if not cam.isOpened():
@@ -40,13 +46,27 @@ class CameraProducer(Producer):
 			unsuccessful_images = 0
 			data_proxy = context.get_prop('shared_data_proxy')
 
+			# pre-roll of the incident clips (encoded on a background thread)
+			recorder = context.get_prop('recorder')
+			if recorder is not None:
+				clip_buffer = recorder.create_buffer(self.parameters.get('zone', str(self.parameters['device'])))
+				clip_buffer.start()
+
 			while not context.stop_event.is_set():
 				ret_val, img = cam.read()
 				if ret_val:
-					data_proxy.set_data(img)
+					try:
+						data_proxy.set_data(img)
+						if clip_buffer is not None:
+							clip_buffer.offer(img)
+					except ValueError as e:
+						CameraProducer.LOGGER.error('Cannot share image: ' + str(e))
+						ret_val = False
 				else:
-					unsuccessful_images += 1
 					CameraProducer.LOGGER.warning('Could not capture image')
+
+				if not ret_val:
+					unsuccessful_images += 1
 					# if too many errors happen we better kill this process
 					if unsuccessful_images == self.parameters['unsuccessful_limit']:
 						break
@@ -54,6 +74,8 @@ class CameraProducer(Producer):
 				cv2.waitKey(self.parameters['wait_key_interval'])
 		finally:
 			CameraProducer.LOGGER.debug('Stopping capturing images')
+			if clip_buffer is not None:
+				clip_buffer.stop()
 			cam.release()
 	
 	def get_zone(self):
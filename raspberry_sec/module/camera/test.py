@@ -30,7 +30,8 @@ def setup_context(proxy: ProducerDataProxy, event: Event):
 	return ProcessContext(
 		log_queue=None,
 		stop_event=event,
-		shared_data_proxy=proxy
+		shared_data_proxy=proxy,
+		recorder=None
 	)
 
 
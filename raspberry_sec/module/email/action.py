@@ -1,15 +1,196 @@
+import re
+import base64
+import hashlib
 import logging
 import smtplib
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty, Full
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from email.mime.image import MIMEImage
 from raspberry_sec.interface.action import Action
 
 
+class SMTPSession:
+	"""
+	Persistent SMTP connection: the handshake (EHLO, STARTTLS, login) is done once
+	and the connection is reused, it is reestablished if the server dropped it.
+	"""
+	LOGGER = logging.getLogger('SMTPSession')
+	TIMEOUT = 30
+	RECOVERED_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+	def __init__(self, parameters: dict):
+		"""
+		Constructor
+		:param parameters: of the EmailAction
+		"""
+		self.parameters = parameters
+		self.server = None
+		self.last_used = 0
+
+	def connect(self):
+		"""
+		Opens the connection
+		"""
+		SMTPSession.LOGGER.debug('Connecting to ' + self.parameters['smtp_addr'])
+		server = smtplib.SMTP(host=self.parameters['smtp_addr'], timeout=SMTPSession.TIMEOUT)
+		try:
+			server.ehlo()
+			if self.parameters.get('starttls', True):
+				server.starttls()
+				server.ehlo()
+			if self.parameters.get('user'):
+				server.login(self.parameters['user'], self.parameters['password'])
+		except Exception:
+			server.close()
+			raise
+		self.server = server
+
+	def send(self, mail: MIMEMultipart):
+		"""
+		Sends the mail, reconnects once if the connection was lost.
+		After any other failure (e.g. a timeout mid-transaction) the connection
+		is in an unknown state, it is closed so that the next mail starts a new one.
+		:param mail: the message
+		"""
+		for attempt in range(2):
+			if self.server is None:
+				self.connect()
+			try:
+				self.server.sendmail(self.parameters['from_addr'], self.parameters['to_addr'], mail.as_string())
+				self.last_used = time.monotonic()
+				return
+			except SMTPSession.RECOVERED_ERRORS:
+				# sendmail has already reset the transaction (RSET), the connection is usable
+				raise
+			except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+				SMTPSession.LOGGER.info('SMTP connection lost: ' + str(e))
+				self.close()
+				if attempt:
+					raise
+			except Exception:
+				self.close()
+				raise
+
+	def close(self):
+		"""
+		Closes the connection (if open)
+		"""
+		if self.server is not None:
+			try:
+				self.server.quit()
+			except Exception:
+				self.server.close()
+			self.server = None
+
+	def close_if_idle(self, idle_timeout: float):
+		"""
+		Closes the connection if it has not been used for a while (servers drop idle clients anyway)
+		:param idle_timeout: in seconds
+		"""
+		if self.server is not None and time.monotonic() - self.last_used > idle_timeout:
+			SMTPSession.LOGGER.debug('Closing idle SMTP connection')
+			self.close()
+
+
+class EmailOutbox:
+	"""
+	Bounded queue of alerts in front of a pool of SMTPSession-s.
+	A sender waits 'window' seconds after the first alert it takes, and merges
+	every alert arriving meanwhile into one mail. If the queue is full, the
+	caller is blocked (backpressure) instead of piling up connections.
+	"""
+	LOGGER = logging.getLogger('EmailOutbox')
+	IDLE_TIMEOUT = 60
+	MAX_BATCH = 50
+
+	def __init__(self, send_batch, window: float, size: int, senders: int):
+		"""
+		Constructor
+		:param send_batch: function taking a list of alerts (lists of ActionMessage-s) and a SMTPSession
+		:param window: seconds to collect alerts into one mail
+		:param size: maximum number of alerts waiting
+		:param senders: number of SMTP sessions sending in parallel
+		"""
+		self.send_batch = send_batch
+		self.window = window
+		self.queue = Queue(maxsize=size)
+		self.senders = senders
+		self.threads = []
+
+	def start(self, session_factory):
+		"""
+		Starts the senders
+		:param session_factory: function returning a new SMTPSession
+		"""
+		for i in range(self.senders):
+			thread = threading.Thread(target=self.send_loop, args=(session_factory(), ), name='EmailSender' + str(i), daemon=True)
+			thread.start()
+			self.threads.append(thread)
+
+	def put(self, messages: list, timeout: float):
+		"""
+		Enqueues an alert
+		:param messages: ActionMessage-s
+		:param timeout: seconds to wait if the outbox is full
+		:return: Future, resolved when the mail containing the alert is sent
+		:raises queue.Full: if the outbox stayed full
+		"""
+		future = Future()
+		self.queue.put((messages, future), timeout=timeout)
+		return future
+
+	def take_batch(self):
+		"""
+		:return: the alerts arriving within the window after the first one (blocks until there is one)
+		"""
+		batch = [self.queue.get(timeout=EmailOutbox.IDLE_TIMEOUT)]
+		deadline = time.monotonic() + self.window
+		while len(batch) < EmailOutbox.MAX_BATCH:
+			try:
+				batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+			except Empty:
+				break
+		return batch
+
+	def send_loop(self, session: SMTPSession):
+		"""
+		Sender thread
+		:param session: SMTPSession owned by the thread
+		"""
+		while True:
+			try:
+				batch = self.take_batch()
+			except Empty:
+				session.close_if_idle(EmailOutbox.IDLE_TIMEOUT)
+				continue
+
+			try:
+				self.send_batch([messages for messages, _ in batch], session)
+				for _, future in batch:
+					future.set_result(True)
+			except Exception as e:
+				EmailOutbox.LOGGER.error('Email could not be sent: ' + str(e))
+				for _, future in batch:
+					future.set_exception(e)
+
+
 class EmailAction(Action):
 	"""
-	Action class for sending emails (with HTML content)
+	Action class for sending emails (with HTML content).
+	Alerts go through an EmailOutbox: alerts within 'batch_window' seconds are merged
+	into one mail, sent over persistent SMTP connections ('pool_size' of them).
+	Inline images (data URIs, e.g. the unknown faces) are sent as related attachments.
+	The Message-ID of a mail is derived from the idempotency keys of its alerts. It is
+	only a best-effort hint: some mail clients hide a mail with a Message-ID they have
+	already seen, but the SMTP servers do not deduplicate, and a retried alert usually
+	lands in a batch with different alerts (so its mail gets a different Message-ID).
 	"""
 	LOGGER = logging.getLogger('EmailAction')
+	DATA_URI_PATTERN = re.compile(r'src="data:image/(\w+);base64,([^"]+)"')
 
 	def __init__(self, parameters: dict):
 		"""
@@ -17,31 +198,105 @@ class EmailAction(Action):
 		:param parameters: see Action constructor
 		"""
 		super().__init__(parameters)
+		self.outbox = None
+		self.lock = threading.Lock()
+
+	def __getstate__(self):
+		"""
+		The outbox (threads, connections) is process local, it is recreated after unpickling
+		:return: state to be pickled
+		"""
+		return {'parameters': self.parameters}
+
+	def __setstate__(self, state):
+		"""
+		:param state: pickled state
+		"""
+		self.__init__(state['parameters'])
 
 	def get_name(self):
 		return 'EmailAction'
 
+	def get_outbox(self):
+		"""
+		:return: the EmailOutbox (started on the first use)
+		"""
+		with self.lock:
+			if self.outbox is None:
+				self.outbox = EmailOutbox(
+					send_batch=self.send_batch,
+					window=self.parameters.get('batch_window', 2),
+					size=self.parameters.get('outbox_size', 20),
+					senders=self.parameters.get('pool_size', 1))
+				self.outbox.start(lambda: SMTPSession(self.parameters))
+			return self.outbox
+
+	def get_message_id(self, batch: list):
+		"""
+		:param batch: list of alerts (lists of ActionMessage-s)
+		:return: Message-ID header derived from the keys of the alerts (None if they have no key),
+		the same set of keys always gets the same Message-ID
+		"""
+		keys = sorted(set([m.key for msg in batch for m in msg if m.key]))
+		if not keys:
+			return None
+		digest = hashlib.sha1(','.join(keys).encode('utf-8')).hexdigest()
+		return '<' + digest + '.raspberry-sec@' + self.parameters['from_addr'].split('@')[-1] + '>'
+
+	def build_mail(self, batch: list):
+		"""
+		Creates one mail from the alerts
+		:param batch: list of alerts (lists of ActionMessage-s)
+		:return: MIME message
+		"""
+		mail = MIMEMultipart('related')
+		mail['From'] = self.parameters['from_addr']
+		mail['To'] = self.parameters['to_addr']
+		subject = self.parameters['subject']
+		if len(batch) > 1:
+			subject += ' (' + str(len(batch)) + ' alerts)'
+		mail['Subject'] = subject
+		message_id = self.get_message_id(batch)
+		if message_id:
+			mail['Message-ID'] = message_id
+
+		images = []
+
+		def to_cid(match):
+			images.append((match.group(1), base64.b64decode(match.group(2))))
+			return 'src="cid:image' + str(len(images)) + '"'
+
+		content = ''.join(['<p>' + str(m.data) + '</p>' for msg in batch for m in msg])
+		content = EmailAction.DATA_URI_PATTERN.sub(to_cid, content)
+		mail.attach(MIMEText('<html>' + content + '</html>', 'html'))
+
+		for i, (subtype, data) in enumerate(images, 1):
+			image = MIMEImage(data, subtype)
+			image.add_header('Content-ID', '<image' + str(i) + '>')
+			image.add_header('Content-Disposition', 'inline', filename='image' + str(i) + '.' + subtype)
+			mail.attach(image)
+		return mail
+
+	def send_batch(self, batch: list, session: SMTPSession):
+		"""
+		Sends the alerts in one mail
+		:param batch: list of alerts (lists of ActionMessage-s)
+		:param session: SMTPSession
+		"""
+		session.send(self.build_mail(batch))
+		EmailAction.LOGGER.info('Email has been successfully sent (' + str(len(batch)) + ' alerts)')
+
 	def fire(self, msg: list):
 		"""
-		This method sends an email with the content set to the msg.
+		This method queues an email with the content set to the msg.
+		Blocks while the outbox is full.
 		:param msg: ActionMessage-s
+		:return: Future resolved when the email is sent
+		:raises queue.Full: if the outbox stayed full
 		"""
 		EmailAction.LOGGER.info('Action fired')
 		try:
-			mail = MIMEMultipart('alternative')
-			mail['From'] = self.parameters['from_addr']
-			mail['To'] = self.parameters['to_addr']
-			mail['Subject'] = self.parameters['subject']
-
-			content = ''.join(['<p>' + str(m.data) + '</p>' for m in msg])
-			mail.attach(MIMEText('<html>' + content + '</html>', 'html'))
-
-			with smtplib.SMTP(host=self.parameters['smtp_addr']) as server:
-				server.ehlo()
-				server.starttls()
-				server.login(self.parameters['user'], self.parameters['password'])
-				server.sendmail(self.parameters['from_addr'], self.parameters['to_addr'], mail.as_string())
-
-			EmailAction.LOGGER.info('Email has been successfully sent')
-		except Exception as e:
-			EmailAction.LOGGER.error('Email could not be sent: ' + e.__str__())
+			return self.get_outbox().put(msg, self.parameters.get('enqueue_timeout', 10))
+		except Full:
+			EmailAction.LOGGER.error('Email could not be queued, the outbox is full')
+			raise
@@ -1,5 +1,6 @@
 import sys
 import os
+import argparse
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
 from raspberry_sec.module.email.action import EmailAction
 from raspberry_sec.interface.action import ActionMessage
@@ -17,15 +18,37 @@ def set_parameters():
 	return parameters
 
 
-def integration_test():
+def set_local_parameters(smtp_addr: str):
+	"""
+	Parameters for a local SMTP stand-in without TLS and authentication,
+	e.g.: python -m aiosmtpd -n -l localhost:8025
+	:param smtp_addr: host:port of the local server
+	"""
+	parameters = set_parameters()
+	parameters['smtp_addr'] = smtp_addr
+	parameters['starttls'] = False
+	parameters['user'] = ''
+	return parameters
+
+
+def integration_test(parameters: dict):
 	# Given
-	email_action = EmailAction(set_parameters())
+	email_action = EmailAction(parameters)
 
 	# When
-	email_action.fire([
-		ActionMessage('<b>TEST</b> Message1'),
-		ActionMessage('<a href="www.google.com">TEST</a> Message2')])
+	futures = [email_action.fire([
+		ActionMessage('<b>TEST</b> Message' + str(i)),
+		ActionMessage('<a href="www.google.com">TEST</a> Message' + str(i))]) for i in range(5)]
+
+	# Then (the alerts are merged into one mail)
+	for future in futures:
+		print('Sent: ' + str(future.result(timeout=60)))
 
 
 if __name__ == '__main__':
-	integration_test()
+	parser = argparse.ArgumentParser(description='== Email action (testing module) ==')
+	parser.add_argument('-l', '--local',
+						help='Sends the mails to a local SMTP stand-in (host:port) instead of the configured server')
+	args = parser.parse_args()
+
+	integration_test(set_local_parameters(args.local) if args.local else set_parameters())
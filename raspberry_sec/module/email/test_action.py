@@ -0,0 +1,226 @@
+import base64
+import queue
+import smtplib
+import socket
+import threading
+import unittest
+from unittest import mock
+from email.mime.text import MIMEText
+from raspberry_sec.module.email.action import EmailAction, EmailOutbox, SMTPSession
+from raspberry_sec.interface.action import ActionMessage
+
+
+def create_parameters():
+    return {
+        'from_addr': 'pi@example.com',
+        'to_addr': 'owner@example.com',
+        'smtp_addr': 'localhost:8025',
+        'subject': 'ALERT'
+    }
+
+
+class StubSMTP:
+    """
+    Stand-in of smtplib.SMTP recording the mails, it can drop the connection
+    or fail with 'error_next' once
+    """
+    instances = []
+    disconnect_next = False
+    error_next = None
+
+    def __init__(self, host: str, timeout: float):
+        self.host = host
+        self.sent = []
+        self.closed = False
+        StubSMTP.instances.append(self)
+
+    def ehlo(self):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user: str, password: str):
+        pass
+
+    def sendmail(self, from_addr: str, to_addr: str, mail: str):
+        if StubSMTP.disconnect_next:
+            StubSMTP.disconnect_next = False
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        if StubSMTP.error_next is not None:
+            error, StubSMTP.error_next = StubSMTP.error_next, None
+            raise error
+        self.sent.append(mail)
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class TestEmailActionMethods(unittest.TestCase):
+
+    def test_message_id_is_derived_from_alert_keys(self):
+        # Given
+        action = EmailAction(create_parameters())
+        batch = [[ActionMessage('A', 'key1')], [ActionMessage('B', 'key2')]]
+
+        # When
+        mail = action.build_mail(batch)
+        again = action.build_mail(list(reversed(batch)))
+        other = action.build_mail(batch[:1])
+
+        # Then
+        self.assertTrue(mail['Message-ID'].endswith('@example.com>'))
+        self.assertEqual(mail['Message-ID'], again['Message-ID'])
+        self.assertNotEqual(mail['Message-ID'], other['Message-ID'])
+        self.assertIsNone(action.build_mail([[ActionMessage('C')]])['Message-ID'])
+
+    def test_build_mail_sends_data_uri_images_inline(self):
+        # Given
+        action = EmailAction(create_parameters())
+        image = base64.b64encode(b'PNGDATA').decode()
+        batch = [[ActionMessage('<img src="data:image/png;base64,' + image + '">')], [ActionMessage('B')]]
+
+        # When
+        mail = action.build_mail(batch)
+        parts = mail.get_payload()
+
+        # Then
+        self.assertEqual('ALERT (2 alerts)', mail['Subject'])
+        self.assertIn('src="cid:image1"', parts[0].get_payload())
+        self.assertEqual('<image1>', parts[1]['Content-ID'])
+        self.assertEqual(b'PNGDATA', parts[1].get_payload(decode=True))
+
+
+class TestSMTPSessionMethods(unittest.TestCase):
+
+    def setUp(self):
+        StubSMTP.instances = []
+        StubSMTP.disconnect_next = False
+        StubSMTP.error_next = None
+        patcher = mock.patch('smtplib.SMTP', StubSMTP)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_send_reuses_connection(self):
+        # Given
+        session = SMTPSession(create_parameters())
+
+        # When
+        session.send(MIMEText('A'))
+        session.send(MIMEText('B'))
+
+        # Then
+        self.assertEqual(1, len(StubSMTP.instances))
+        self.assertEqual(2, len(StubSMTP.instances[0].sent))
+
+    def test_send_reconnects_once(self):
+        # Given
+        session = SMTPSession(create_parameters())
+        session.send(MIMEText('A'))
+        StubSMTP.disconnect_next = True
+
+        # When
+        session.send(MIMEText('B'))
+
+        # Then
+        self.assertEqual(2, len(StubSMTP.instances))
+        self.assertTrue(StubSMTP.instances[0].closed)
+        self.assertEqual(1, len(StubSMTP.instances[1].sent))
+
+    def test_send_reconnects_after_timeout(self):
+        # Given
+        session = SMTPSession(create_parameters())
+        session.send(MIMEText('A'))
+        StubSMTP.error_next = socket.timeout('timed out')
+
+        # When
+        self.assertRaises(socket.timeout, session.send, MIMEText('B'))
+        session.send(MIMEText('C'))
+
+        # Then
+        self.assertEqual(2, len(StubSMTP.instances))
+        self.assertTrue(StubSMTP.instances[0].closed)
+        self.assertEqual(1, len(StubSMTP.instances[1].sent))
+
+    def test_send_keeps_connection_after_refused_recipients(self):
+        # Given
+        session = SMTPSession(create_parameters())
+        StubSMTP.error_next = smtplib.SMTPRecipientsRefused({'to@example.com': (550, b'No such user')})
+
+        # When
+        self.assertRaises(smtplib.SMTPRecipientsRefused, session.send, MIMEText('A'))
+        session.send(MIMEText('B'))
+
+        # Then
+        self.assertEqual(1, len(StubSMTP.instances))
+        self.assertEqual(1, len(StubSMTP.instances[0].sent))
+
+    def test_send_gives_up_after_second_disconnect(self):
+        # Given
+        session = SMTPSession(create_parameters())
+        original = StubSMTP.sendmail
+
+        def always_disconnect(smtp, from_addr, to_addr, mail):
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+
+        # When
+        StubSMTP.sendmail = always_disconnect
+        try:
+            self.assertRaises(smtplib.SMTPServerDisconnected, session.send, MIMEText('A'))
+        finally:
+            StubSMTP.sendmail = original
+
+        # Then
+        self.assertEqual(2, len(StubSMTP.instances))
+        self.assertIsNone(session.server)
+
+
+class TestEmailOutboxMethods(unittest.TestCase):
+
+    def test_take_batch_merges_alerts_within_window(self):
+        # Given
+        outbox = EmailOutbox(send_batch=None, window=0.2, size=10, senders=1)
+        for i in range(3):
+            outbox.put([ActionMessage(i)], timeout=1)
+
+        # When
+        threading.Timer(0.1, outbox.put, args=([ActionMessage(3)], 1)).start()
+        batch = outbox.take_batch()
+        threading.Timer(0.4, outbox.put, args=([ActionMessage(4)], 1)).start()
+        late = outbox.take_batch()
+
+        # Then
+        self.assertEqual([0, 1, 2, 3], [messages[0].data for messages, _ in batch])
+        self.assertEqual([4], [messages[0].data for messages, _ in late])
+
+    def test_put_blocks_when_full(self):
+        # Given
+        outbox = EmailOutbox(send_batch=None, window=0, size=1, senders=1)
+        outbox.put([ActionMessage('A')], timeout=1)
+
+        # Then
+        self.assertRaises(queue.Full, outbox.put, [ActionMessage('B')], 0.01)
+
+    def test_fire_sends_one_mail_per_batch(self):
+        # Given
+        StubSMTP.instances = []
+        parameters = create_parameters()
+        parameters['batch_window'] = 0.2
+        action = EmailAction(parameters)
+
+        # When
+        with mock.patch('smtplib.SMTP', StubSMTP):
+            futures = [action.fire([ActionMessage('ALERT' + str(i))]) for i in range(3)]
+            results = [future.result(timeout=5) for future in futures]
+
+        # Then
+        self.assertEqual([True] * 3, results)
+        self.assertEqual(1, len(StubSMTP.instances))
+        self.assertEqual(1, len(StubSMTP.instances[0].sent))
+        self.assertIn('(3 alerts)', StubSMTP.instances[0].sent[0])
+
+if __name__ == '__main__':
+    unittest.main()
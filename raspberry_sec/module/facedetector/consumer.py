@@ -4,11 +4,19 @@ import logging
 import time
 from raspberry_sec.interface.producer import Type
 from raspberry_sec.interface.consumer import Consumer, ConsumerContext
+from raspberry_sec.system.framecache import FrameCache
+from raspberry_sec.module.facedetector.tracker import FaceTracker
 
 
 class FacedetectorConsumer(Consumer):
 	"""
-	Consumer class for detecting human body in an image
+	Consumer class for detecting faces in an image.
+	The Haar cascade runs every 'detect_interval'-th frame, when nothing is tracked
+	or when there is motion (context.regions) away from the tracked faces. In between
+	the faces are followed by a FaceTracker. The boxes of the faces are stored in
+	context.regions and their stable ids in context.region_ids.
+	With 'multi_face' enabled context.data becomes the list of all the faces
+	(in the order of the regions), otherwise it is the first face.
 	"""
 	LOGGER = logging.getLogger('FacedetectorConsumer')
 
@@ -20,6 +28,10 @@ class FacedetectorConsumer(Consumer):
 		super().__init__(parameters)
 		self.initialized = False
 		self.face_cascade = None
+		self.detect_interval = self.parameters.get('detect_interval', 1)
+		self.tracker = FaceTracker(min_score=self.parameters.get('track_min_score', 0.6))
+		self.frames = 0
+		self.multi_face = self.parameters.get('multi_face', False)
 
 	def get_name(self):
 		return 'FacedetectorConsumer'
@@ -40,6 +52,16 @@ class FacedetectorConsumer(Consumer):
 		self.face_cascade = cv2.CascadeClassifier(FacedetectorConsumer.get_path(self.parameters['cascade_file']))
 		self.initialized = True
 
+	def needs_detection(self, context: ConsumerContext):
+		"""
+		:param context: ConsumerContext
+		:return: True if the cascade has to run on this frame
+		"""
+		self.frames += 1
+		if not self.tracker.tracks or self.frames % self.detect_interval == 0:
+			return True
+		return bool(context.regions) and not self.tracker.covers(context.regions)
+
 	def run(self, context: ConsumerContext):
 		if not self.initialized:
 			self.initialize()
@@ -48,18 +70,24 @@ class FacedetectorConsumer(Consumer):
 		context.alert = False
 
 		if img is not None:
-			img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-			faces = self.face_cascade.detectMultiScale(
-				image=img,
-				scaleFactor=self.parameters['scale_factor'],
-				minNeighbors=self.parameters['min_neighbors'])
+			img = FrameCache.get(context, gray=True)
+			if self.needs_detection(context):
+				faces = self.face_cascade.detectMultiScale(
+					image=img,
+					scaleFactor=self.parameters['scale_factor'],
+					minNeighbors=self.parameters['min_neighbors'])
+				tracks = self.tracker.update(img, faces)
+			else:
+				tracks = self.tracker.track(img)
 
-			# Take one of the faces and process that
-			if len(faces) > 0:
-				(x, y, w, h) = faces[0]
+			if len(tracks) > 0:
+				faces = [img[y:(y + h), x:(x + w)] for (x, y, w, h) in [track.box for track in tracks]]
 				context.alert = True
 				context.alert_data = 'Face detected'
-				context.data = img[y:(y + h), x:(x + w)]
+				# Take one of the faces and process that, unless all of them are needed
+				context.data = faces if self.multi_face else faces[0]
+				context.regions = [track.box for track in tracks]
+				context.region_ids = [track.id for track in tracks]
 				FacedetectorConsumer.LOGGER.info(context.alert_data)
 			else:
 				FacedetectorConsumer.LOGGER.debug('Could not detect any faces')
@@ -71,3 +99,9 @@ class FacedetectorConsumer(Consumer):
 
 	def get_type(self):
 		return Type.CAMERA
+
+	def get_inputs(self):
+		return {'regions'}
+
+	def get_outputs(self):
+		return {'regions', 'region_ids'}
@@ -0,0 +1,104 @@
+import unittest
+import numpy as np
+from raspberry_sec.module.facedetector.tracker import FaceTracker
+
+
+class TestFaceTrackerMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.random = np.random.RandomState(42)
+        self.face = self.random.randint(0, 256, (20, 20)).astype(np.uint8)
+
+    def create_image(self, x: int, y: int):
+        image = np.zeros((100, 100), dtype=np.uint8)
+        image[y:(y + 20), x:(x + 20)] = self.face
+        return image
+
+    def test_get_overlap(self):
+        # Then
+        self.assertEqual(1.0, FaceTracker.get_overlap((0, 0, 10, 10), (0, 0, 10, 10)))
+        self.assertEqual(0.0, FaceTracker.get_overlap((0, 0, 10, 10), (20, 20, 10, 10)))
+        self.assertAlmostEqual(50 / 150, FaceTracker.get_overlap((0, 0, 10, 10), (5, 0, 10, 10)))
+
+    def test_update_keeps_id_of_overlapping_track(self):
+        # Given
+        tracker = FaceTracker()
+        first = tracker.update(self.create_image(10, 10), [(10, 10, 20, 20)])
+
+        # When
+        second = tracker.update(self.create_image(12, 11), [(12, 11, 20, 20)])
+
+        # Then
+        self.assertEqual([first[0].id], [track.id for track in second])
+        self.assertEqual((12, 11, 20, 20), second[0].box)
+
+    def test_update_new_id_for_distant_face(self):
+        # Given
+        tracker = FaceTracker()
+        first = tracker.update(self.create_image(10, 10), [(10, 10, 20, 20)])
+
+        # When
+        second = tracker.update(self.create_image(60, 60), [(60, 60, 20, 20)])
+
+        # Then
+        self.assertNotEqual(first[0].id, second[0].id)
+
+    def test_update_matches_each_track_once(self):
+        # Given
+        tracker = FaceTracker()
+        first = tracker.update(self.create_image(10, 10), [(10, 10, 20, 20)])
+
+        # When
+        second = tracker.update(self.create_image(10, 10), [(10, 10, 20, 20), (11, 10, 20, 20)])
+
+        # Then
+        self.assertEqual(first[0].id, second[0].id)
+        self.assertNotEqual(first[0].id, second[1].id)
+
+    def test_track_follows_face(self):
+        # Given
+        tracker = FaceTracker()
+        track_id = tracker.update(self.create_image(40, 40), [(40, 40, 20, 20)])[0].id
+
+        # When
+        found = tracker.track(self.create_image(45, 37))
+
+        # Then
+        self.assertEqual([track_id], [track.id for track in found])
+        self.assertEqual((45, 37, 20, 20), found[0].box)
+
+    def test_track_drops_lost_face(self):
+        # Given
+        tracker = FaceTracker(max_misses=2)
+        tracker.update(self.create_image(40, 40), [(40, 40, 20, 20)])
+        noise = self.random.randint(0, 256, (100, 100)).astype(np.uint8)
+
+        # When
+        found = [tracker.track(noise) for _ in range(3)]
+
+        # Then
+        self.assertEqual([[], [], []], found)
+        self.assertEqual([], tracker.tracks)
+
+    def test_track_keeps_face_after_short_loss(self):
+        # Given
+        tracker = FaceTracker(max_misses=2)
+        track_id = tracker.update(self.create_image(40, 40), [(40, 40, 20, 20)])[0].id
+        noise = self.random.randint(0, 256, (100, 100)).astype(np.uint8)
+        tracker.track(noise)
+
+        # When
+        found = tracker.track(self.create_image(40, 40))
+
+        # Then
+        self.assertEqual([track_id], [track.id for track in found])
+        self.assertEqual(0, found[0].misses)
+
+    def test_covers(self):
+        # Given
+        tracker = FaceTracker()
+        tracker.update(self.create_image(40, 40), [(40, 40, 20, 20)])
+
+        # Then
+        self.assertTrue(tracker.covers([(50, 50, 30, 30)]))
+        self.assertFalse(tracker.covers([(50, 50, 30, 30), (0, 0, 10, 10)]))
@@ -0,0 +1,121 @@
+import cv2
+import itertools
+
+
+class FaceTrack:
+	"""
+	A face followed between detections
+	"""
+	def __init__(self, track_id: int, box: tuple, template):
+		"""
+		Constructor
+		:param track_id: stable id of the face
+		:param box: (x, y, w, h)
+		:param template: grayscale image of the face
+		"""
+		self.id = track_id
+		self.box = box
+		self.template = template
+		self.misses = 0
+
+
+class FaceTracker:
+	"""
+	Cheap tracker for the frames between two full face detections: every face is
+	searched for by template matching in a small window around its last position.
+	Detections are associated with the existing tracks by overlap, so a face
+	keeps its id as long as it is seen.
+	"""
+	def __init__(self, search_margin: float=0.5, min_score: float=0.6,
+				min_overlap: float=0.3, max_misses: int=2):
+		"""
+		Constructor
+		:param search_margin: size of the search window around the last box (relative to the box size)
+		:param min_score: minimal normalized correlation of a match
+		:param min_overlap: minimal intersection over union for matching a detection with a track
+		:param max_misses: a track is dropped after this many frames without a match
+		"""
+		self.search_margin = search_margin
+		self.min_score = min_score
+		self.min_overlap = min_overlap
+		self.max_misses = max_misses
+		self.tracks = []
+		self.ids = itertools.count(1)
+
+	@staticmethod
+	def get_overlap(first: tuple, second: tuple):
+		"""
+		:param first: (x, y, w, h)
+		:param second: (x, y, w, h)
+		:return: intersection over union
+		"""
+		x1 = max(first[0], second[0])
+		y1 = max(first[1], second[1])
+		x2 = min(first[0] + first[2], second[0] + second[2])
+		y2 = min(first[1] + first[3], second[1] + second[3])
+		intersection = max(0, x2 - x1) * max(0, y2 - y1)
+		union = first[2] * first[3] + second[2] * second[3] - intersection
+		return intersection / union if union > 0 else 0.0
+
+	def update(self, img, faces: list):
+		"""
+		Replaces the tracks with the detected faces, reusing the ids of the overlapping tracks
+		:param img: grayscale image the faces were detected on
+		:param faces: list of (x, y, w, h)
+		:return: the current tracks
+		"""
+		tracks = []
+		unmatched = list(self.tracks)
+		for face in faces:
+			(x, y, w, h) = [int(v) for v in face]
+			box = (x, y, w, h)
+			best = max(unmatched, key=lambda track: FaceTracker.get_overlap(track.box, box), default=None)
+			if best is not None and FaceTracker.get_overlap(best.box, box) >= self.min_overlap:
+				unmatched.remove(best)
+				track_id = best.id
+			else:
+				track_id = next(self.ids)
+			tracks.append(FaceTrack(track_id, box, img[y:(y + h), x:(x + w)].copy()))
+
+		self.tracks = tracks
+		return self.tracks
+
+	def track(self, img):
+		"""
+		Moves every track to the best match in its search window
+		:param img: grayscale image
+		:return: the tracks that were found on the image
+		"""
+		height, width = img.shape[:2]
+		for track in self.tracks:
+			(x, y, w, h) = track.box
+			margin_x = int(w * self.search_margin)
+			margin_y = int(h * self.search_margin)
+			x1, y1 = max(0, x - margin_x), max(0, y - margin_y)
+			x2, y2 = min(width, x + w + margin_x), min(height, y + h + margin_y)
+
+			window = img[y1:y2, x1:x2]
+			if window.shape[0] < h or window.shape[1] < w:
+				track.misses += 1
+				continue
+
+			scores = cv2.matchTemplate(window, track.template, cv2.TM_CCOEFF_NORMED)
+			_, score, _, location = cv2.minMaxLoc(scores)
+			if score >= self.min_score:
+				track.box = (x1 + location[0], y1 + location[1], w, h)
+				track.misses = 0
+			else:
+				track.misses += 1
+
+		self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+		return [track for track in self.tracks if track.misses == 0]
+
+	def covers(self, regions: list):
+		"""
+		:param regions: list of (x, y, w, h), e.g. moving regions
+		:return: True if every region overlaps with a track
+		"""
+		for region in regions:
+			if not any(FaceTracker.get_overlap(track.box, region) > 0 for track in self.tracks):
+				return False
+		return True
@@ -1,16 +1,35 @@
 import logging
 import json
 import os
+import time
 import cv2
+import numpy as np
 from raspberry_sec.interface.producer import Type
 from raspberry_sec.interface.consumer import Consumer, ConsumerContext
+from raspberry_sec.system.recognitioncache import RecognitionCache
+from raspberry_sec.system.scheduler import ConsumerStats
 
 
 class FacerecognizerConsumer(Consumer):
 	"""
-	Consumer class for recognizing human face
+	Consumer class for recognizing human face.
+	The data can be a single face or a list of faces (see FacedetectorConsumer 'multi_face').
+	The Eigen and Fisher recognizers handle a list in one vectorized pass
+	(projection + nearest neighbour with numpy), LBPH predicts face by face.
+	The alert is only cleared if every face is recognized. Verdicts are cached
+	for 'cache_ttl' seconds per tracked face (see RecognitionCache).
+	The recognizers form an ensemble: they run in the order of their measured cost
+	and stop as soon as the verdict of a face cannot change anymore.
+	Policies ('policy' parameter):
+	- unanimous: the names identified must agree (default)
+	- quorum: at least 'min_votes' recognizers have to identify the same name
 	"""
 	LOGGER = logging.getLogger('FacerecognizerConsumer')
+	UNANIMOUS = 'unanimous'
+	QUORUM = 'quorum'
+	UNDECIDED = object()
+	ENABLED = {'FisherRecognizer': 'fisher_enabled', 'EigenRecognizer': 'eigen_enabled', 'LBPHRecognizer': 'lbph_enabled'}
+	STATS_INTERVAL = 100
 
 	def __init__(self, parameters: dict):
 		"""
@@ -23,6 +42,13 @@ class FacerecognizerConsumer(Consumer):
 		self.fisher_recognizer = None
 		self.lbph_recognizer = None
 		self.label_to_name = None
+		self.subspaces = dict()
+		self.cache = RecognitionCache(self.parameters.get('cache_ttl', 0))
+		self.policy = self.parameters.get('policy', FacerecognizerConsumer.UNANIMOUS)
+		self.min_votes = self.parameters.get('min_votes', 2)
+		self.stats = {name: ConsumerStats(0.1) for name in FacerecognizerConsumer.ENABLED}
+		self.votes = []
+		self.recognitions = 0
 
 	def get_name(self):
 		return 'FacerecognizerConsumer'
@@ -60,6 +86,11 @@ class FacerecognizerConsumer(Consumer):
 		self.fisher_recognizer.read(FacerecognizerConsumer.get_path(self.parameters['fisher_model']))
 		self.lbph_recognizer.read(FacerecognizerConsumer.get_path(self.parameters['lbph_model']))
 
+		self.subspaces = {
+			'EigenRecognizer': FacerecognizerConsumer.get_subspace(self.eigen_recognizer),
+			'FisherRecognizer': FacerecognizerConsumer.get_subspace(self.fisher_recognizer)
+		}
+
 		try:
 			label_map_path = FacerecognizerConsumer.get_path(self.parameters['label_map'])
 			with open(label_map_path) as label_file:
@@ -75,65 +106,198 @@ class FacerecognizerConsumer(Consumer):
 		if not self.initialized:
 			self.initialize()
 
-		# the data is expected to be the detected face
-		face = context.data
+		# the data is expected to be the detected face (or the list of them)
+		faces = context.data
 		context.alert = True
 
-		if face is not None:
-			face = cv2.resize(face, (self.parameters['size'], self.parameters['size']))
-			name = self.recognize(face)
-			if name is None:
+		if faces is not None and len(faces) > 0:
+			if isinstance(faces, np.ndarray):
+				faces = [faces]
+			keys = RecognitionCache.get_keys(context, faces)
+			verdicts = self.cache.lookup(
+				keys, lambda missing: [(name,) for name in self.recognize_batch(self.preprocess([faces[i] for i in missing]))])
+			names = [name for (name,) in verdicts]
+			if None in names:
 				context.alert_data = 'Cannot recognize face'
 			else:
 				context.alert = False
-				context.alert_data = name
+				context.alert_data = ', '.join(names)
 		else:
 			FacerecognizerConsumer.LOGGER.warning('Face was not provided (is None)')
 
 		return context
 
+	@staticmethod
+	def get_subspace(recognizer):
+		"""
+		Extracts the trained model of an Eigen or Fisher recognizer
+		:param recognizer: cv2.face.BasicFaceRecognizer
+		:return: (mean, eigenvectors, projections, labels, threshold) or None if not available
+		"""
+		try:
+			projections = recognizer.getProjections()
+			if len(projections) == 0:
+				return None
+			return (recognizer.getMean().reshape(1, -1).astype(np.float64),
+					recognizer.getEigenVectors().astype(np.float64),
+					np.vstack(projections).astype(np.float64),
+					recognizer.getLabels().reshape(-1),
+					recognizer.getThreshold())
+		except (AttributeError, cv2.error) as e:
+			FacerecognizerConsumer.LOGGER.warning('Cannot extract the model, falling back to predict: ' + str(e))
+			return None
+
+	@staticmethod
+	def predict_batch(subspace: tuple, faces: list):
+		"""
+		Same as BasicFaceRecognizer.predict but for many faces at once:
+		projects the faces into the subspace and finds the nearest training sample
+		:param subspace: see get_subspace
+		:param faces: list of equally sized grayscale images
+		:return: list of (label, distance) pairs (label is -1 if the distance is above the threshold)
+		"""
+		mean, eigenvectors, projections, labels, threshold = subspace
+		samples = np.vstack([face.reshape(1, -1) for face in faces]).astype(np.float64)
+		projected = (samples - mean).dot(eigenvectors)
+
+		# squared euclidean distances between every face and every training sample
+		distances = (np.sum(projected ** 2, axis=1)[:, np.newaxis]
+					+ np.sum(projections ** 2, axis=1)[np.newaxis, :]
+					- 2 * projected.dot(projections.T))
+		nearest = np.argmin(distances, axis=1)
+		results = []
+		for i, j in enumerate(nearest):
+			distance = np.sqrt(max(distances[i, j], 0.0))
+			results.append((int(labels[j]) if distance < threshold else -1, distance))
+		return results
+
+	def preprocess(self, faces: list):
+		"""
+		Prepares the faces once for all the recognizers
+		:param faces: detected faces
+		:return: resized (and optionally equalized) grayscale faces
+		"""
+		size = (self.parameters['size'], self.parameters['size'])
+		processed = []
+		for face in faces:
+			if face.ndim == 3:
+				face = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+			face = cv2.resize(face, size)
+			if self.parameters.get('equalize', False):
+				face = cv2.equalizeHist(face)
+			processed.append(face)
+		return processed
+
+	def get_plan(self):
+		"""
+		:return: the enabled recognizers ordered by their measured cost per face
+		(the ones that have not been measured yet come first)
+		"""
+		plan = [(name, recognizer) for name, recognizer in self.get_recognizers() if self.parameters[FacerecognizerConsumer.ENABLED[name]]]
+		return sorted(plan, key=lambda item: (self.stats[item[0]].calls > 0, self.stats[item[0]].latency))
+
+	def get_recognizers(self):
+		"""
+		:return: list of (name, recognizer) pairs in configured order
+		"""
+		return [
+			('FisherRecognizer', self.fisher_recognizer),
+			('EigenRecognizer', self.eigen_recognizer),
+			('LBPHRecognizer', self.lbph_recognizer)
+		]
+
+	def decide(self, votes: dict, remaining: int):
+		"""
+		:param votes: recognizer name - (name, confidence) pairs of the face
+		:param remaining: number of recognizers that have not voted yet
+		:return: name, None (not recognized) or UNDECIDED if the remaining votes can change the verdict
+		"""
+		names = [name for name, _ in votes.values() if name is not None]
+		if self.policy == FacerecognizerConsumer.UNANIMOUS:
+			# the identified names must agree, at least one recognizer has to identify the face
+			if len(set(names)) > 1:
+				return None
+			if remaining == 0:
+				return names[0] if names else None
+			return FacerecognizerConsumer.UNDECIDED
+
+		counts = {name: names.count(name) for name in names}
+		best = max(counts, key=counts.get) if counts else None
+		if best is not None and counts[best] >= self.min_votes:
+			return best
+		if (counts[best] if best else 0) + remaining < self.min_votes:
+			return None
+		return FacerecognizerConsumer.UNDECIDED
+
 	def recognize(self, face):
 		"""
 		This method decides if the face is among those that are to be recognized.
 		It uses 3 different recognition algorithms for this (Eigen, Fisher, LBPH).
 		Though any of these can be disabled by the configuration.
 		:param face: detected face
-		:return: name if the face was successfully identified by at least 1 of the recognizers or None
-		"""
-		FacerecognizerConsumer.LOGGER.info('Starting recognition')
-		# Get the recognition results
-		names = {
-			self.recognize_face(self.parameters['fisher_enabled'], 'FisherRecognizer', face, self.fisher_recognizer),
-			self.recognize_face(self.parameters['eigen_enabled'], 'EigenRecognizer', face, self.eigen_recognizer),
-			self.recognize_face(self.parameters['lbph_enabled'], 'LBPHRecognizer', face, self.lbph_recognizer)
-		}
+		:return: name if the face was successfully identified or None
+		"""
+		return self.recognize_batch(self.preprocess([face]))[0]
+
+	def recognize_batch(self, faces: list):
+		"""
+		Same as recognize, for a list of faces. The recognizers run in increasing cost order,
+		each of them only on the faces whose verdict can still change.
+		:param faces: preprocessed faces
+		:return: list of names (or None-s)
+		"""
+		FacerecognizerConsumer.LOGGER.info('Starting recognition of ' + str(len(faces)) + ' face(s)')
+		plan = self.get_plan()
+		self.votes = [dict() for _ in faces]
+		verdicts = [FacerecognizerConsumer.UNDECIDED for _ in faces]
 
-		# Filter out None-s
-		names = {name for name in names if name is not None}
+		for position, (name, recognizer) in enumerate(plan):
+			pending = [i for i, verdict in enumerate(verdicts) if verdict is FacerecognizerConsumer.UNDECIDED]
+			if not pending:
+				break
 
-		# If there is only one name in the set, the result is unambiguous
-		if len(names) == 1:
-			return names.pop()
-		else:
-			return None
+			start = time.perf_counter()
+			predictions = self.recognize_faces(name, [faces[i] for i in pending], recognizer)
+			self.stats[name].update((time.perf_counter() - start) / len(pending), any(p[0] is not None for p in predictions))
+
+			for i, prediction in zip(pending, predictions):
+				self.votes[i][name] = prediction
+				verdicts[i] = self.decide(self.votes[i], len(plan) - position - 1)
+
+		self.recognitions += 1
+		if self.recognitions % FacerecognizerConsumer.STATS_INTERVAL == 0:
+			FacerecognizerConsumer.LOGGER.debug('Recognizer stats: ' + str(self.get_stats()))
 
-	def recognize_face(self, enabled: bool, name: str, face, recognizer):
+		return [None if verdict is FacerecognizerConsumer.UNDECIDED else verdict for verdict in verdicts]
+
+	def recognize_faces(self, name: str, faces: list, recognizer):
 		"""
 		Conducts face recognition
-		:param enabled: if False, None is returned
 		:param name: of the technique used for recognition
-		:param face: numpy object
+		:param faces: list of numpy objects
 		:param recognizer: method object
-		:return: name of the recognized person, or None
+		:return: list of (name of the recognized person or None, confidence) pairs
 		"""
-		if enabled:
-			label, c = recognizer.predict(face)
-			if self.label_to_name.__contains__(label):
-				recognized = self.label_to_name[label]
+		subspace = self.subspaces.get(name)
+		if subspace is not None:
+			predictions = FacerecognizerConsumer.predict_batch(subspace, faces)
+		else:
+			predictions = [recognizer.predict(face) for face in faces]
+
+		results = []
+		for label, c in predictions:
+			recognized = self.label_to_name.get(label)
+			if recognized is not None:
 				FacerecognizerConsumer.LOGGER.info(name + ' identified ' + recognized + ' with ' + str(c))
-				return recognized
+			results.append((recognized, c))
+		return results
 
-		return None
+	def get_stats(self):
+		"""
+		:return: recognizer name - measured cost per face (ms) and identification rate pairs
+		"""
+		return {name: {'latency_ms': round(1000 * stats.latency, 3), 'identified': round(stats.pass_rate, 2), 'calls': stats.calls}
+				for name, stats in self.stats.items()}
 
 	def get_type(self):
 		return Type.CAMERA
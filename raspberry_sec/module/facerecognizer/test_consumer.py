@@ -0,0 +1,108 @@
+import unittest
+from raspberry_sec.module.facerecognizer.consumer import FacerecognizerConsumer
+
+
+class TestFacerecognizerConsumerMethods(unittest.TestCase):
+
+    def test_decide_unanimous_agreement(self):
+        # Given
+        consumer = FacerecognizerConsumer({'policy': FacerecognizerConsumer.UNANIMOUS})
+        votes = {'EigenRecognizer': ('Alice', 10.0), 'FisherRecognizer': ('Alice', 20.0)}
+
+        # When
+        verdict = consumer.decide(votes, remaining=0)
+
+        # Then
+        self.assertEqual('Alice', verdict)
+
+    def test_decide_unanimous_disagreement(self):
+        # Given
+        consumer = FacerecognizerConsumer({'policy': FacerecognizerConsumer.UNANIMOUS})
+        votes = {'EigenRecognizer': ('Alice', 10.0), 'FisherRecognizer': ('Bob', 20.0)}
+
+        # When
+        verdict = consumer.decide(votes, remaining=1)
+
+        # Then
+        self.assertIsNone(verdict)
+
+    def test_decide_unanimous_waits_for_remaining(self):
+        # Given
+        consumer = FacerecognizerConsumer({'policy': FacerecognizerConsumer.UNANIMOUS})
+        votes = {'EigenRecognizer': ('Alice', 10.0)}
+
+        # When
+        verdict = consumer.decide(votes, remaining=2)
+
+        # Then
+        self.assertIs(FacerecognizerConsumer.UNDECIDED, verdict)
+
+    def test_decide_unanimous_nobody_identified(self):
+        # Given
+        consumer = FacerecognizerConsumer({'policy': FacerecognizerConsumer.UNANIMOUS})
+        votes = {'EigenRecognizer': (None, 0.0), 'FisherRecognizer': (None, 0.0)}
+
+        # When
+        verdict = consumer.decide(votes, remaining=0)
+
+        # Then
+        self.assertIsNone(verdict)
+
+    def test_decide_quorum_reached(self):
+        # Given
+        consumer = FacerecognizerConsumer({'policy': FacerecognizerConsumer.QUORUM, 'min_votes': 2})
+        votes = {'EigenRecognizer': ('Alice', 10.0), 'FisherRecognizer': ('Alice', 20.0)}
+
+        # When
+        verdict = consumer.decide(votes, remaining=1)
+
+        # Then
+        self.assertEqual('Alice', verdict)
+
+    def test_decide_quorum_ignores_dissent(self):
+        # Given
+        consumer = FacerecognizerConsumer({'policy': FacerecognizerConsumer.QUORUM, 'min_votes': 2})
+        votes = {
+            'EigenRecognizer': ('Alice', 10.0),
+            'FisherRecognizer': ('Bob', 20.0),
+            'LBPHRecognizer': ('Alice', 30.0)
+        }
+
+        # When
+        verdict = consumer.decide(votes, remaining=0)
+
+        # Then
+        self.assertEqual('Alice', verdict)
+
+    def test_decide_quorum_still_reachable(self):
+        # Given
+        consumer = FacerecognizerConsumer({'policy': FacerecognizerConsumer.QUORUM, 'min_votes': 2})
+        votes = {'EigenRecognizer': ('Alice', 10.0)}
+
+        # When
+        verdict = consumer.decide(votes, remaining=1)
+
+        # Then
+        self.assertIs(FacerecognizerConsumer.UNDECIDED, verdict)
+
+    def test_decide_quorum_unreachable(self):
+        # Given
+        consumer = FacerecognizerConsumer({'policy': FacerecognizerConsumer.QUORUM, 'min_votes': 2})
+        votes = {'EigenRecognizer': ('Alice', 10.0), 'FisherRecognizer': (None, 0.0)}
+
+        # When
+        verdict = consumer.decide(votes, remaining=0)
+
+        # Then
+        self.assertIsNone(verdict)
+
+    def test_decide_quorum_no_votes_unreachable(self):
+        # Given
+        consumer = FacerecognizerConsumer({'policy': FacerecognizerConsumer.QUORUM, 'min_votes': 3})
+        votes = {'EigenRecognizer': (None, 0.0)}
+
+        # When
+        verdict = consumer.decide(votes, remaining=1)
+
+        # Then
+        self.assertIsNone(verdict)
@@ -1,15 +1,28 @@
 import logging
 import time
 import cv2
+import numpy as np
 from raspberry_sec.interface.producer import Type
 from raspberry_sec.interface.consumer import Consumer, ConsumerContext
+from raspberry_sec.system.framecache import FrameCache
 
 
 class MotiondetectorConsumer(Consumer):
 	"""
-	Consumer class for detecting motion
+	Consumer class for detecting motion.
+	Modes (parameter 'mode'):
+	- frame_diff: compares the frame to the previous one (default)
+	- running_average: compares the frame to a background model updated in place
+	with cv2.accumulateWeighted (parameter 'learning_rate')
+	If 'early_reject_scale' is set (running_average mode), a background model of a
+	frame downscaled by that factor decides first, and the full resolution pipeline
+	only runs if at least 'early_reject_pixels' pixels changed there.
+	The bounding boxes of the moving regions are stored in context.regions
+	(in the coordinates of the original frame).
 	"""
 	LOGGER = logging.getLogger('MotiondetectorConsumer')
+	FRAME_DIFF = 'frame_diff'
+	RUNNING_AVERAGE = 'running_average'
 
 	def __init__(self, parameters: dict):
 		"""
@@ -17,11 +30,100 @@ class MotiondetectorConsumer(Consumer):
 		:param parameters: see Consumer constructor
 		"""
 		super().__init__(parameters)
+		self.mode = self.parameters.get('mode', MotiondetectorConsumer.FRAME_DIFF)
+		self.blur_size = self.parameters.get('blur_size', 21)
+		self.learning_rate = self.parameters.get('learning_rate', 0.05)
+		self.early_reject_scale = self.parameters.get('early_reject_scale', 0)
+		self.early_reject_pixels = self.parameters.get('early_reject_pixels', 1)
 		self.previous_frame = None
+		# running average state and preallocated buffers
+		self.background = None
+		self.small_background = None
+		self.skipped = 0
+		self.buffers = dict()
 
 	def get_name(self):
 		return 'MotiondetectorConsumer'
 
+	def get_buffer(self, name: str, like: np.ndarray):
+		"""
+		:param name: of the buffer
+		:param like: image with the expected shape and type
+		:return: buffer reused across frames
+		"""
+		buffer = self.buffers.get(name)
+		if buffer is None or buffer.shape != like.shape or buffer.dtype != like.dtype:
+			buffer = np.empty_like(like)
+			self.buffers[name] = buffer
+		return buffer
+
+	def threshold(self, delta: np.ndarray, name: str):
+		"""
+		Thresholds the difference image into a preallocated buffer
+		:param delta: absolute difference image
+		:param name: name of the buffer
+		:return: binary image
+		"""
+		thresh = self.get_buffer(name, delta)
+		cv2.threshold(src=delta,
+					thresh=self.parameters['threshold'],
+					maxval=self.parameters['threshold_max_val'],
+					type=cv2.THRESH_BINARY,
+					dst=thresh)
+		return thresh
+
+	def early_reject(self, context: ConsumerContext, size: tuple):
+		"""
+		Checks the downscaled background model
+		:param context: ConsumerContext
+		:param size: processing resolution
+		:return: True if there is certainly no motion on the frame
+		"""
+		small_size = (size[0] // self.early_reject_scale, size[1] // self.early_reject_scale)
+		small = FrameCache.get(context, small_size, gray=True)
+		if self.small_background is None:
+			self.small_background = small.astype(np.float32)
+			return False
+
+		background = self.get_buffer('small_background', small)
+		cv2.convertScaleAbs(self.small_background, dst=background)
+		delta = self.get_buffer('small_delta', small)
+		cv2.absdiff(small, background, dst=delta)
+		cv2.accumulateWeighted(small, self.small_background, self.learning_rate)
+
+		return cv2.countNonZero(self.threshold(delta, 'small_thresh')) < self.early_reject_pixels
+
+	def compute_delta(self, gray: np.ndarray):
+		"""
+		Compares the frame to the reference (previous frame or background model)
+		:param gray: blurred grayscale frame
+		:return: absolute difference image or None if there is no reference yet
+		"""
+		if self.mode == MotiondetectorConsumer.RUNNING_AVERAGE:
+			if self.background is None:
+				self.background = gray.astype(np.float32)
+				return None
+
+			background = self.get_buffer('background', gray)
+			cv2.convertScaleAbs(self.background, dst=background)
+			delta = self.get_buffer('delta', gray)
+			cv2.absdiff(gray, background, dst=delta)
+
+			# catching up with the frames skipped by the early reject (static scene)
+			alpha = 1 - (1 - self.learning_rate) ** (self.skipped + 1)
+			cv2.accumulateWeighted(gray, self.background, alpha)
+			self.skipped = 0
+			return delta
+		else:
+			previous_frame = self.previous_frame
+			self.previous_frame = gray
+			if previous_frame is None:
+				return None
+
+			delta = self.get_buffer('delta', gray)
+			cv2.absdiff(previous_frame, gray, dst=delta)
+			return delta
+
 	def run(self, context: ConsumerContext):
 		img = context.data
 		context.alert = False
@@ -31,37 +133,52 @@ class MotiondetectorConsumer(Consumer):
 			time.sleep(self.parameters['timeout'])
 			return context
 
-		frame = cv2.resize(img, (self.parameters['resize_width'], self.parameters['resize_height']))
-		gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-		gray = cv2.GaussianBlur(gray, (21, 21), 0)
+		size = (self.parameters['resize_width'], self.parameters['resize_height'])
 
-		# if the first frame is None, initialize it
-		if self.previous_frame is None:
-			self.previous_frame = gray
+		if self.mode == MotiondetectorConsumer.RUNNING_AVERAGE and self.early_reject_scale \
+				and self.background is not None and self.early_reject(context, size):
+			MotiondetectorConsumer.LOGGER.debug('No motion was detected (early reject)')
+			self.skipped += 1
+			context.regions = []
 			return context
 
-		# compute the absolute difference between the current frame and previous frame
-		frame_delta = cv2.absdiff(self.previous_frame, gray)
-		(_, thresh) = cv2.threshold(src=frame_delta,
-									thresh=self.parameters['threshold'],
-									maxval=self.parameters['threshold_max_val'],
-									type=cv2.THRESH_BINARY)
+		gray = FrameCache.get(context, size, gray=True, blur=self.blur_size)
+
+		# if there is no reference frame yet, initialize it
+		frame_delta = self.compute_delta(gray)
+		if frame_delta is None:
+			return context
 
 		# dilate the image to fill in holes, then find contours on image
-		thresh = cv2.dilate(thresh, None, iterations=self.parameters['dilate_iteration'])
-		(_, contours, _) = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+		# (the buffer is overwritten by findContours, but it is not needed afterwards)
+		thresh = self.threshold(frame_delta, 'thresh')
+		cv2.dilate(thresh, None, dst=thresh, iterations=self.parameters['dilate_iteration'])
+		(_, contours, _) = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-		# loop over the contours
-		motion_detected = any([True for c in contours if cv2.contourArea(c) > self.parameters['area_threshold']])
-		if motion_detected:
+		# bounding boxes of the big enough contours, scaled back to the original frame
+		scale_x = img.shape[1] / size[0]
+		scale_y = img.shape[0] / size[1]
+		regions = []
+		for c in contours:
+			if cv2.contourArea(c) > self.parameters['area_threshold']:
+				(x, y, w, h) = cv2.boundingRect(c)
+				regions.append((int(x * scale_x), int(y * scale_y), int(w * scale_x), int(h * scale_y)))
+
+		context.regions = regions
+		if regions:
 			context.alert = True
 			context.alert_data = 'Motion detected'
 			MotiondetectorConsumer.LOGGER.debug(context.alert_data)
 		else:
 			MotiondetectorConsumer.LOGGER.debug('No motion was detected')
 
-		self.previous_frame = gray
 		return context
 
 	def get_type(self):
 		return Type.CAMERA
+
+	def is_gate(self):
+		return True
+
+	def get_outputs(self):
+		return {'regions'}
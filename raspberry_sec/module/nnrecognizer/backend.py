@@ -0,0 +1,201 @@
+import logging
+import numpy as np
+
+
+class InferenceBackend:
+	"""
+	Base class of the runtimes the face recognition model can run on.
+	The runtimes are imported lazily, only the configured one has to be installed.
+	"""
+	LOGGER = logging.getLogger('InferenceBackend')
+	# True if the Keras model can be converted into the format of the backend (see export)
+	EXPORTABLE = False
+
+	@staticmethod
+	def get_class(name: str):
+		"""
+		:param name: keras, tflite or onnx
+		:return: the InferenceBackend class (nothing is imported)
+		"""
+		backends = {'keras': KerasBackend, 'tflite': TFLiteBackend, 'onnx': OnnxBackend}
+		if name not in backends:
+			raise ValueError('Unknown inference backend: ' + name + ' (available: ' + ', '.join(sorted(backends)) + ')')
+		return backends[name]
+
+	@staticmethod
+	def create(name: str):
+		"""
+		:param name: keras, tflite or onnx
+		:return: new InferenceBackend instance
+		"""
+		return InferenceBackend.get_class(name)()
+
+	@staticmethod
+	def export(keras_path: str, output_path: str, quantization: str=None, samples: np.ndarray=None):
+		"""
+		Converts the Keras model into the format of the backend
+		:param keras_path: path of the Keras model
+		:param output_path: path of the converted model
+		:param quantization: None or the name of the quantization (depends on the backend)
+		:param samples: representative inputs for the calibration (if the quantization needs them)
+		"""
+		pass
+
+	def load(self, path: str):
+		"""
+		Loads the model
+		:param path: path of the model file
+		"""
+		pass
+
+	def predict(self, batch: np.ndarray):
+		"""
+		:param batch: normalized input tensor (n x size x size x 1, float32)
+		:return: class probabilities (n x classes)
+		"""
+		pass
+
+
+class KerasBackend(InferenceBackend):
+	"""
+	The trained Keras model itself (e.g. resources/model.h5py)
+	"""
+	def __init__(self):
+		self.model = None
+
+	def load(self, path: str):
+		from keras.models import load_model
+		self.model = load_model(path)
+
+	def predict(self, batch: np.ndarray):
+		return self.model.predict(batch, batch_size=len(batch))
+
+	@staticmethod
+	def export(keras_path: str, output_path: str, quantization: str=None, samples: np.ndarray=None):
+		raise ValueError('The Keras model is used as it is, it cannot be exported to the keras backend')
+
+
+class TFLiteBackend(InferenceBackend):
+	"""
+	TensorFlow Lite flatbuffer (see export), runs with tflite_runtime if it is
+	installed (that is much lighter than TensorFlow), otherwise with tf.lite
+	"""
+	EXPORTABLE = True
+
+	def __init__(self):
+		self.interpreter = None
+		self.input = None
+		self.output = None
+		self.batch_size = 0
+
+	def load(self, path: str):
+		try:
+			from tflite_runtime.interpreter import Interpreter
+		except ImportError:
+			from tensorflow.lite import Interpreter
+		self.interpreter = Interpreter(model_path=path)
+		self.interpreter.allocate_tensors()
+		self.input = self.interpreter.get_input_details()[0]
+		self.output = self.interpreter.get_output_details()[0]
+		self.batch_size = self.input['shape'][0]
+
+	def predict(self, batch: np.ndarray):
+		if len(batch) != self.batch_size:
+			self.interpreter.resize_tensor_input(self.input['index'], list(batch.shape))
+			self.interpreter.allocate_tensors()
+			self.output = self.interpreter.get_output_details()[0]
+			self.batch_size = len(batch)
+
+		self.interpreter.set_tensor(self.input['index'], TFLiteBackend.quantize(batch, self.input))
+		self.interpreter.invoke()
+		return TFLiteBackend.dequantize(self.interpreter.get_tensor(self.output['index']), self.output)
+
+	@staticmethod
+	def quantize(batch: np.ndarray, details: dict):
+		"""
+		Fully quantized models take integers: q = round(x / scale + zero_point)
+		:param batch: float input
+		:param details: input details of the interpreter (dtype, quantization)
+		:return: the input in the dtype of the model
+		"""
+		scale, zero_point = details['quantization']
+		if details['dtype'] != np.float32 and scale:
+			info = np.iinfo(details['dtype'])
+			return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(details['dtype'])
+		return batch
+
+	@staticmethod
+	def dequantize(output: np.ndarray, details: dict):
+		"""
+		Fully quantized models return integers: x = (q - zero_point) * scale
+		:param output: output of the model
+		:param details: output details of the interpreter (dtype, quantization)
+		:return: float output
+		"""
+		scale, zero_point = details['quantization']
+		if details['dtype'] != np.float32 and scale:
+			return (output.astype(np.float32) - zero_point) * scale
+		return output
+
+	@staticmethod
+	def export(keras_path: str, output_path: str, quantization: str=None, samples: np.ndarray=None):
+		"""
+		Converts the Keras model (needs TensorFlow with the TFLite converter)
+		:param keras_path: path of the Keras model
+		:param output_path: path of the flatbuffer
+		:param quantization: None, 'float16' or 'int8' (post-training quantization)
+		:param samples: representative inputs for the int8 calibration
+		"""
+		import tensorflow as tf
+		from keras.models import load_model
+		converter = tf.lite.TFLiteConverter.from_keras_model(load_model(keras_path))
+		if quantization:
+			converter.optimizations = [tf.lite.Optimize.DEFAULT]
+		if quantization == 'float16':
+			converter.target_spec.supported_types = [tf.float16]
+		elif quantization == 'int8':
+			if samples is None:
+				raise ValueError('int8 quantization needs representative samples')
+			converter.representative_dataset = lambda: ([sample[np.newaxis].astype(np.float32)] for sample in samples)
+			converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+		with open(output_path, 'wb') as file:
+			file.write(converter.convert())
+
+
+class OnnxBackend(InferenceBackend):
+	"""
+	ONNX model (see export) running on ONNX Runtime
+	"""
+	EXPORTABLE = True
+
+	def __init__(self):
+		self.session = None
+		self.input_name = None
+
+	def load(self, path: str):
+		import onnxruntime
+		self.session = onnxruntime.InferenceSession(path)
+		self.input_name = self.session.get_inputs()[0].name
+
+	def predict(self, batch: np.ndarray):
+		return self.session.run(None, {self.input_name: batch.astype(np.float32)})[0]
+
+	@staticmethod
+	def export(keras_path: str, output_path: str, quantization: str=None, samples: np.ndarray=None):
+		"""
+		Converts the Keras model (needs tf2onnx)
+		:param keras_path: path of the Keras model
+		:param output_path: path of the ONNX model
+		:param quantization: None or 'int8' (dynamic quantization of the weights with onnxruntime)
+		:param samples: not used
+		"""
+		import tf2onnx
+		from keras.models import load_model
+		tf2onnx.convert.from_keras(load_model(keras_path), output_path=output_path)
+		if quantization == 'int8':
+			from onnxruntime.quantization import quantize_dynamic, QuantType
+			quantize_dynamic(output_path, output_path, weight_type=QuantType.QInt8)
+		elif quantization:
+			raise ValueError('Unsupported ONNX quantization: ' + quantization)
+
@@ -1,14 +1,24 @@
 import logging
 import os, base64
 import cv2, numpy as np
-from keras.models import load_model
 from raspberry_sec.interface.producer import Type
 from raspberry_sec.interface.consumer import Consumer, ConsumerContext
+from raspberry_sec.system.recognitioncache import RecognitionCache
+from raspberry_sec.module.nnrecognizer.backend import InferenceBackend
+from raspberry_sec.module.nnrecognizer.service import InferenceService
 
 
 class NnrecognizerConsumer(Consumer):
 	"""
-	Consumer class for recognizing human face with a neural network
+	Consumer class for recognizing human face with a neural network.
+	The data can be a single face or a list of faces (see FacedetectorConsumer 'multi_face'),
+	a list is recognized with one batched prediction. The alert is only cleared
+	if every face is recognized. Verdicts (and the encoded images of the unknown faces)
+	are cached for 'cache_ttl' seconds per tracked face (see RecognitionCache).
+	With 'inference_service' enabled the model runs in a separate process
+	shared by the streams (see InferenceService).
+	The model runs on the runtime selected by 'backend': keras (default), tflite or onnx
+	(the latter two need a model exported by the training module, see test.py --export).
 	"""
 	LOGGER = logging.getLogger('NnrecognizerConsumer')
 
@@ -21,6 +31,9 @@ class NnrecognizerConsumer(Consumer):
 		self.model = None
 		self.size = self.parameters['size']
 		self.initialized = False
+		self.cache = RecognitionCache(self.parameters.get('cache_ttl', 0))
+		self.backend = self.parameters.get('backend', 'keras')
+		self.service = None
 
 	def get_name(self):
 		return 'NnrecognizerConsumer'
@@ -49,17 +62,41 @@ class NnrecognizerConsumer(Consumer):
 		final_format = b64_encoded.decode('utf-8')
 		return '<img class="img-responsive center-block" src="data:image/png;base64,' + final_format + '">'
 
+	@staticmethod
+	def load_network(model: str, size: int, backend: str='keras'):
+		"""
+		Loads the model and runs a prediction on a dummy input,
+		so that building the graph is not paid by the first face
+		:param model: e.g. resources/model.h5py
+		:param size: width and height of the input images
+		:param backend: name of the InferenceBackend
+		:return: InferenceBackend holding the model
+		"""
+		network = InferenceBackend.create(backend)
+		network.load(NnrecognizerConsumer.get_path(model))
+		network.predict(np.zeros((1, size, size, 1), dtype='float32'))
+		NnrecognizerConsumer.LOGGER.info('Loaded network model (' + backend + ')')
+		return network
+
+	def get_services(self):
+		"""
+		:return: the InferenceService of the model if it is enabled
+		"""
+		if self.parameters.get('inference_service', False):
+			self.service = InferenceService.get_instance(self.parameters['model'], self.size, self.backend)
+			return [self.service]
+		return []
+
 	def initialize(self):
 		"""
 		Initializes component
 		"""
 		NnrecognizerConsumer.LOGGER.info('Initializing component')
-		try:
-			model_path = NnrecognizerConsumer.get_path(self.parameters['model'])
-			self.model = load_model(model_path)
-			NnrecognizerConsumer.LOGGER.info('Loaded network model')
-		except Exception as e:
-			NnrecognizerConsumer.LOGGER.error('Cannot load model: ' + str(e))
+		if self.service is None:
+			try:
+				self.model = NnrecognizerConsumer.load_network(self.parameters['model'], self.size, self.backend)
+			except Exception as e:
+				NnrecognizerConsumer.LOGGER.error('Cannot load model: ' + str(e))
 
 		self.initialized = True
 
@@ -67,18 +104,23 @@ class NnrecognizerConsumer(Consumer):
 		if not self.initialized:
 			self.initialize()
 
-		# the data is expected to be the detected face
-		face = context.data
+		# the data is expected to be the detected face (or the list of them)
+		faces = context.data
 		context.alert = True
 
-		if face is not None:
-			NnrecognizerConsumer.LOGGER.info('Running face recognition...')
-			if self.recognize(face):
+		if faces is not None and len(faces) > 0:
+			if isinstance(faces, np.ndarray):
+				faces = [faces]
+			NnrecognizerConsumer.LOGGER.info('Running face recognition on ' + str(len(faces)) + ' face(s)...')
+			keys = RecognitionCache.get_keys(context, faces)
+			results = self.cache.lookup(keys, lambda missing: self.get_verdicts([faces[i] for i in missing]))
+			unknown = [image for recognized, image in results if not recognized]
+			if not unknown:
 				context.alert = False
 				context.alert_data = 'Positive recognition'
 				NnrecognizerConsumer.LOGGER.info(context.alert_data)
 			else:
-				context.alert_data = NnrecognizerConsumer.img_to_str(face)
+				context.alert_data = ''.join(unknown)
 				NnrecognizerConsumer.LOGGER.info('Negative recognition')
 		else:
 			NnrecognizerConsumer.LOGGER.warning('Face was not provided (is None)')
@@ -86,22 +128,38 @@ class NnrecognizerConsumer(Consumer):
 
 		return context
 
+	def get_verdicts(self, faces: list):
+		"""
+		:param faces: detected faces
+		:return: list of (recognized, encoded image of the unknown face or None) pairs
+		"""
+		return [(recognized, None if recognized else NnrecognizerConsumer.img_to_str(face))
+				for face, recognized in zip(faces, self.recognize_batch(faces))]
+
 	def recognize(self, face: np.ndarray):
 		"""
 		Runs the face through the neural network
 		:param face: detected face
-		:return:
+		:return: True if the face was recognized
 		"""
-		# Resize
-		face = cv2.resize(face, (self.size, self.size))
+		return self.recognize_batch([face])[0]
 
-		# Normalize image
-		face = np.asarray([face]).reshape(-1, self.size, self.size, 1).astype('float32') / 255
+	def recognize_batch(self, faces: list):
+		"""
+		Runs the faces through the neural network in one batch
+		:param faces: detected faces
+		:return: list of True/False values (True if the face was recognized)
+		"""
+		# Resize and normalize the images into one tensor
+		batch = np.empty((len(faces), self.size, self.size, 1), dtype='float32')
+		for i, face in enumerate(faces):
+			batch[i, :, :, 0] = cv2.resize(face, (self.size, self.size))
+		batch /= 255
 
 		# Run it through the network
-		prediction = self.model.predict(face)
-		prediction = np.argmax(np.round(prediction), axis=1)
-		if prediction[0] == 1:
-			return True
+		if self.service is not None:
+			prediction = self.service.predict(batch)
 		else:
-			return False
+			prediction = self.model.predict(batch)
+			prediction = np.argmax(np.round(prediction), axis=1)
+		return [label == 1 for label in prediction]
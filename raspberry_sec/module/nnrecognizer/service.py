@@ -0,0 +1,248 @@
+import ctypes
+import logging
+import time
+import numpy as np
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray
+from raspberry_sec.system.util import ProcessContext, ProcessReady
+
+
+class InferenceService(ProcessReady):
+	"""
+	Runs the face recognition model in a dedicated process, so it is loaded only once
+	and it is shared by every stream using the same model.
+	Requests travel in shared memory: every request slot holds a batch of faces,
+	the worker collects all the pending slots and runs them through the model in one
+	prediction. Latency and throughput statistics are kept in shared memory as well.
+	Nobody is notified, both sides poll the slot states: a process killed while
+	waiting can never block the others, and the slots it left behind are reclaimed.
+	"""
+	LOGGER = logging.getLogger('InferenceService')
+	# slot states
+	FREE = 0
+	CLAIMED = 1
+	PENDING = 2
+	DONE = 3
+	# stats indexes
+	REQUESTS = 0
+	FACES = 1
+	LATENCY = 2
+	BUSY = 3
+	STATS_INTERVAL = 100
+	TIMEOUT = 10
+	POLL_INTERVAL = 0.005
+	# seconds between two checks of the stop event (while idle)
+	STOP_CHECK_INTERVAL = 1
+	# slots not freed by their clients (e.g. killed) are reclaimed after this
+	ABANDON_TIMEOUT = 3 * TIMEOUT
+
+	INSTANCES = dict()
+
+	def __init__(self, model: str, size: int, backend: str='keras', slots: int=4, max_batch: int=8):
+		"""
+		Constructor
+		:param model: path of the model
+		:param size: width and height of the input images
+		:param backend: name of the InferenceBackend
+		:param slots: number of request slots (requests in flight)
+		:param max_batch: maximum number of faces in a request
+		"""
+		self.model_path = model
+		self.size = size
+		self.backend = backend
+		self.slots = slots
+		self.max_batch = max_batch
+		self.inputs = RawArray(ctypes.c_float, slots * max_batch * size * size)
+		self.outputs = RawArray(ctypes.c_int, slots * max_batch)
+		self.counts = RawArray(ctypes.c_int, slots)
+		self.states = RawArray(ctypes.c_int, slots)
+		# incremented when a slot is claimed, so late results of abandoned requests are dropped
+		self.tickets = RawArray(ctypes.c_ulonglong, slots)
+		self.submitted = RawArray(ctypes.c_double, slots)
+		self.stats = RawArray(ctypes.c_double, 4)
+		# guards the slot states (it is never held while waiting)
+		self.lock = Lock()
+
+	@staticmethod
+	def get_instance(model: str, size: int, backend: str='keras'):
+		"""
+		:param model: path of the model
+		:param size: width and height of the input images
+		:param backend: name of the InferenceBackend
+		:return: the service of the model (created if it does not exist yet)
+		"""
+		key = (model, size, backend)
+		if key not in InferenceService.INSTANCES:
+			InferenceService.INSTANCES[key] = InferenceService(model, size, backend)
+		return InferenceService.INSTANCES[key]
+
+	def get_name(self):
+		"""
+		:return: name of the service
+		"""
+		return 'InferenceService(' + self.model_path + ')'
+
+	def get_inputs(self, slot: int):
+		"""
+		:param slot: index of the request slot
+		:return: numpy view of the input tensor of the slot
+		"""
+		batch = self.size * self.size * self.max_batch
+		view = np.frombuffer(self.inputs, dtype=np.float32, count=batch, offset=slot * batch * 4)
+		return view.reshape(self.max_batch, self.size, self.size, 1)
+
+	@staticmethod
+	def wait_until(predicate, timeout: float):
+		"""
+		Polls the predicate until it is True
+		:param predicate: function without arguments
+		:param timeout: in seconds
+		:return: True if the predicate became True in time
+		"""
+		deadline = time.monotonic() + timeout
+		while not predicate():
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				return False
+			time.sleep(min(InferenceService.POLL_INTERVAL, remaining))
+		return True
+
+	def claim_slot(self, deadline: float):
+		"""
+		:param deadline: (monotonic) time to give up at
+		:return: index and ticket of the claimed slot
+		:raises TimeoutError: if no slot became free in time
+		"""
+		while InferenceService.wait_until(lambda: InferenceService.FREE in self.states[:],
+										max(0.0, deadline - time.monotonic())):
+			with self.lock:
+				if InferenceService.FREE in self.states[:]:
+					slot = self.states[:].index(InferenceService.FREE)
+					self.states[slot] = InferenceService.CLAIMED
+					self.tickets[slot] += 1
+					self.submitted[slot] = time.monotonic()
+					return slot, self.tickets[slot]
+		raise TimeoutError('No free request slot in ' + self.get_name())
+
+	def reclaim_slots(self, now: float):
+		"""
+		Frees the slots abandoned by their clients, the caller must hold the lock
+		:param now: current (monotonic) time
+		"""
+		for slot in range(self.slots):
+			if self.states[slot] != InferenceService.FREE and now - self.submitted[slot] > InferenceService.ABANDON_TIMEOUT:
+				InferenceService.LOGGER.warning('Reclaiming abandoned request slot ' + str(slot))
+				self.states[slot] = InferenceService.FREE
+				self.tickets[slot] += 1
+
+	def predict(self, batch: np.ndarray, timeout: float=TIMEOUT):
+		"""
+		Client side: runs the batch through the model of the service process
+		:param batch: normalized input tensor (n x size x size x 1)
+		:param timeout: seconds to wait for the result
+		:return: predicted labels
+		"""
+		labels = []
+		for start in range(0, len(batch), self.max_batch):
+			labels.extend(self.predict_chunk(batch[start:start + self.max_batch], timeout))
+		return np.array(labels)
+
+	def predict_chunk(self, batch: np.ndarray, timeout: float):
+		"""
+		:param batch: at most max_batch faces
+		:param timeout: seconds to wait for a slot and for the result
+		:return: predicted labels
+		"""
+		deadline = time.monotonic() + timeout
+		slot, ticket = self.claim_slot(deadline)
+
+		try:
+			# only the owner of the slot touches its buffers until it is submitted
+			self.get_inputs(slot)[:len(batch)] = batch
+			self.counts[slot] = len(batch)
+			with self.lock:
+				self.submitted[slot] = time.monotonic()
+				self.states[slot] = InferenceService.PENDING
+			done = InferenceService.wait_until(
+				lambda: self.states[slot] == InferenceService.DONE and self.tickets[slot] == ticket,
+				max(0.0, deadline - time.monotonic()))
+			if not done:
+				raise TimeoutError('No response from ' + self.get_name())
+			labels = list(self.outputs[slot * self.max_batch:slot * self.max_batch + len(batch)])
+			if -1 in labels:
+				raise RuntimeError('Prediction failed in ' + self.get_name())
+			return labels
+		finally:
+			with self.lock:
+				# the slot could have been reclaimed meanwhile
+				if self.tickets[slot] == ticket:
+					self.states[slot] = InferenceService.FREE
+
+	def get_stats(self):
+		"""
+		:return: dictionary of the statistics
+		"""
+		requests, faces, latency, busy = self.stats[:]
+		return {
+			'requests': int(requests),
+			'faces': int(faces),
+			'avg_latency_ms': 1000 * latency / requests if requests else 0.0,
+			'throughput_fps': faces / busy if busy else 0.0
+		}
+
+	def load_model(self):
+		"""
+		:return: the loaded and warmed up model
+		"""
+		from raspberry_sec.module.nnrecognizer.consumer import NnrecognizerConsumer
+		return NnrecognizerConsumer.load_network(self.model_path, self.size, self.backend)
+
+	def run(self, context: ProcessContext):
+		"""
+		Worker loop: serves the pending requests in batches until the stop event is set
+		:param context: Process context
+		"""
+		InferenceService.LOGGER.info('Starting ' + self.get_name())
+		model = self.load_model()
+
+		while not context.stop_event.is_set():
+			has_pending = InferenceService.wait_until(
+				lambda: InferenceService.PENDING in self.states[:], InferenceService.STOP_CHECK_INTERVAL)
+			with self.lock:
+				self.reclaim_slots(time.monotonic())
+			if not has_pending:
+				continue
+
+			with self.lock:
+				pending = [slot for slot in range(self.slots) if self.states[slot] == InferenceService.PENDING]
+				tickets = [self.tickets[slot] for slot in pending]
+				counts = [self.counts[slot] for slot in pending]
+
+			start = time.monotonic()
+			batch = np.concatenate([self.get_inputs(slot)[:count] for slot, count in zip(pending, counts)])
+			try:
+				labels = np.argmax(np.round(model.predict(batch)), axis=1)
+			except Exception as e:
+				InferenceService.LOGGER.error('Prediction failed: ' + str(e))
+				labels = np.full(len(batch), -1)
+			end = time.monotonic()
+
+			with self.lock:
+				offset = 0
+				for slot, ticket, count in zip(pending, tickets, counts):
+					# the request could have been abandoned (timeout) and the slot reused meanwhile
+					if self.states[slot] == InferenceService.PENDING and self.tickets[slot] == ticket:
+						base = slot * self.max_batch
+						self.outputs[base:base + count] = [int(label) for label in labels[offset:offset + count]]
+						self.states[slot] = InferenceService.DONE
+						self.stats[InferenceService.LATENCY] += end - self.submitted[slot]
+					offset += count
+
+			previous = int(self.stats[InferenceService.REQUESTS])
+			self.stats[InferenceService.REQUESTS] += len(pending)
+			self.stats[InferenceService.FACES] += len(batch)
+			self.stats[InferenceService.BUSY] += end - start
+			if previous // InferenceService.STATS_INTERVAL != int(self.stats[InferenceService.REQUESTS]) // InferenceService.STATS_INTERVAL:
+				InferenceService.LOGGER.info(self.get_name() + ' stats: ' + str(self.get_stats()))
+
+		InferenceService.LOGGER.info('Stopping ' + self.get_name())
@@ -1,4 +1,5 @@
 import os, sys
+import time
 import logging
 import argparse
 import cv2
@@ -14,6 +15,7 @@ from sklearn.model_selection import train_test_split
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
 from raspberry_sec.module.facedetector.consumer import FacedetectorConsumer, ConsumerContext
 from raspberry_sec.module.nnrecognizer.consumer import NnrecognizerConsumer
+from raspberry_sec.module.nnrecognizer.backend import InferenceBackend
 
 
 logging.basicConfig(format='%(asctime)s:%(name)s:%(levelname)s - %(message)s', level=logging.DEBUG)
@@ -306,6 +308,71 @@ def train(detect: bool, update: bool):
 	nn.evaluate_model()
 
 
+def get_export_path(backend: str, quantization: str):
+	"""
+	:param backend: tflite or onnx
+	:param quantization: None, float16 or int8
+	:return: path of the exported model, e.g. resources/model-int8.tflite
+	"""
+	suffix = '-' + quantization if quantization else ''
+	return 'resources/model' + suffix + '.' + backend
+
+
+def export(backend: str, quantization: str):
+	"""
+	Exports the trained Keras model to a lighter CPU runtime
+	:param backend: tflite or onnx
+	:param quantization: None, float16 or int8 (post-training quantization)
+	"""
+	backend_class = InferenceBackend.get_class(backend)
+	if not backend_class.EXPORTABLE:
+		raise ValueError('The model cannot be exported to the ' + backend + ' backend')
+
+	ctx = Context(img_size=128)
+	samples = None
+	if quantization == 'int8':
+		# calibration data for the activation ranges
+		ctx.load_data(['neg', 'pos'])
+		samples = ctx.train_data[:200]
+
+	output_path = get_export_path(backend, quantization)
+	backend_class.export(ctx.model_path, output_path, quantization, samples)
+	print('Exported: ' + output_path + ' (' + str(os.path.getsize(output_path) // 1024) + ' kB)')
+
+
+def compare(models: list, runs: int=100):
+	"""
+	Compares the accuracy and latency of the models on the pos/neg test set
+	:param models: list of backend:path strings, e.g. tflite:resources/model-int8.tflite
+	:param runs: number of single face predictions to measure the latency with
+	"""
+	ctx = Context(img_size=128)
+	ctx.load_data(['neg', 'pos'])
+	data = ctx.test_data.astype('float32')
+	expected = np.argmax(ctx.test_label, axis=1)
+
+	print('{:<45}{:>10}{:>14}{:>14}'.format('Model', 'Accuracy', 'Latency (ms)', 'Batch (fps)'))
+	for model in models:
+		backend, path = model.split(':', 1)
+		network = NnrecognizerConsumer.load_network(path, ctx.img_size, backend)
+
+		predicted = np.concatenate([network.predict(data[i:i + 8]) for i in range(0, len(data), 8)])
+		accuracy = np.mean(np.argmax(np.round(predicted), axis=1) == expected)
+
+		latencies = []
+		for i in range(min(runs, len(data))):
+			start = time.perf_counter()
+			network.predict(data[i:i + 1])
+			latencies.append(time.perf_counter() - start)
+
+		start = time.perf_counter()
+		for i in range(0, len(data), 8):
+			network.predict(data[i:i + 8])
+		throughput = len(data) / (time.perf_counter() - start)
+
+		print('{:<45}{:>10.3f}{:>14.2f}{:>14.1f}'.format(model, accuracy, 1000 * np.median(latencies), throughput))
+
+
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description='== NN Face Recognizer (testing/training module) ==')
 	parser.add_argument('-tr', '--training',
@@ -317,10 +384,26 @@ if __name__ == '__main__':
 	parser.add_argument('-u', '--update',
 						help='If the input should be updated with the face that has been detected (only with -d)',
 						action='store_true')
+	parser.add_argument('-e', '--export',
+						help='Exports the trained model for the given runtime',
+						choices=['tflite', 'onnx'])
+	parser.add_argument('-q', '--quantization',
+						help='Post-training quantization of the exported model (only with -e)',
+						choices=['float16', 'int8'])
+	parser.add_argument('-c', '--compare',
+						help='Compares the accuracy and latency of the models (e.g. keras:resources/model.h5py tflite:resources/model-int8.tflite)',
+						nargs='+',
+						metavar='BACKEND:PATH')
 	args = parser.parse_args()
 
 	# If training is enabled
 	if args.training:
 		train(args.detect, args.update)
 
-	test()
+	if args.export:
+		export(args.export, args.quantization)
+
+	if args.compare:
+		compare(args.compare)
+	elif not args.export:
+		test()
@@ -0,0 +1,61 @@
+import unittest
+import numpy as np
+from raspberry_sec.module.nnrecognizer.backend import InferenceBackend, TFLiteBackend, OnnxBackend
+
+
+class TestInferenceBackendMethods(unittest.TestCase):
+
+    def test_get_class_does_not_create_backend(self):
+        # Then
+        self.assertIs(OnnxBackend, InferenceBackend.get_class('onnx'))
+        self.assertRaises(ValueError, InferenceBackend.get_class, 'caffe')
+
+    def test_exportable_backends(self):
+        # Then
+        self.assertFalse(InferenceBackend.get_class('keras').EXPORTABLE)
+        self.assertTrue(InferenceBackend.get_class('tflite').EXPORTABLE)
+        self.assertTrue(InferenceBackend.get_class('onnx').EXPORTABLE)
+
+    def test_export_is_not_supported_by_keras_backend(self):
+        # Then
+        self.assertRaises(ValueError, InferenceBackend.get_class('keras').export, 'model.h5py', 'model.out')
+
+
+class TestTFLiteBackendMethods(unittest.TestCase):
+
+    def test_quantize_uses_scale_and_zero_point(self):
+        # Given
+        details = {'dtype': np.int8, 'quantization': (1 / 255, -128)}
+        batch = np.array([0.0, 0.6, 1.0, 2.0], dtype=np.float32)
+
+        # When
+        quantized = TFLiteBackend.quantize(batch, details)
+
+        # Then
+        self.assertEqual(np.int8, quantized.dtype)
+        self.assertEqual([-128, 25, 127, 127], quantized.tolist())
+
+    def test_dequantize_restores_float_output(self):
+        # Given
+        details = {'dtype': np.uint8, 'quantization': (1 / 256, 0)}
+        output = np.array([[0, 128, 255]], dtype=np.uint8)
+
+        # When
+        dequantized = TFLiteBackend.dequantize(output, details)
+
+        # Then
+        self.assertEqual(np.float32, dequantized.dtype)
+        np.testing.assert_allclose([[0.0, 0.5, 255 / 256]], dequantized)
+
+    def test_float_model_is_left_alone(self):
+        # Given
+        details = {'dtype': np.float32, 'quantization': (0.0, 0)}
+        batch = np.array([0.25], dtype=np.float32)
+
+        # Then
+        self.assertIs(batch, TFLiteBackend.quantize(batch, details))
+        self.assertIs(batch, TFLiteBackend.dequantize(batch, details))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import time
+import threading
+import unittest
+import numpy as np
+from raspberry_sec.module.nnrecognizer.service import InferenceService
+from raspberry_sec.system.util import ProcessContext
+
+
+class FakeModel:
+
+    def predict(self, batch):
+        # the first pixel of a face is its label
+        return np.eye(3)[batch[:, 0, 0, 0].astype(int)]
+
+
+class FakeInferenceService(InferenceService):
+
+    def load_model(self):
+        return FakeModel()
+
+
+class TestInferenceServiceMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.service = FakeInferenceService('model', size=2, slots=2, max_batch=2)
+        self.stop_event = threading.Event()
+        context = ProcessContext(log_queue=None, stop_event=self.stop_event)
+        self.worker = threading.Thread(target=self.service.run, args=(context, ), daemon=True)
+        self.worker.start()
+
+    def tearDown(self):
+        self.stop_event.set()
+        self.worker.join(5)
+
+    def test_predict_returns_labels(self):
+        # Given
+        batch = np.zeros((3, 2, 2, 1), dtype=np.float32)
+        batch[:, 0, 0, 0] = [2, 0, 1]
+
+        # When
+        labels = self.service.predict(batch, timeout=5)
+
+        # Then
+        self.assertEqual([2, 0, 1], list(labels))
+        self.assertEqual(2, self.service.get_stats()['requests'])
+
+    def test_abandoned_slot_is_reclaimed(self):
+        # Given
+        slot, _ = self.service.claim_slot(time.monotonic() + 1)
+        self.service.claim_slot(time.monotonic() + 1)
+
+        # When
+        with self.service.lock:
+            self.service.reclaim_slots(time.monotonic() + InferenceService.ABANDON_TIMEOUT + 1)
+
+        # Then
+        self.assertEqual(InferenceService.FREE, self.service.states[slot])
+        self.assertEqual([1], list(self.service.predict(np.ones((1, 2, 2, 1), dtype=np.float32), timeout=5)))
+
+    def test_run_returns_when_stop_event_is_set(self):
+        # When
+        self.stop_event.set()
+        self.worker.join(5)
+
+        # Then
+        self.assertFalse(self.worker.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -32,7 +32,7 @@ class VoicerecognizerConsumer(Consumer):
 		Initialize variables
 		"""
 		self.VoiceRecognizer = sr.Recognizer()
-		self.zone_manager = ZoneManager()
+		self.zone_manager = ZoneManager.get_instance()
 		self.initialized = True
 
 	def get_name(self):
@@ -0,0 +1,189 @@
+import ctypes
+import logging
+import time
+import numpy as np
+from multiprocessing.sharedctypes import RawArray, RawValue
+from raspberry_sec.interface.producer import ProducerDataProxy, ProducerSample
+
+
+class SharedFrameRing:
+	"""
+	Fixed-slot ring of shared memory buffers for passing ndarray frames between processes.
+	There is exactly one writer (the producer process), readers never take locks:
+	every slot has a generation counter (seqlock) that is odd while the slot is being written.
+	Readers waiting for a new frame poll the sequence number, so the writer never waits for
+	them (a reader killed while waiting cannot block the producer).
+	"""
+	LOGGER = logging.getLogger('SharedFrameRing')
+	MAX_DIMS = 4
+	DTYPES = ['uint8', 'int8', 'uint16', 'int16', 'int32', 'float32', 'float64']
+	READ_RETRIES = 10
+	POLL_INTERVAL = 0.005
+
+	def __init__(self, slot_size: int, slots: int=4):
+		"""
+		Constructor
+		:param slot_size: capacity of one slot in bytes (the biggest frame that fits)
+		:param slots: number of slots in the ring
+		"""
+		if slots < 2:
+			raise ValueError('At least 2 slots are needed')
+
+		self.slot_size = slot_size
+		self.slots = slots
+		self.buffers = [RawArray(ctypes.c_ubyte, slot_size) for _ in range(slots)]
+		self.generations = RawArray(ctypes.c_ulonglong, slots)
+		self.shapes = RawArray(ctypes.c_long, slots * SharedFrameRing.MAX_DIMS)
+		self.ndims = RawArray(ctypes.c_int, slots)
+		self.dtypes = RawArray(ctypes.c_int, slots)
+		self.timestamps = RawArray(ctypes.c_double, slots)
+		self.latest = RawValue(ctypes.c_ulonglong, 0)
+		self.views = None
+
+	def __getstate__(self):
+		"""
+		The numpy views are process local, they are recreated after unpickling
+		:return: state to be pickled
+		"""
+		state = self.__dict__.copy()
+		state['views'] = None
+		return state
+
+	def get_views(self):
+		"""
+		:return: uint8 numpy views of the slot buffers (created once per process)
+		"""
+		if self.views is None:
+			self.views = [np.frombuffer(buffer, dtype=np.uint8) for buffer in self.buffers]
+		return self.views
+
+	def write(self, frame: np.ndarray):
+		"""
+		Copies the frame into the next slot and publishes it.
+		Must only be called from a single (producer) process.
+		:param frame: numpy array
+		:return: sequence number of the frame
+		"""
+		frame = np.ascontiguousarray(frame)
+		if frame.nbytes > self.slot_size:
+			raise ValueError('Frame of ' + str(frame.nbytes) + ' bytes does not fit into slot of ' + str(self.slot_size))
+		if frame.ndim > SharedFrameRing.MAX_DIMS or frame.dtype.name not in SharedFrameRing.DTYPES:
+			raise ValueError('Unsupported frame: ' + str(frame.shape) + ' ' + frame.dtype.name)
+
+		seq = self.latest.value + 1
+		slot = seq % self.slots
+
+		# odd generation: slot is being written
+		self.generations[slot] += 1
+		self.get_views()[slot][:frame.nbytes] = frame.reshape(-1).view(np.uint8)
+		self.ndims[slot] = frame.ndim
+		self.dtypes[slot] = SharedFrameRing.DTYPES.index(frame.dtype.name)
+		offset = slot * SharedFrameRing.MAX_DIMS
+		for i, dim in enumerate(frame.shape):
+			self.shapes[offset + i] = dim
+		self.timestamps[slot] = time.time()
+		# even generation: slot is consistent again
+		self.generations[slot] += 1
+
+		self.latest.value = seq
+		return seq
+
+	def read_slot(self, seq: int, copy: bool=False):
+		"""
+		Reads the frame with the given sequence number
+		:param seq: sequence number
+		:param copy: if False a zero-copy view is returned, that stays valid until
+		the writer wraps around the ring (slots - 1 newer frames)
+		:return: ProducerSample or None if the frame has already been overwritten
+		"""
+		slot = seq % self.slots
+		for _ in range(SharedFrameRing.READ_RETRIES):
+			generation = self.generations[slot]
+			if generation & 1:
+				continue
+
+			offset = slot * SharedFrameRing.MAX_DIMS
+			shape = tuple(self.shapes[offset:offset + self.ndims[slot]])
+			dtype = np.dtype(SharedFrameRing.DTYPES[self.dtypes[slot]])
+			nbytes = int(np.prod(shape)) * dtype.itemsize
+			frame = self.get_views()[slot][:nbytes].view(dtype).reshape(shape)
+			if copy:
+				frame = frame.copy()
+			timestamp = self.timestamps[slot]
+
+			# the slot was not touched meanwhile and still holds the requested frame
+			if self.generations[slot] == generation and self.latest.value - seq < self.slots - 1:
+				return ProducerSample(seq, timestamp, frame)
+
+		return None
+
+	def read(self, copy: bool=False):
+		"""
+		Reads the latest frame
+		:param copy: see read_slot
+		:return: ProducerSample or None if nothing has been written yet
+		"""
+		for _ in range(SharedFrameRing.READ_RETRIES):
+			seq = self.latest.value
+			if seq == 0:
+				return None
+			sample = self.read_slot(seq, copy)
+			if sample is not None:
+				return sample
+
+		SharedFrameRing.LOGGER.warning('Could not read a consistent frame')
+		return None
+
+	def wait_next(self, after_seq: int, timeout: float, copy: bool=False):
+		"""
+		Blocks until a frame newer than after_seq is published
+		:param after_seq: sequence number of the last frame seen (0 if none)
+		:param timeout: in seconds
+		:param copy: see read_slot
+		:return: ProducerSample of the latest frame or None in case of timeout
+		"""
+		deadline = time.monotonic() + timeout
+		while self.latest.value <= after_seq:
+			remaining = deadline - time.monotonic()
+			if remaining <= 0:
+				return None
+			time.sleep(min(SharedFrameRing.POLL_INTERVAL, remaining))
+		return self.read(copy)
+
+
+class SharedFrameDataProxy(ProducerDataProxy):
+	"""
+	ProducerDataProxy implementation backed by a SharedFrameRing.
+	It does not need the ProducerDataManager, it is handed over to the
+	producer and stream processes directly when they are spawned.
+	"""
+	def __init__(self, slot_size: int, slots: int=4):
+		"""
+		Constructor (the in-process state of ProducerDataProxy is replaced by the ring)
+		:param slot_size: see SharedFrameRing
+		:param slots: see SharedFrameRing
+		"""
+		self.ring = SharedFrameRing(slot_size, slots)
+
+	def set_data(self, new):
+		"""
+		Publishes a new frame
+		:param new: numpy array
+		"""
+		self.ring.write(new)
+
+	def get_data(self):
+		"""
+		:return: copy of the latest frame or None
+		"""
+		sample = self.ring.read(copy=True)
+		return sample.data if sample else None
+
+	def get_next(self, after_seq: int, timeout: float, copy: bool=False):
+		"""
+		:param after_seq: see ProducerDataProxy
+		:param timeout: see ProducerDataProxy
+		:param copy: see SharedFrameRing.read_slot
+		:return: ProducerSample holding a zero-copy view (or a copy) or None
+		"""
+		return self.ring.wait_next(after_seq, timeout, copy)
@@ -0,0 +1,40 @@
+import cv2
+from raspberry_sec.interface.consumer import ConsumerContext
+
+
+class FrameCache:
+	"""
+	Computes the derivatives of the image in a ConsumerContext (resized, grayscale and
+	blurred versions) lazily and memoizes them in the context, so consumers down the
+	chain (and streams sharing the context, see StreamGroup) do not compute them again.
+	The returned images are shared, they must not be modified in place.
+	"""
+	@staticmethod
+	def get(context: ConsumerContext, size: tuple=None, gray: bool=False, blur: int=0):
+		"""
+		:param context: its data is the source image (BGR or grayscale numpy array)
+		:param size: (width, height) or None to keep the original size
+		:param gray: True for grayscale
+		:param blur: Gaussian kernel size (0 means no blurring)
+		:return: derived image
+		"""
+		source = context.data
+		key = (size, gray, blur)
+		entry = context.cache.get(key)
+		# the entry is only valid if the consumers have not replaced the data since
+		if entry is not None and entry[0] is source:
+			return entry[1]
+
+		if blur:
+			image = cv2.GaussianBlur(FrameCache.get(context, size, gray), (blur, blur), 0)
+		elif gray:
+			image = FrameCache.get(context, size)
+			if image.ndim == 3:
+				image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+		elif size and (source.shape[1], source.shape[0]) != tuple(size):
+			image = cv2.resize(source, tuple(size))
+		else:
+			image = source
+
+		context.cache[key] = (source, image)
+		return image
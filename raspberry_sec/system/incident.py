@@ -0,0 +1,97 @@
+import time
+import uuid
+
+
+class Incident:
+	"""
+	A group of alerts belonging to the same event: it is opened when the query
+	becomes True and closed when no alert arrived for a while. Only one
+	notification is sent per incident, later alerts are counted into it.
+	"""
+	def __init__(self, start: float):
+		"""
+		Constructor
+		:param start: (monotonic) time of the first alert
+		"""
+		self.id = uuid.uuid4().hex
+		self.start = start
+		self.end = start
+		# wall clock time of the first alert (for the notification)
+		self.started_at = time.time()
+		self.streams = set()
+		self.zones = set()
+		self.alerts = 0
+		self.notified = False
+
+	def add(self, sender: str, zone: str, now: float):
+		"""
+		Registers an alert
+		:param sender: name of the stream
+		:param zone: zone of the stream (or None)
+		:param now: (monotonic) time of the alert
+		"""
+		self.streams.add(sender)
+		if zone:
+			self.zones.add(zone)
+		self.alerts += 1
+		self.end = max(self.end, now)
+
+	def get_duration(self):
+		"""
+		:return: seconds between the first and the last alert
+		"""
+		return self.end - self.start
+
+	def get_summary(self):
+		"""
+		:return: human readable description of the incident
+		"""
+		summary = 'Incident started at ' + time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at))
+		summary += ', streams: ' + ', '.join(sorted(self.streams))
+		if self.zones:
+			summary += ', zones: ' + ', '.join(sorted(self.zones))
+		return summary
+
+
+class TokenBucket:
+	"""
+	Rate limiter: 'rate' tokens are added per second up to 'capacity',
+	every action takes one token.
+	"""
+	def __init__(self, rate: float, capacity: float, now: float=0):
+		"""
+		Constructor
+		:param rate: tokens per second
+		:param capacity: maximum number of tokens (burst size)
+		:param now: current (monotonic) time
+		"""
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.updated = now
+
+	def refill(self, now: float):
+		"""
+		:param now: current (monotonic) time
+		"""
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+		self.updated = max(self.updated, now)
+
+	def take(self, now: float):
+		"""
+		:param now: current (monotonic) time
+		:return: True if a token was available
+		"""
+		self.refill(now)
+		if self.tokens >= 1:
+			self.tokens -= 1
+			return True
+		return False
+
+	def get_wait_time(self, now: float):
+		"""
+		:param now: current (monotonic) time
+		:return: seconds until the next token is available
+		"""
+		self.refill(now)
+		return max(0.0, (1 - self.tokens) / self.rate)
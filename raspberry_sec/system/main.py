@@ -54,6 +54,22 @@ class PCARuntime:
 		self.stop_event.set()
 		self.pca_thread.join()
 
+	def reload(self, pca_system: PCASystem):
+		"""
+		Applies a new configuration. The running system restarts only the changed
+		components, if that is not possible the whole system is restarted.
+		:param pca_system: PCASystem loaded from the new configuration
+		:return: True if the configuration is applied without a full restart
+		"""
+		if self.pca_thread is not None and self.pca_thread.is_alive() and self.pca_system.can_reload(pca_system):
+			self.pca_system.request_reload(pca_system)
+			return True
+
+		self.stop()
+		self.pca_system = pca_system
+		self.start()
+		return False
+
 
 class LogRuntime:
 	"""
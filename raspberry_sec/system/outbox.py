@@ -0,0 +1,328 @@
+import os
+import json
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, CancelledError
+from raspberry_sec.interface.action import Action, ActionMessage
+
+
+class ActionOutbox:
+	"""
+	Durable queue of the alerts to be fired (SQLite in WAL mode).
+	Every alert is written here before it is handed over to its Action, so it
+	survives failures and restarts. Alerts are identified by an idempotency key:
+	enqueuing the same key again is a no-op. Failed alerts are retried with
+	exponential backoff until max_attempts is reached.
+	"""
+	LOGGER = logging.getLogger('ActionOutbox')
+	PENDING = 'pending'
+	SENDING = 'sending'
+	DONE = 'done'
+	FAILED = 'failed'
+
+	@staticmethod
+	def get_abs_path(file: str):
+		"""
+		:return: the absolute path to file
+		"""
+		return os.path.abspath(os.path.join(os.path.dirname(__file__), file))
+
+	DEFAULT_PATH = get_abs_path.__func__('../../config/prod/outbox.db')
+
+	def __init__(self, path: str=DEFAULT_PATH, max_attempts: int=8, base_delay: float=5, max_delay: float=600,
+				retention: float=7 * 24 * 3600):
+		"""
+		Constructor
+		:param path: of the database file (':memory:' for a non-durable outbox)
+		:param max_attempts: an alert is given up after this many failures
+		:param base_delay: seconds to wait before the first retry (doubled after every failure)
+		:param max_delay: upper limit of the delay between retries
+		:param retention: seconds the finished alerts are kept for
+		"""
+		self.path = path
+		self.max_attempts = max_attempts
+		self.base_delay = base_delay
+		self.max_delay = max_delay
+		self.retention = retention
+		self.connection = None
+		self.lock = threading.Lock()
+
+	def __getstate__(self):
+		"""
+		The connection is process local, it is reopened after unpickling
+		:return: state to be pickled
+		"""
+		state = self.__dict__.copy()
+		state['connection'] = None
+		state['lock'] = None
+		return state
+
+	def __setstate__(self, state):
+		"""
+		:param state: pickled state
+		"""
+		self.__dict__.update(state)
+		self.lock = threading.Lock()
+
+	def open(self):
+		"""
+		Opens (and creates if needed) the database, alerts that were being sent
+		when the process stopped are scheduled again
+		"""
+		if self.connection is not None:
+			return
+		if self.path != ':memory:':
+			os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+		with self.lock:
+			self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+			self.connection.execute('PRAGMA journal_mode=WAL')
+			self.connection.execute('PRAGMA synchronous=NORMAL')
+			self.connection.execute(
+				'CREATE TABLE IF NOT EXISTS alerts ('
+				'id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE NOT NULL, action TEXT NOT NULL, '
+				'payload TEXT NOT NULL, state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, '
+				'next_attempt REAL NOT NULL, created REAL NOT NULL, last_error TEXT)')
+			self.connection.execute('CREATE INDEX IF NOT EXISTS alerts_due ON alerts (state, action, next_attempt)')
+			recovered = self.connection.execute(
+				'UPDATE alerts SET state = ? WHERE state = ?', (ActionOutbox.PENDING, ActionOutbox.SENDING)).rowcount
+		if recovered:
+			ActionOutbox.LOGGER.info(str(recovered) + ' interrupted alerts will be sent again')
+
+	def enqueue(self, action: str, messages: list, key: str=None, now: float=None):
+		"""
+		Stores an alert
+		:param action: name of the Action
+		:param messages: ActionMessage-s
+		:param key: idempotency key (generated if not given)
+		:param now: current time (time.time() if not given)
+		:return: the key of the alert
+		"""
+		now = time.time() if now is None else now
+		key = key if key else uuid.uuid4().hex
+		payload = json.dumps([message.data for message in messages])
+		with self.lock:
+			inserted = self.connection.execute(
+				'INSERT OR IGNORE INTO alerts (key, action, payload, state, next_attempt, created) VALUES (?, ?, ?, ?, ?, ?)',
+				(key, action, payload, ActionOutbox.PENDING, now, now)).rowcount
+		if not inserted:
+			ActionOutbox.LOGGER.debug('Alert ' + key + ' is already in the outbox')
+		return key
+
+	def claim(self, action: str, limit: int, now: float=None):
+		"""
+		Takes the alerts that are due
+		:param action: name of the Action
+		:param limit: maximum number of alerts
+		:param now: current time (time.time() if not given)
+		:return: list of (key, ActionMessage-s) pairs, they are marked as being sent
+		"""
+		now = time.time() if now is None else now
+		with self.lock:
+			rows = self.connection.execute(
+				'SELECT key, payload FROM alerts WHERE state = ? AND action = ? AND next_attempt <= ? '
+				'ORDER BY next_attempt LIMIT ?', (ActionOutbox.PENDING, action, now, limit)).fetchall()
+			self.connection.executemany(
+				'UPDATE alerts SET state = ? WHERE key = ?', [(ActionOutbox.SENDING, key) for key, _ in rows])
+		return [(key, [ActionMessage(data, key) for data in json.loads(payload)]) for key, payload in rows]
+
+	def complete(self, key: str):
+		"""
+		Marks the alert as sent
+		:param key: of the alert
+		"""
+		with self.lock:
+			self.connection.execute('UPDATE alerts SET state = ?, last_error = NULL WHERE key = ?', (ActionOutbox.DONE, key))
+
+	def get_delay(self, attempts: int):
+		"""
+		:param attempts: number of failed attempts so far
+		:return: seconds to wait before the next attempt
+		"""
+		return min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+
+	def fail(self, key: str, error: str, now: float=None):
+		"""
+		Schedules a retry of the alert (or gives it up)
+		:param key: of the alert
+		:param error: reason of the failure
+		:param now: current time (time.time() if not given)
+		:return: True if the alert will be retried
+		"""
+		now = time.time() if now is None else now
+		with self.lock:
+			(attempts, ) = self.connection.execute('SELECT attempts FROM alerts WHERE key = ?', (key, )).fetchone()
+			attempts += 1
+			retry = attempts < self.max_attempts
+			self.connection.execute(
+				'UPDATE alerts SET state = ?, attempts = ?, next_attempt = ?, last_error = ? WHERE key = ?',
+				(ActionOutbox.PENDING if retry else ActionOutbox.FAILED, attempts,
+				now + self.get_delay(attempts), error, key))
+		if retry:
+			ActionOutbox.LOGGER.warning('Alert ' + key + ' failed (' + error + '), retrying in '
+										+ str(self.get_delay(attempts)) + ' s')
+		else:
+			ActionOutbox.LOGGER.error('Alert ' + key + ' failed ' + str(attempts) + ' times, giving up: ' + error)
+		return retry
+
+	def get_next_attempt(self, action: str):
+		"""
+		:param action: name of the Action
+		:return: time of the next due alert or None if there are no pending alerts
+		"""
+		with self.lock:
+			(next_attempt, ) = self.connection.execute(
+				'SELECT MIN(next_attempt) FROM alerts WHERE state = ? AND action = ?',
+				(ActionOutbox.PENDING, action)).fetchone()
+		return next_attempt
+
+	def get_state(self, key: str):
+		"""
+		:param key: of the alert
+		:return: state of the alert or None if it is unknown
+		"""
+		with self.lock:
+			row = self.connection.execute('SELECT state FROM alerts WHERE key = ?', (key, )).fetchone()
+		return row[0] if row else None
+
+	def purge(self, now: float=None):
+		"""
+		Deletes the finished alerts older than the retention period
+		:param now: current time (time.time() if not given)
+		"""
+		now = time.time() if now is None else now
+		with self.lock:
+			self.connection.execute(
+				'DELETE FROM alerts WHERE state IN (?, ?) AND created < ?',
+				(ActionOutbox.DONE, ActionOutbox.FAILED, now - self.retention))
+
+
+class ActionDispatcher:
+	"""
+	Delivers the alerts of an ActionOutbox to an Action on a background thread,
+	with at most 'concurrency' fire calls in flight. Alerts that do not fit are
+	waiting on disk, not in memory. An Action signals failure by raising an exception
+	(or by returning a Future that fails). An alert stays in flight until its Future
+	is done, it is never retried while the action may still deliver it.
+	"""
+	LOGGER = logging.getLogger('ActionDispatcher')
+	POLL_INTERVAL = 60
+
+	def __init__(self, outbox: ActionOutbox, action: Action, concurrency: int=2):
+		"""
+		Constructor
+		:param outbox: ActionOutbox
+		:param action: Action the alerts are fired on
+		:param concurrency: maximum number of parallel fire calls
+		"""
+		self.outbox = outbox
+		self.action = action
+		self.concurrency = concurrency
+		self.in_flight = 0
+		self.condition = threading.Condition()
+		self.wakeup = False
+		self.executor = None
+		self.thread = None
+
+	def start(self):
+		"""
+		Opens the outbox and starts the dispatcher thread
+		"""
+		self.outbox.open()
+		self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+		self.thread = threading.Thread(target=self.dispatch_loop, name='ActionDispatcher', daemon=True)
+		self.thread.start()
+
+	def submit(self, messages: list):
+		"""
+		Stores the alert durably and wakes the dispatcher up
+		:param messages: ActionMessage-s
+		:return: the idempotency key of the alert
+		"""
+		key = self.outbox.enqueue(self.action.get_name(), messages, messages[0].key if messages else None)
+		with self.condition:
+			self.wakeup = True
+			self.condition.notify_all()
+		return key
+
+	def deliver(self, key: str, messages: list):
+		"""
+		Fires the action, runs on the executor
+		:param key: of the alert
+		:param messages: ActionMessage-s
+		"""
+		try:
+			result = self.action.fire(messages)
+		except Exception as e:
+			self.finish(key, e)
+			return
+
+		if isinstance(result, Future):
+			result.add_done_callback(lambda future: self.finish(key, ActionDispatcher.get_error(future)))
+		else:
+			self.finish(key, None)
+
+	@staticmethod
+	def get_error(future: Future):
+		"""
+		:param future: finished Future
+		:return: its exception or None if it succeeded
+		"""
+		try:
+			return future.exception()
+		except CancelledError as e:
+			return e
+
+	def finish(self, key: str, error: Exception):
+		"""
+		Records the outcome of the alert and frees its slot
+		:param key: of the alert
+		:param error: exception or None if the alert was delivered
+		"""
+		try:
+			if error is None:
+				self.outbox.complete(key)
+			else:
+				self.outbox.fail(key, type(error).__name__ + ': ' + str(error))
+		finally:
+			with self.condition:
+				self.in_flight -= 1
+				self.condition.notify_all()
+
+	def get_wait_time(self):
+		"""
+		:return: seconds until the next alert is due
+		"""
+		next_attempt = self.outbox.get_next_attempt(self.action.get_name())
+		if next_attempt is None:
+			return ActionDispatcher.POLL_INTERVAL
+		return min(ActionDispatcher.POLL_INTERVAL, max(0.0, next_attempt - time.time()))
+
+	def dispatch_loop(self):
+		"""
+		Dispatcher thread
+		"""
+		self.outbox.purge()
+		while True:
+			try:
+				with self.condition:
+					self.condition.wait_for(lambda: self.in_flight < self.concurrency)
+					free = self.concurrency - self.in_flight
+
+				claimed = self.outbox.claim(self.action.get_name(), free)
+				for key, messages in claimed:
+					with self.condition:
+						self.in_flight += 1
+					self.executor.submit(self.deliver, key, messages)
+
+				if len(claimed) < free:
+					with self.condition:
+						if not self.wakeup:
+							self.condition.wait(self.get_wait_time())
+						self.wakeup = False
+			except Exception as e:
+				ActionDispatcher.LOGGER.error('Dispatching failed: ' + str(e))
+				time.sleep(1)
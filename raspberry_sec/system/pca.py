@@ -1,14 +1,18 @@
+import os
 import json
+import queue
 import logging
 import importlib
+import multiprocessing
 from json import JSONDecoder
 from json import JSONEncoder
-from multiprocessing import Queue
+from multiprocessing import Queue, Event
 from raspberry_sec.system.util import Loader, DynamicLoader, ProcessContext, ProcessReady
 from raspberry_sec.interface.action import Action
 from raspberry_sec.interface.consumer import Consumer
 from raspberry_sec.interface.producer import Producer, ProducerDataManager
-from raspberry_sec.system.stream import StreamController, Stream
+from raspberry_sec.system.stream import StreamController, Stream, StreamGroup
+from raspberry_sec.system.recorder import ClipRecorder
 
 
 class PCASystem(ProcessReady):
@@ -18,21 +22,46 @@ class PCASystem(ProcessReady):
 	LOGGER = logging.getLogger('PCASystem')
 	TIMEOUT = 2
 	POLLING_INTERVAL = 2
+	# seconds a stream, service or the stream controller gets to stop on its own before it is terminated
+	STOP_TIMEOUT = 10
+	# these libraries start threads when imported, a process forked after that may deadlock
+	FORK_UNSAFE = {'tensorflow', 'keras'}
 
 	def __init__(self):
 		"""
 		Constructor
 		"""
 		self.streams = set()
+		# streams sharing a producer and their first stages run these stages only once
+		self.shared_stages = False
+		# records the incidents (None means no recording)
+		self.recorder = None
+		# start method of the component processes (None means the default one) and the modules
+		# a forkserver imports once, so the forked processes start with them already loaded
+		self.start_method = None
+		self.preload = []
+		self.mp_context = None
 		self.producer_set = set()
-		self.stream_processes = []
+		# unit name -> process
+		self.stream_processes = {}
+		# service name -> process
+		self.service_processes = {}
+		# every stream unit and service has its own stop event, so it can be stopped alone
+		# (a terminated process may leave the locks of the shared queues held)
+		self.stream_events = {}
+		self.service_events = {}
 		self.prod_to_proc = {}
 		self.prod_to_proxy = {}
-		
+		# every producer has its own stop event, so it can be stopped alone
+		self.prod_to_event = {}
+		# new configurations to be applied (see request_reload)
+		self.reload_queue = queue.Queue()
+
 		self.manager = None
 		self.stream_controller = None
 		self.sc_queue = None
 		self.sc_process = None
+		self.sc_event = None
 
 	def validate(self):
 		"""
@@ -50,6 +79,10 @@ class PCASystem(ProcessReady):
 			PCASystem.LOGGER.warning('There are no streams configured')
 			return False
 
+		if self.shared_stages:
+			for stream in [s for s in self.streams if s.adaptive]:
+				PCASystem.LOGGER.warning(stream.get_name() + ' is adaptive, it does not share stages with other streams')
+
 		return True
 
 	def run(self, context: ProcessContext):
@@ -61,8 +94,10 @@ class PCASystem(ProcessReady):
 
 		# 1 - Validate the components
 		self.validate()
+		self.get_mp_context()
 		self.producer_set = set([s.producer for s in self.streams])
 		self.sc_queue = Queue()
+		self.stream_controller.recorder = self.recorder
 
 		# 2 - setup shared data manager
 		self.setup_shared_manager()
@@ -73,14 +108,44 @@ class PCASystem(ProcessReady):
 		# 4 - start stream controller process
 		self.start_stream_controller_process(context)
 
-		# 5 - start stream processes
+		# 5 - start the services of the consumers
+		self.start_service_processes(context)
+
+		# 6 - start stream processes
 		self.start_stream_processes(context)
 
-		# 6 - wait for the stop event and periodically check the producers
+		# 7 - wait for the stop event and periodically check the producers
 		self.wait_for_completion(context)
 
 		PCASystem.LOGGER.info('Finished')
 
+	def get_preload(self):
+		"""
+		:return: the modules to preload in the forkserver (the fork unsafe ones are left out)
+		"""
+		preload = []
+		for module in self.preload:
+			if module.split('.')[0] in PCASystem.FORK_UNSAFE:
+				PCASystem.LOGGER.warning(module + ' cannot be preloaded, it is not fork-safe')
+			else:
+				preload.append(module)
+		return preload
+
+	def get_mp_context(self):
+		"""
+		The forkserver preloads the modules when it starts (at the first process created),
+		it is shared by the whole application, so the preload of the first PCASystem wins.
+		:return: multiprocessing context of the component processes (None means the default one)
+		"""
+		if self.mp_context is None and self.start_method:
+			if self.start_method not in multiprocessing.get_all_start_methods():
+				PCASystem.LOGGER.warning('Start method ' + self.start_method + ' is not available, using the default one')
+				return None
+			self.mp_context = multiprocessing.get_context(self.start_method)
+			if self.start_method == 'forkserver':
+				self.mp_context.set_forkserver_preload(self.get_preload())
+		return self.mp_context
+
 	def create_producer_process(self, context: ProcessContext, producer: Producer):
 		"""
 		Creates a new process for the Producer instance.
@@ -89,14 +154,16 @@ class PCASystem(ProcessReady):
 		:return: newly created process object
 		"""
 		proc_context = ProcessContext(
-			stop_event=context.stop_event,
+			stop_event=self.prod_to_event[producer],
 			log_queue=context.logging_queue,
-			shared_data_proxy=self.prod_to_proxy[producer]
+			shared_data_proxy=self.prod_to_proxy[producer],
+			recorder=self.recorder
 		)
 		return ProcessContext.create_process(
 			target=producer.start,
 			name=producer.get_name(),
-			args=(proc_context, )
+			args=(proc_context, ),
+			mp_context=self.get_mp_context()
 		)
 
 	def resurrect_producers(self, context: ProcessContext):
@@ -105,7 +172,7 @@ class PCASystem(ProcessReady):
 		:param context: holds process related stuff
 		"""
 		PCASystem.LOGGER.debug('Checking producer processes')
-		for prod, proc in self.prod_to_proc.items():
+		for prod, proc in list(self.prod_to_proc.items()):
 			if not proc.is_alive():
 				PCASystem.LOGGER.info(prod.get_name() + ' process will be resurrected')
 				new_proc = self.create_producer_process(context, prod)
@@ -129,93 +196,411 @@ class PCASystem(ProcessReady):
 		for producer in self.producer_set:
 			self.prod_to_proxy[producer] = producer.create_shared_data_proxy(self.manager)
 
-	def start_producer_processes(self, context: ProcessContext):
+	def start_producer_processes(self, context: ProcessContext, producers=None):
 		"""
 		Creates and starts the producer processes.
 		:param context: holds 'stop event' and logging queue
+		:param producers: Producer-s to start (all of them by default)
 		"""
-		for producer in self.producer_set:
+		for producer in (self.producer_set if producers is None else producers):
+			self.prod_to_event[producer] = Event()
 			proc = self.create_producer_process(context, producer)
 
 			PCASystem.LOGGER.info('Starting producer: ' + producer.get_name())
 			self.prod_to_proc[producer] = proc
 			proc.start()
-	
+
+	def stop_producer_process(self, producer: Producer):
+		"""
+		Stops the producer process and forgets the producer
+		:param producer: Producer instance
+		"""
+		PCASystem.LOGGER.info('Stopping producer: ' + producer.get_name())
+		self.prod_to_event.pop(producer).set()
+		proc = self.prod_to_proc.pop(producer)
+		proc.join(PCASystem.TIMEOUT)
+		if proc.is_alive():
+			proc.terminate()
+			proc.join()
+		self.prod_to_proxy.pop(producer, None)
+		self.producer_set.discard(producer)
+
+	@staticmethod
+	def stop_process(proc, event):
+		"""
+		Sets the stop event of the process and waits for it to finish,
+		it is terminated if it does not stop in time
+		:param proc: Process
+		:param event: stop event of the process
+		:return: True if the process stopped on its own
+		"""
+		event.set()
+		proc.join(PCASystem.STOP_TIMEOUT)
+		if not proc.is_alive():
+			return True
+		PCASystem.LOGGER.warning(proc.name + ' did not stop in time, terminating it')
+		proc.terminate()
+		proc.join()
+		return False
+
+	def stop_stream_process(self, name: str):
+		"""
+		Stops the stream unit process
+		:param name: name of the unit
+		:return: True if the process stopped on its own
+		"""
+		PCASystem.LOGGER.info('Stopping stream: ' + name)
+		return PCASystem.stop_process(self.stream_processes.pop(name), self.stream_events.pop(name))
+
+	def stop_service_process(self, name: str):
+		"""
+		Stops the service process
+		:param name: name of the service
+		:return: True if the process stopped on its own
+		"""
+		PCASystem.LOGGER.info('Stopping service: ' + name)
+		return PCASystem.stop_process(self.service_processes.pop(name), self.service_events.pop(name))
+
+	def stop_stream_controller_process(self):
+		"""
+		Stops the stream controller process
+		:return: True if the process stopped on its own
+		"""
+		PCASystem.LOGGER.info('Stopping stream-controller')
+		return PCASystem.stop_process(self.sc_process, self.sc_event)
+
 	def start_stream_controller_process(self, context: ProcessContext):
 		"""
 		Creates and fires up the stream controller process
 		:param context: holds the 'stop event' and the logging queue
 		"""
+		self.sc_event = Event()
 		sc_context = ProcessContext(
 			log_queue=context.logging_queue,
-			stop_event=context.stop_event,
-			message_queue=self.sc_queue,
-			
+			stop_event=self.sc_event,
+			message_queue=self.sc_queue
 		)
 		self.sc_process = ProcessContext.create_process(
 			target=self.stream_controller.start,
 			name='SC process',
-			args=(sc_context, )
+			args=(sc_context, ),
+			mp_context=self.get_mp_context()
 		)
 
 		PCASystem.LOGGER.info('Starting stream-controller')
 		self.sc_process.start()
 
-	def start_stream_processes(self, context: ProcessContext):
+	def get_services(self):
+		"""
+		:return: the services needed by the consumers (each of them once)
+		"""
+		services = []
+		for stream in sorted(self.streams, key=lambda s: s.get_name()):
+			for consumer in stream.consumers:
+				for service in consumer.get_services():
+					if not any(service is s for s in services):
+						services.append(service)
+		return services
+
+	def start_service_processes(self, context: ProcessContext):
+		"""
+		Creates and starts the service processes (e.g. shared inference, clip recording)
+		that are not running yet
+		:param context: holds the 'stop event' and the logging queue
+		"""
+		services = self.get_services()
+		if self.recorder is not None:
+			services.append(self.recorder)
+		for service in services:
+			if service.get_name() in self.service_processes:
+				continue
+			self.service_events[service.get_name()] = Event()
+			service_context = ProcessContext(
+				stop_event=self.service_events[service.get_name()],
+				log_queue=context.logging_queue
+			)
+			proc = ProcessContext.create_process(
+				target=service.start,
+				name=service.get_name(),
+				args=(service_context, ),
+				mp_context=self.get_mp_context()
+			)
+			self.service_processes[service.get_name()] = proc
+
+			PCASystem.LOGGER.info('Starting service: ' + service.get_name())
+			proc.start()
+
+	def get_stream_units(self):
+		"""
+		:return: Stream-s and StreamGroup-s, each of them runs in its own process
 		"""
-		Creates the stream processes .zoand fires them up.
-		:param context: holds the 'stop event' and the loggign queue as well
+		if not self.shared_stages:
+			return list(self.streams)
+
+		units = []
+		for streams in StreamGroup.group_streams(self.streams):
+			units.append(StreamGroup(streams) if len(streams) > 1 else streams[0])
+		return units
+
+	def start_stream_processes(self, context: ProcessContext, names=None):
 		"""
-		for stream in self.streams:
+		Creates the stream processes and fires them up.
+		:param context: holds the 'stop event' and the logging queue as well
+		:param names: names of the units to start (all of them by default)
+		"""
+		for unit in self.get_stream_units():
+			if names is not None and unit.get_name() not in names:
+				continue
+			self.stream_events[unit.get_name()] = Event()
 			s_context = ProcessContext(
-				stop_event=context.stop_event,
+				stop_event=self.stream_events[unit.get_name()],
 				log_queue=context.logging_queue,
-				shared_data_proxy=self.prod_to_proxy[stream.producer],
+				shared_data_proxy=self.prod_to_proxy[unit.producer],
 				sc_queue=self.sc_queue,
 			)
 			proc = ProcessContext.create_process(
-				target=stream.start,
-				name=stream.get_name(),
-				args=(s_context, )
+				target=unit.start,
+				name=unit.get_name(),
+				args=(s_context, ),
+				mp_context=self.get_mp_context()
 			)
-			self.stream_processes.append(proc)
+			self.stream_processes[unit.get_name()] = proc
 
-			PCASystem.LOGGER.info('Starting stream: ' + stream.name)
+			PCASystem.LOGGER.info('Starting stream: ' + unit.get_name())
 			proc.start()
 
+	def can_reload(self, new_system):
+		"""
+		Producers are registered in the shared data manager when it starts,
+		so a new type of producer needs a full restart (as well as a new start method).
+		:param new_system: PCASystem with the new configuration
+		:return: True if the new configuration can be applied without a full restart
+		"""
+		if (self.start_method, self.preload) != (new_system.start_method, new_system.preload):
+			return False
+		producers = set([s.producer.get_name() for s in self.streams])
+		return set([s.producer.get_name() for s in new_system.streams]) <= producers
+
+	def request_reload(self, new_system):
+		"""
+		Asks the running system to apply a new configuration (see reload)
+		:param new_system: PCASystem with the new configuration
+		"""
+		self.reload_queue.put(new_system)
+
+	def reload(self, context: ProcessContext, new_system):
+		"""
+		Applies a new configuration, only the processes whose configuration changed
+		are restarted: unchanged cameras keep capturing and warm models stay loaded.
+		:param context: holds the 'stop event' and the logging queue
+		:param new_system: PCASystem with the new configuration
+		"""
+		new_system.validate()
+		diff = PCASystemDiff(self, new_system)
+		if diff.is_empty():
+			PCASystem.LOGGER.info('Configuration has not changed')
+			return
+		PCASystem.LOGGER.info('Reloading configuration: ' + str(diff))
+
+		# 1 - stop what changed or was removed
+		units = set(diff.units)
+		controller = diff.controller
+		stopped = True
+		for name in [n for n in units if n in self.stream_processes]:
+			stopped &= self.stop_stream_process(name)
+		if controller:
+			stopped &= self.stop_stream_controller_process()
+		if not stopped:
+			# a killed process may hold the lock of the message queue, nobody could use it any more
+			PCASystem.LOGGER.warning('Replacing the message queue, every stream is restarted')
+			for name in list(self.stream_processes):
+				self.stop_stream_process(name)
+			if not controller:
+				self.stop_stream_controller_process()
+			self.sc_queue = Queue()
+			units = set([unit.get_name() for unit in new_system.get_stream_units()])
+			controller = True
+		for producer in [p for p in list(self.producer_set) if p.get_name() in diff.producers]:
+			self.stop_producer_process(producer)
+		if diff.recorder and self.recorder is not None and self.recorder.get_name() in self.service_processes:
+			self.stop_service_process(self.recorder.get_name())
+
+		# 2 - take over the new configuration, the unchanged components keep their running instances
+		self.streams = new_system.streams
+		self.shared_stages = new_system.shared_stages
+		if diff.recorder:
+			self.recorder = new_system.recorder
+		if diff.controller:
+			self.stream_controller = new_system.stream_controller
+			self.stream_controller.recorder = self.recorder
+
+		# 3 - start what is new
+		new_producers = [s.producer for s in self.streams if s.producer not in self.producer_set]
+		new_producers = list(dict.fromkeys(new_producers))
+		for producer in new_producers:
+			self.producer_set.add(producer)
+			self.prod_to_proxy[producer] = producer.create_shared_data_proxy(self.manager)
+		self.start_producer_processes(context, new_producers)
+		if controller:
+			self.start_stream_controller_process(context)
+		self.stop_unused_services()
+		self.start_service_processes(context)
+		self.start_stream_processes(context, units)
+
+	def stop_unused_services(self):
+		"""
+		Stops the services the new configuration does not need
+		"""
+		needed = set([service.get_name() for service in self.get_services()])
+		if self.recorder is not None:
+			needed.add(self.recorder.get_name())
+		for name in [n for n in self.service_processes if n not in needed]:
+			self.stop_service_process(name)
+
 	def wait_for_completion(self, context: ProcessContext):
 		"""
 		Waits for the stop event to be set and then initiates the shutdown
-		of the system. Producers, streams and the stream controller will be terminated.
+		of the system. Producers, streams, services and the stream controller are asked to stop
+		(and terminated if they do not stop in time).
+		New configurations are applied meanwhile.
 		:param context: holds the 'event' object
 		"""
 		while not context.stop_event.is_set():
 			context.stop_event.wait(timeout=PCASystem.POLLING_INTERVAL)
+			while not context.stop_event.is_set() and not self.reload_queue.empty():
+				try:
+					self.reload(context, self.reload_queue.get_nowait())
+				except Exception as e:
+					PCASystem.LOGGER.error('Cannot reload configuration: ' + str(e))
 			self.resurrect_producers(context)
 
 		PCASystem.LOGGER.info('Stop event arrived')
 
 		stream_proc_count = str(len(self.stream_processes))
 		PCASystem.LOGGER.info('Number of stream processes to be stopped: ' + stream_proc_count)
-		for process in self.stream_processes:
-			process.terminate()
+		for event in list(self.stream_events.values()) + list(self.service_events.values()) + [self.sc_event]:
+			event.set()
+		for name in list(self.stream_processes):
+			self.stop_stream_process(name)
+
+		PCASystem.LOGGER.info('Stopping services')
+		for name in list(self.service_processes):
+			self.stop_service_process(name)
 
 		PCASystem.LOGGER.info('Stopping stream controller')
-		self.sc_process.terminate()
+		self.stop_stream_controller_process()
 
 		PCASystem.LOGGER.info('Waiting for producers')
+		for event in self.prod_to_event.values():
+			event.set()
 		for prod, proc in self.prod_to_proc.items():
 			proc.join()
 
 
+class PCASystemDiff:
+	"""
+	Differences between a running and a new PCASystem configuration,
+	expressed as the processes that have to be restarted.
+	"""
+	def __init__(self, old: PCASystem, new: PCASystem):
+		"""
+		Constructor
+		:param old: running PCASystem
+		:param new: PCASystem with the new configuration
+		"""
+		self.recorder = PCASystemDiff.get_signature(old.recorder and old.recorder.parameters) \
+			!= PCASystemDiff.get_signature(new.recorder and new.recorder.parameters)
+
+		# the producers get the recorder too
+		old_producers = PCASystemDiff.get_producer_signatures(old)
+		new_producers = PCASystemDiff.get_producer_signatures(new)
+		self.producers = set([name for name in set(old_producers) | set(new_producers)
+							if self.recorder or old_producers.get(name) != new_producers.get(name)])
+
+		# streams have to be restarted if their producer was restarted
+		old_units = PCASystemDiff.get_unit_signatures(old)
+		new_units = PCASystemDiff.get_unit_signatures(new)
+		self.units = set([name for name in set(old_units) | set(new_units)
+						if old_units.get(name) != new_units.get(name)
+						or (name in new_units and new_units[name][0] in self.producers)])
+
+		self.controller = self.recorder or PCASystemDiff.get_signature(old.stream_controller) \
+			!= PCASystemDiff.get_signature(new.stream_controller)
+
+	@staticmethod
+	def get_signature(obj):
+		"""
+		:param obj: component (or its configuration)
+		:return: canonical JSON form of the configuration
+		"""
+		return json.dumps(obj, cls=PCASystemJSONEncoder, sort_keys=True)
+
+	@staticmethod
+	def get_producer_signatures(pca_system: PCASystem):
+		"""
+		:param pca_system: PCASystem
+		:return: producer name -> signature
+		"""
+		return dict([(s.producer.get_name(), PCASystemDiff.get_signature([type(s.producer).__name__, s.producer.parameters]))
+					for s in pca_system.streams])
+
+	@staticmethod
+	def get_unit_signatures(pca_system: PCASystem):
+		"""
+		:param pca_system: PCASystem
+		:return: unit name -> (producer name, signature)
+		"""
+		signatures = dict()
+		for unit in pca_system.get_stream_units():
+			streams = unit.streams if isinstance(unit, StreamGroup) else [unit]
+			signatures[unit.get_name()] = (unit.producer.get_name(), PCASystemDiff.get_signature(
+				sorted([PCASystemDiff.get_signature(stream) for stream in streams])))
+		return signatures
+
+	def is_empty(self):
+		"""
+		:return: True if nothing has to be restarted
+		"""
+		return not (self.recorder or self.producers or self.units or self.controller)
+
+	def __str__(self):
+		"""
+		:return: description of the changes
+		"""
+		changes = []
+		if self.producers:
+			changes.append('producers: ' + ', '.join(sorted(self.producers)))
+		if self.units:
+			changes.append('streams: ' + ', '.join(sorted(self.units)))
+		if self.controller:
+			changes.append('stream-controller')
+		if self.recorder:
+			changes.append('recorder')
+		return '; '.join(changes)
+
+
 class PCALoader(Loader):
 	"""
 	Implementation of Loader, that is capable of loading a PCASystem from the package system.
+	The modules are not imported up front: a manifest (class name -> module) is built from
+	the module names (cached on disk until the module directories change) and a class is
+	imported when a configuration refers to it for the first time.
 	"""
 	LOGGER = logging.getLogger('PCALoader')
 	module_package = 'raspberry_sec.module'
 	allowed_modules = {'action', 'consumer', 'producer'}
 	loaded_classes = {Action: {}, Consumer: {}, Producer: {}}
+	base_classes = {'action': Action, 'consumer': Consumer, 'producer': Producer}
+	manifest = None
+
+	@staticmethod
+	def get_abs_path(file: str):
+		"""
+		:return: the absolute path to file
+		"""
+		return os.path.abspath(os.path.join(os.path.dirname(__file__), file))
+
+	MANIFEST_PATH = get_abs_path.__func__('../module/.manifest.json')
 
 	@staticmethod
 	def filter_for_allowed_modules(modules: list):
@@ -250,24 +635,96 @@ class PCALoader(Loader):
 			class_names.append('.'.join([_module, package_name.capitalize() + module_name.capitalize()]))
 		return class_names
 
-	def load(self):
+	@staticmethod
+	def get_manifest_signature():
+		"""
+		Adding, removing or renaming a module changes the modification time of its directory
+		:return: directory -> modification time for the directories of the module package
 		"""
-		Loads and stores the newly loaded class objects
+		root = importlib.import_module(PCALoader.module_package).__path__[0]
+		signature = dict()
+		for path, directories, _ in os.walk(root):
+			directories[:] = [d for d in directories if d != '__pycache__']
+			signature[os.path.relpath(path, root)] = os.stat(path).st_mtime_ns
+		return signature
+
+	@staticmethod
+	def build_manifest():
+		"""
+		Discovers the components without importing them
+		:return: class name -> [full class name, kind (action/consumer/producer)]
 		"""
 		modules = DynamicLoader.list_modules(PCALoader.module_package)
 		modules = PCALoader.filter_for_allowed_modules(modules)
-		classes = PCALoader.generate_class_names(modules)
+		manifest = dict()
+		for _class in PCALoader.generate_class_names(modules):
+			manifest[_class.split('.')[-1]] = [_class, _class.split('.')[-2]]
+		return manifest
+
+	@staticmethod
+	def get_manifest(path: str=MANIFEST_PATH):
+		"""
+		:param path: of the manifest cache file
+		:return: the manifest (read from the cache if it is still valid)
+		"""
+		if PCALoader.manifest is not None:
+			return PCALoader.manifest
 
-		for _class in classes:
+		signature = PCALoader.get_manifest_signature()
+		try:
+			with open(path, 'r') as file:
+				cached = json.load(file)
+			if cached['signature'] == signature:
+				PCALoader.manifest = cached['classes']
+				return PCALoader.manifest
+		except (OSError, ValueError, KeyError):
+			pass
+
+		PCALoader.LOGGER.info('Building component manifest')
+		PCALoader.manifest = PCALoader.build_manifest()
+		try:
+			with open(path, 'w') as file:
+				json.dump({'signature': signature, 'classes': PCALoader.manifest}, file, indent=4, sort_keys=True)
+		except OSError as e:
+			PCALoader.LOGGER.warning('Cannot cache component manifest: ' + str(e))
+		return PCALoader.manifest
+
+	def get_class(self, kind: str, class_name: str):
+		"""
+		Imports the class on the first use
+		:param kind: action, consumer or producer
+		:param class_name: e.g. CameraProducer
+		:return: class object
+		:raises KeyError: if there is no such component
+		"""
+		base_class = PCALoader.base_classes[kind]
+		loaded = self.loaded_classes[base_class]
+		if class_name not in loaded:
+			entry = PCALoader.get_manifest().get(class_name)
+			if entry is None or entry[1] != kind:
+				PCALoader.LOGGER.error(class_name + ' - Unknown ' + kind)
+				raise KeyError(class_name)
 			try:
-				loaded_class = DynamicLoader.load_class(_class)
-				PCALoader.LOGGER.info('Loaded: ' + _class)
-				for key in self.loaded_classes.keys():
-					if issubclass(loaded_class, key):
-						self.loaded_classes[key][loaded_class.__name__] = loaded_class
-						break
+				loaded_class = DynamicLoader.load_class(entry[0])
 			except ImportError:
-				PCALoader.LOGGER.error(_class + ' - Cannot be imported')
+				PCALoader.LOGGER.error(entry[0] + ' - Cannot be imported')
+				raise
+			if not issubclass(loaded_class, base_class):
+				PCALoader.LOGGER.error(entry[0] + ' - Not a subclass of ' + base_class.__name__)
+				raise KeyError(class_name)
+			PCALoader.LOGGER.info('Loaded: ' + entry[0])
+			loaded[class_name] = loaded_class
+		return loaded[class_name]
+
+	def load(self):
+		"""
+		Loads and stores every component (normally they are loaded on demand, see get_class)
+		"""
+		for class_name, (_class, kind) in PCALoader.get_manifest().items():
+			try:
+				self.get_class(kind, class_name)
+			except (ImportError, KeyError):
+				pass
 
 	def get_actions(self):
 		"""
@@ -331,6 +788,7 @@ class PCASystemJSONEncoder(JSONEncoder):
 			obj_dict['consumers'].append(c)
 
 		obj_dict['name'] = obj.name
+		obj_dict['adaptive'] = obj.adaptive
 
 		obj_dict[PCASystemJSONEncoder.TYPE] = Stream.__name__
 		return obj_dict
@@ -343,7 +801,12 @@ class PCASystemJSONEncoder(JSONEncoder):
 		"""
 		obj_dict = dict()
 		obj_dict['streams'] = list(obj.streams)
+		obj_dict['shared_stages'] = obj.shared_stages
+		obj_dict['start_method'] = obj.start_method
+		obj_dict['preload'] = obj.preload
 		obj_dict['stream_controller'] = obj.stream_controller
+		if obj.recorder is not None:
+			obj_dict['recorder'] = obj.recorder.parameters
 		obj_dict[PCASystemJSONEncoder.TYPE] = PCASystem.__name__
 		return obj_dict
 
@@ -356,6 +819,15 @@ class PCASystemJSONEncoder(JSONEncoder):
 		obj_dict = dict()
 		obj_dict['msg_limit'] = obj.message_limit
 		obj_dict['polling_interval'] = obj.polling_interval
+		obj_dict['alert_window'] = obj.alert_window
+		obj_dict['debounce'] = obj.debounce
+		obj_dict['outbox_path'] = obj.outbox_path
+		obj_dict['action_concurrency'] = obj.action_concurrency
+		obj_dict['incident_timeout'] = obj.incident_timeout
+		obj_dict['stream_suppression'] = obj.stream_suppression
+		obj_dict['zone_suppression'] = obj.zone_suppression
+		obj_dict['max_action_rate'] = obj.max_action_rate
+		obj_dict['action_burst'] = obj.action_burst
 		obj_dict['query'] = obj.query
 		obj_dict['action'] = dict()
 
@@ -392,11 +864,8 @@ class PCASystemJSONDecoder(JSONDecoder):
 		:param args:
 		:param kwargs:
 		"""
-		pca_loader = PCALoader()
-		pca_loader.load()
-		self.loaded_producers = pca_loader.get_producers()
-		self.loaded_consumers = pca_loader.get_consumers()
-		self.loaded_actions = pca_loader.get_actions()
+		# the components are imported lazily, only the ones the configuration refers to
+		self.pca_loader = PCALoader()
 
 		json.JSONDecoder.__init__(self, object_hook=self.object_hook, *args, **kwargs)
 
@@ -421,16 +890,17 @@ class PCASystemJSONDecoder(JSONDecoder):
 		"""
 		try:
 			new_stream = Stream(_name=obj_dict['name'])
+			new_stream.adaptive = bool(obj_dict.get('adaptive', False))
 
 			producer_class_name = obj_dict['producer'][PCASystemJSONEncoder.TYPE]
 			parameters_dict = obj_dict['producer'][PCASystemJSONEncoder.PARAMETERS]
-			new_stream.producer = self.loaded_producers[producer_class_name](parameters_dict)
+			new_stream.producer = self.pca_loader.get_class('producer', producer_class_name)(parameters_dict)
 
 			new_stream.consumers = list()
 			for consumer in obj_dict['consumers']:
 				consumer_class_name = consumer[PCASystemJSONEncoder.TYPE]
 				parameters_dict = consumer[PCASystemJSONEncoder.PARAMETERS]
-				new_stream.consumers.append(self.loaded_consumers[consumer_class_name](parameters_dict))
+				new_stream.consumers.append(self.pca_loader.get_class('consumer', consumer_class_name)(parameters_dict))
 
 			return new_stream
 		except KeyError:
@@ -445,13 +915,22 @@ class PCASystemJSONDecoder(JSONDecoder):
 		try:
 			stream_controller = StreamController()
 			stream_controller.query = obj_dict['query']
-			stream_controller.msg_limit = int(obj_dict['msg_limit'])
+			stream_controller.message_limit = int(obj_dict['msg_limit'])
 			stream_controller.polling_interval = int(obj_dict['polling_interval'])
+			stream_controller.alert_window = float(obj_dict.get('alert_window', stream_controller.polling_interval))
+			stream_controller.debounce = float(obj_dict.get('debounce', stream_controller.polling_interval))
+			stream_controller.outbox_path = obj_dict.get('outbox_path')
+			stream_controller.action_concurrency = int(obj_dict.get('action_concurrency', stream_controller.action_concurrency))
+			stream_controller.incident_timeout = float(obj_dict.get('incident_timeout', 0))
+			stream_controller.stream_suppression = dict(obj_dict.get('stream_suppression', dict()))
+			stream_controller.zone_suppression = dict(obj_dict.get('zone_suppression', dict()))
+			stream_controller.max_action_rate = float(obj_dict.get('max_action_rate', 0))
+			stream_controller.action_burst = int(obj_dict.get('action_burst', stream_controller.action_burst))
 
 			action_class_name = obj_dict['action'][PCASystemJSONEncoder.TYPE]
 			parameters_dict = obj_dict['action'][PCASystemJSONEncoder.PARAMETERS]
 
-			stream_controller.action = self.loaded_actions[action_class_name](parameters_dict)
+			stream_controller.action = self.pca_loader.get_class('action', action_class_name)(parameters_dict)
 			return stream_controller
 		except KeyError:
 			PCASystemJSONDecoder.LOGGER.error('Cannot load StreamController from JSON')
@@ -466,6 +945,11 @@ class PCASystemJSONDecoder(JSONDecoder):
 			pca_system = PCASystem()
 			pca_system.stream_controller = obj_dict['stream_controller']
 			pca_system.streams = obj_dict['streams']
+			pca_system.shared_stages = bool(obj_dict.get('shared_stages', False))
+			pca_system.start_method = obj_dict.get('start_method')
+			pca_system.preload = list(obj_dict.get('preload', []))
+			if obj_dict.get('recorder') is not None:
+				pca_system.recorder = ClipRecorder(obj_dict['recorder'])
 			return pca_system
 		except KeyError:
 			PCASystemJSONDecoder.LOGGER.error('Cannot load PCASystem from JSON')
@@ -0,0 +1,248 @@
+import re
+import logging
+
+
+class QuerySyntaxError(ValueError):
+	"""
+	Raised when an alert query cannot be parsed
+	"""
+	pass
+
+
+class QueryNode:
+	"""
+	Base class of the nodes of a compiled alert query
+	"""
+	def evaluate(self, active: int, times: list):
+		"""
+		:param active: bitset of the streams that are currently alerting
+		:param times: time of the last alert of every stream (None if it has not alerted)
+		:return: True or False
+		"""
+		pass
+
+
+class ConstantNode(QueryNode):
+	"""
+	True or False literal
+	"""
+	def __init__(self, value: bool):
+		self.value = value
+
+	def evaluate(self, active: int, times: list):
+		return self.value
+
+
+class StreamNode(QueryNode):
+	"""
+	Reference to a stream (@NAME@), True if the stream is alerting
+	"""
+	def __init__(self, index: int):
+		self.mask = 1 << index
+
+	def evaluate(self, active: int, times: list):
+		return bool(active & self.mask)
+
+
+class NotNode(QueryNode):
+	"""
+	Logical negation
+	"""
+	def __init__(self, operand: QueryNode):
+		self.operand = operand
+
+	def evaluate(self, active: int, times: list):
+		return not self.operand.evaluate(active, times)
+
+
+class AndNode(QueryNode):
+	"""
+	Logical conjunction (short-circuiting)
+	"""
+	def __init__(self, operands: list):
+		self.operands = operands
+
+	def evaluate(self, active: int, times: list):
+		return all(operand.evaluate(active, times) for operand in self.operands)
+
+
+class OrNode(QueryNode):
+	"""
+	Logical disjunction (short-circuiting)
+	"""
+	def __init__(self, operands: list):
+		self.operands = operands
+
+	def evaluate(self, active: int, times: list):
+		return any(operand.evaluate(active, times) for operand in self.operands)
+
+
+class WithinNode(QueryNode):
+	"""
+	@A@ within N s of @B@: both streams alerted, their last alerts are at most
+	N seconds apart and at least one of them is still alerting
+	"""
+	def __init__(self, first: int, second: int, seconds: float):
+		self.first = first
+		self.second = second
+		self.mask = (1 << first) | (1 << second)
+		self.seconds = seconds
+
+	def evaluate(self, active: int, times: list):
+		if not active & self.mask:
+			return False
+		first_time = times[self.first]
+		second_time = times[self.second]
+		if first_time is None or second_time is None:
+			return False
+		return abs(first_time - second_time) <= self.seconds
+
+
+class AlertQuery:
+	"""
+	Alert query compiled once into a tree of QueryNode-s.
+	Grammar (keywords are case insensitive):
+		expr   := term ('or' term)*
+		term   := factor ('and' factor)*
+		factor := 'not' factor | '(' expr ')' | 'True' | 'False' | stream ['within' NUMBER['s'] 'of' stream]
+		stream := '@' NAME '@'
+	Stream names are case insensitive, every stream gets a bit in the state bitset.
+	"""
+	LOGGER = logging.getLogger('AlertQuery')
+	TOKEN_PATTERN = re.compile(r'\s*(?:(@[^@]*@)|(\d+(?:\.\d*)?)s?\b|(\()|(\))|(\w+))')
+
+	def __init__(self, text: str):
+		"""
+		Constructor, parses the query
+		:param text: e.g. '@STREAM1@ and (@STREAM2@ within 10s of @STREAM3@)'
+		"""
+		self.text = text
+		self.streams = []
+		self.indexes = dict()
+		self.horizon = 0
+		self.tokens = AlertQuery.tokenize(text)
+		self.position = 0
+		self.root = self.parse_expr()
+		if self.position != len(self.tokens):
+			raise QuerySyntaxError('Unexpected token: ' + self.tokens[self.position][1])
+		self.tokens = None
+
+	@staticmethod
+	def tokenize(text: str):
+		"""
+		:param text: query
+		:return: list of (kind, value) pairs
+		"""
+		kinds = ('stream', 'number', '(', ')', 'word')
+		tokens = []
+		position = 0
+		text = text.rstrip()
+		while position < len(text):
+			match = AlertQuery.TOKEN_PATTERN.match(text, position)
+			if not match or match.end() == position:
+				raise QuerySyntaxError('Invalid character at ' + str(position) + ' in: ' + text)
+			for kind, value in zip(kinds, match.groups()):
+				if value is not None:
+					tokens.append((kind, value))
+			position = match.end()
+		return tokens
+
+	def peek(self):
+		"""
+		:return: the next token or (None, None)
+		"""
+		if self.position < len(self.tokens):
+			return self.tokens[self.position]
+		return None, None
+
+	def next_token(self):
+		"""
+		:return: the next token, consumes it
+		"""
+		token = self.peek()
+		if token[0] is None:
+			raise QuerySyntaxError('Unexpected end of query: ' + self.text)
+		self.position += 1
+		return token
+
+	def accept_word(self, word: str):
+		"""
+		:param word: keyword
+		:return: True if the next token is the keyword (it is consumed then)
+		"""
+		kind, value = self.peek()
+		if kind == 'word' and value.lower() == word:
+			self.position += 1
+			return True
+		return False
+
+	def get_index(self, name: str):
+		"""
+		:param name: stream name
+		:return: bit index of the stream or None if the query does not refer to it
+		"""
+		index = self.indexes.get(name)
+		if index is None:
+			index = self.indexes.get(name.upper())
+			if index is not None:
+				self.indexes[name] = index
+		return index
+
+	def register_stream(self, token: str):
+		"""
+		:param token: @NAME@
+		:return: bit index of the stream
+		"""
+		name = token[1:-1].upper()
+		if name not in self.indexes:
+			self.indexes[name] = len(self.streams)
+			self.streams.append(name)
+		return self.indexes[name]
+
+	def parse_expr(self):
+		operands = [self.parse_term()]
+		while self.accept_word('or'):
+			operands.append(self.parse_term())
+		return operands[0] if len(operands) == 1 else OrNode(operands)
+
+	def parse_term(self):
+		operands = [self.parse_factor()]
+		while self.accept_word('and'):
+			operands.append(self.parse_factor())
+		return operands[0] if len(operands) == 1 else AndNode(operands)
+
+	def parse_factor(self):
+		if self.accept_word('not'):
+			return NotNode(self.parse_factor())
+
+		kind, value = self.next_token()
+		if kind == '(':
+			node = self.parse_expr()
+			if self.next_token()[0] != ')':
+				raise QuerySyntaxError('Missing closing parenthesis in: ' + self.text)
+			return node
+		elif kind == 'word' and value.lower() in ('true', 'false'):
+			return ConstantNode(value.lower() == 'true')
+		elif kind == 'stream':
+			index = self.register_stream(value)
+			if not self.accept_word('within'):
+				return StreamNode(index)
+
+			kind, seconds = self.next_token()
+			if kind != 'number' or not self.accept_word('of'):
+				raise QuerySyntaxError('Expected "within <seconds>s of @STREAM@" in: ' + self.text)
+			kind, other = self.next_token()
+			if kind != 'stream':
+				raise QuerySyntaxError('Expected a stream after "of" in: ' + self.text)
+			self.horizon = max(self.horizon, float(seconds))
+			return WithinNode(index, self.register_stream(other), float(seconds))
+		else:
+			raise QuerySyntaxError('Unexpected token: ' + value)
+
+	def evaluate(self, active: int, times: list):
+		"""
+		:param active: bitset of the alerting streams (bit i belongs to streams[i])
+		:param times: time of the last alert of every stream (None if unknown)
+		:return: True or False
+		"""
+		return self.root.evaluate(active, times)
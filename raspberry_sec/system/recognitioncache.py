@@ -0,0 +1,126 @@
+import time
+import numpy as np
+from collections import OrderedDict
+from raspberry_sec.interface.consumer import ConsumerContext
+
+
+class RecognitionCache:
+	"""
+	LRU cache of recognition verdicts with a time to live, so a face that stays
+	in view is not recognized again on every frame.
+	Faces are identified by their track id (see FacedetectorConsumer) if known,
+	otherwise by a perceptual hash (dHash) of the face image: two hashes are
+	considered the same face if they differ in at most 'max_distance' bits.
+	A verdict is trusted for 'ttl' seconds, afterwards the face is recognized again.
+	"""
+	HASH_SIZE = 8
+
+	def __init__(self, ttl: float, capacity: int=64, max_distance: int=6):
+		"""
+		Constructor
+		:param ttl: lifetime of a verdict in seconds (0 disables the cache)
+		:param capacity: maximum number of verdicts kept
+		:param max_distance: maximum Hamming distance of matching hashes
+		"""
+		self.ttl = ttl
+		self.capacity = capacity
+		self.max_distance = max_distance
+		self.entries = OrderedDict()
+
+	@staticmethod
+	def get_hash(face: np.ndarray):
+		"""
+		Difference hash: the image is averaged into a 8x9 grid and
+		every bit tells whether a cell is brighter than its right neighbour
+		:param face: grayscale (or BGR) image
+		:return: 64 bit integer
+		"""
+		if face.ndim == 3:
+			face = face.mean(axis=2)
+		size = RecognitionCache.HASH_SIZE
+		rows = np.linspace(0, face.shape[0], size + 1).astype(int)[:-1]
+		columns = np.linspace(0, face.shape[1], size + 2).astype(int)[:-1]
+		grid = np.add.reduceat(np.add.reduceat(face.astype(np.float64), rows, axis=0), columns, axis=1)
+		# the cells are not equally big, normalize the sums
+		grid /= np.maximum(np.outer(np.diff(np.append(rows, face.shape[0])), np.diff(np.append(columns, face.shape[1]))), 1)
+		bits = (grid[:, 1:] > grid[:, :-1]).reshape(-1)
+		return int(np.packbits(bits).view('>u8')[0])
+
+	@staticmethod
+	def get_keys(context: ConsumerContext, faces: list):
+		"""
+		:param context: ConsumerContext (region_ids are used if they belong to the faces)
+		:param faces: the faces in the context
+		:return: list of keys, ('track', id) or ('hash', dHash)
+		"""
+		ids = context.region_ids
+		if ids is not None and len(ids) >= len(faces):
+			return [('track', track_id) for track_id in ids[:len(faces)]]
+		return [('hash', RecognitionCache.get_hash(face)) for face in faces]
+
+	def find(self, key: tuple, now: float):
+		"""
+		:param key: see get_keys
+		:param now: current time
+		:return: key of the matching, still valid entry or None
+		"""
+		if key in self.entries:
+			return key if now - self.entries[key][0] < self.ttl else None
+
+		if key[0] == 'hash':
+			for other, (timestamp, _) in self.entries.items():
+				if other[0] == 'hash' and now - timestamp < self.ttl \
+						and bin(other[1] ^ key[1]).count('1') <= self.max_distance:
+					return other
+		return None
+
+	def get(self, key: tuple, now: float=None):
+		"""
+		:param key: see get_keys
+		:param now: current time (time.monotonic() if not given)
+		:return: the cached verdict or None
+		"""
+		if not self.ttl:
+			return None
+		now = time.monotonic() if now is None else now
+
+		found = self.find(key, now)
+		if found is None:
+			self.entries.pop(key, None)
+			return None
+		self.entries.move_to_end(found)
+		return self.entries[found][1]
+
+	def put(self, key: tuple, verdict, now: float=None):
+		"""
+		Stores the verdict, evicts the least recently used one if the cache is full
+		:param key: see get_keys
+		:param verdict: any object (except None)
+		:param now: current time (time.monotonic() if not given)
+		"""
+		if not self.ttl:
+			return
+		now = time.monotonic() if now is None else now
+
+		self.entries[key] = (now, verdict)
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.capacity:
+			self.entries.popitem(last=False)
+
+	def lookup(self, keys: list, recognize, now: float=None):
+		"""
+		Returns the cached verdicts and runs the recognition for the rest
+		:param keys: see get_keys
+		:param recognize: function taking the list of indexes of the missing verdicts
+		and returning their verdicts in the same order
+		:param now: current time (time.monotonic() if not given)
+		:return: list of verdicts
+		"""
+		now = time.monotonic() if now is None else now
+		verdicts = [self.get(key, now) for key in keys]
+		missing = [i for i, verdict in enumerate(verdicts) if verdict is None]
+		if missing:
+			for i, verdict in zip(missing, recognize(missing)):
+				verdicts[i] = verdict
+				self.put(keys[i], verdict, now)
+		return verdicts
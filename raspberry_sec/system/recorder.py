@@ -0,0 +1,433 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+from collections import deque
+from queue import Empty, Full
+from multiprocessing import Queue, Value, Array
+from raspberry_sec.system.util import ProcessContext, ProcessReady
+
+
+class ClipIndex:
+	"""
+	SQLite index of the recorded clip segments, it also enforces the size limit
+	of the recordings by deleting the oldest segments.
+	"""
+	LOGGER = logging.getLogger('ClipIndex')
+
+	def __init__(self, path: str):
+		"""
+		Constructor
+		:param path: of the database file (':memory:' for a non-durable index)
+		"""
+		self.path = path
+		self.connection = None
+
+	def open(self):
+		"""
+		Opens (and creates if needed) the database
+		"""
+		if self.connection is not None:
+			return
+		if self.path != ':memory:':
+			os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		self.connection = sqlite3.connect(self.path, isolation_level=None)
+		self.connection.execute('PRAGMA journal_mode=WAL')
+		self.connection.execute(
+			'CREATE TABLE IF NOT EXISTS clips ('
+			'id INTEGER PRIMARY KEY AUTOINCREMENT, camera TEXT NOT NULL, incident TEXT NOT NULL, '
+			'path TEXT NOT NULL, start REAL NOT NULL, end REAL NOT NULL, frames INTEGER NOT NULL, size INTEGER NOT NULL)')
+		self.connection.execute('CREATE INDEX IF NOT EXISTS clips_start ON clips (start)')
+		self.connection.execute('CREATE INDEX IF NOT EXISTS clips_incident ON clips (incident)')
+
+	def add(self, camera: str, incident: str, path: str, start: float, end: float, frames: int, size: int):
+		"""
+		Registers a segment
+		:param camera: name of the camera
+		:param incident: id of the incident
+		:param path: of the segment file
+		:param start: time of the first frame (seconds since the epoch)
+		:param end: time of the last frame (seconds since the epoch)
+		:param frames: number of frames
+		:param size: in bytes
+		"""
+		self.connection.execute(
+			'INSERT INTO clips (camera, incident, path, start, end, frames, size) VALUES (?, ?, ?, ?, ?, ?, ?)',
+			(camera, incident, path, start, end, frames, size))
+
+	def get_clips(self, incident: str=None, limit: int=100):
+		"""
+		:param incident: id of the incident (None means every incident)
+		:param limit: maximum number of segments
+		:return: list of segment dictionaries, the newest first
+		"""
+		query = 'SELECT camera, incident, path, start, end, frames, size FROM clips'
+		args = ()
+		if incident is not None:
+			query += ' WHERE incident = ?'
+			args = (incident, )
+		rows = self.connection.execute(query + ' ORDER BY start DESC LIMIT ?', args + (limit, )).fetchall()
+		keys = ('camera', 'incident', 'path', 'start', 'end', 'frames', 'size')
+		return [dict(zip(keys, row)) for row in rows]
+
+	def get_paths(self):
+		"""
+		:return: set of the paths of the indexed segments
+		"""
+		return set([row[0] for row in self.connection.execute('SELECT path FROM clips')])
+
+	def get_total_size(self):
+		"""
+		:return: size of the recorded segments in bytes
+		"""
+		(total, ) = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM clips').fetchone()
+		return total
+
+	def evict(self, max_size: int):
+		"""
+		Deletes the oldest segments until the recordings fit into max_size
+		:param max_size: in bytes
+		:return: number of segments deleted
+		"""
+		total = self.get_total_size()
+		evicted = 0
+		while total > max_size:
+			row = self.connection.execute('SELECT id, path, size FROM clips ORDER BY start LIMIT 1').fetchone()
+			if row is None:
+				break
+			clip_id, path, size = row
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+			self.connection.execute('DELETE FROM clips WHERE id = ?', (clip_id, ))
+			total -= size
+			evicted += 1
+		if evicted:
+			ClipIndex.LOGGER.info(str(evicted) + ' old clip segments deleted')
+		return evicted
+
+
+class ClipSegment:
+	"""
+	MJPEG file being written (the JPEG frames concatenated)
+	"""
+	def __init__(self, camera: str, incident: str, path: str, start: float):
+		"""
+		Constructor
+		:param camera: name of the camera
+		:param incident: id of the incident
+		:param path: of the file
+		:param start: time of the first frame
+		"""
+		self.camera = camera
+		self.incident = incident
+		self.path = path
+		self.start = start
+		self.end = start
+		self.frames = 0
+		self.size = 0
+		self.updated = time.time()
+		self.file = open(path, 'wb')
+
+	def write(self, timestamp: float, jpeg: bytes):
+		"""
+		:param timestamp: capture time of the frame
+		:param jpeg: encoded frame
+		"""
+		self.file.write(jpeg)
+		# a process dying before close loses no frame
+		self.file.flush()
+		self.end = timestamp
+		self.frames += 1
+		self.size += len(jpeg)
+		self.updated = time.time()
+
+	def close(self):
+		"""
+		Closes the file
+		"""
+		self.file.close()
+
+
+class ClipBuffer:
+	"""
+	Pre-roll buffer of a camera, lives in the producer process.
+	The capture loop only hands over its latest frame (offer), a background thread
+	samples the frames at 'fps', encodes them to JPEG and keeps the last 'pre_roll'
+	seconds in memory. When the ClipRecorder is triggered the buffered frames and
+	the following ones are sent to the recorder process.
+	"""
+	LOGGER = logging.getLogger('ClipBuffer')
+
+	def __init__(self, recorder, camera: str):
+		"""
+		Constructor
+		:param recorder: ClipRecorder
+		:param camera: name of the camera
+		"""
+		self.recorder = recorder
+		self.camera = camera
+		self.pre_roll = recorder.parameters.get('pre_roll', ClipRecorder.PRE_ROLL)
+		self.ring = deque()
+		self.frame = None
+		self.thread = None
+		self.stop_event = threading.Event()
+
+	def start(self):
+		"""
+		Starts the encoder thread
+		"""
+		self.thread = threading.Thread(target=self.encode_loop, name='ClipBuffer', daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		"""
+		Stops the encoder thread (the frames already submitted are written by the recorder)
+		"""
+		self.stop_event.set()
+		if self.thread is not None:
+			self.thread.join()
+
+	def offer(self, img):
+		"""
+		Called by the capture loop, never blocks
+		:param img: the newest frame
+		"""
+		self.frame = img
+
+	def add(self, timestamp: float, jpeg: bytes):
+		"""
+		Buffers the encoded frame or sends it to the recorder (together with the pre-roll)
+		:param timestamp: capture time of the frame
+		:param jpeg: encoded frame
+		"""
+		incident = self.recorder.get_incident(timestamp)
+		if incident is None:
+			self.ring.append((timestamp, jpeg))
+			while timestamp - self.ring[0][0] > self.pre_roll:
+				self.ring.popleft()
+			return
+
+		while self.ring:
+			self.recorder.submit(self.camera, incident, *self.ring.popleft())
+		self.recorder.submit(self.camera, incident, timestamp, jpeg)
+
+	def encode_loop(self):
+		"""
+		Encoder thread
+		"""
+		import cv2
+		interval = 1.0 / self.recorder.parameters.get('fps', ClipRecorder.FPS)
+		quality = [cv2.IMWRITE_JPEG_QUALITY, self.recorder.parameters.get('quality', ClipRecorder.QUALITY)]
+		deadline = time.monotonic()
+		while not self.stop_event.is_set():
+			# a slow encoder skips frames instead of falling behind
+			deadline = max(deadline + interval, time.monotonic())
+			if self.stop_event.wait(max(0.0, deadline - time.monotonic())):
+				break
+			frame, self.frame = self.frame, None
+			if frame is None:
+				continue
+			ret_val, jpeg = cv2.imencode('.jpg', frame, quality)
+			if ret_val:
+				self.add(time.time(), jpeg.tobytes())
+			else:
+				ClipBuffer.LOGGER.warning('Could not encode frame of ' + self.camera)
+
+
+class ClipRecorder(ProcessReady):
+	"""
+	Records video clips of the incidents. Every camera keeps a pre-roll in memory
+	(see ClipBuffer), the StreamController triggers the recording when it notifies
+	about an incident (and extends it while the incident goes on). The frames are
+	written to segmented MJPEG files by a background process, the segments are
+	indexed in SQLite and the oldest ones are deleted above 'max_size_mb'.
+	Every camera is recorded during an incident.
+	"""
+	LOGGER = logging.getLogger('ClipRecorder')
+	PRE_ROLL = 5
+	POST_ROLL = 10
+	FPS = 5
+	QUALITY = 80
+	SEGMENT_LENGTH = 60
+	MAX_SIZE_MB = 1024
+	QUEUE_SIZE = 200
+	IDLE_TIMEOUT = 2
+
+	@staticmethod
+	def get_abs_path(file: str):
+		"""
+		:return: the absolute path to file
+		"""
+		return os.path.abspath(os.path.join(os.path.dirname(__file__), file))
+
+	DEFAULT_DIRECTORY = get_abs_path.__func__('../../clips')
+
+	def __init__(self, parameters: dict):
+		"""
+		Constructor
+		:param parameters: configuration coming from the JSON file (directory, pre_roll, post_roll,
+		fps, quality, segment_length, max_size_mb, queue_size)
+		"""
+		self.parameters = parameters
+		self.queue = Queue(maxsize=parameters.get('queue_size', ClipRecorder.QUEUE_SIZE))
+		# recording goes on until this time (seconds since the epoch)
+		self.until = Value('d', 0.0)
+		self.incident = Array('c', 32)
+		self.dropped = Value('i', 0)
+
+	def get_name(self):
+		"""
+		:return: name of the component
+		"""
+		return 'ClipRecorder'
+
+	def get_directory(self):
+		"""
+		:return: directory of the clips
+		"""
+		return self.parameters.get('directory', ClipRecorder.DEFAULT_DIRECTORY)
+
+	def create_buffer(self, camera: str):
+		"""
+		:param camera: name of the camera
+		:return: new ClipBuffer for the camera
+		"""
+		return ClipBuffer(self, camera)
+
+	def trigger(self, incident: str, now: float=None):
+		"""
+		Starts or extends the recording (called by the StreamController)
+		:param incident: id of the incident
+		:param now: current time (time.time() if not given)
+		"""
+		now = time.time() if now is None else now
+		with self.until.get_lock():
+			self.incident.value = incident[:32].encode()
+			self.until.value = max(self.until.value, now + self.parameters.get('post_roll', ClipRecorder.POST_ROLL))
+
+	def get_incident(self, timestamp: float):
+		"""
+		:param timestamp: capture time of a frame
+		:return: id of the incident being recorded or None if the frame is not needed
+		"""
+		with self.until.get_lock():
+			if self.incident.value and timestamp <= self.until.value:
+				return self.incident.value.decode()
+		return None
+
+	def submit(self, camera: str, incident: str, timestamp: float, jpeg: bytes):
+		"""
+		Hands a frame over to the recorder process, the frame is dropped if it cannot keep up
+		:param camera: name of the camera
+		:param incident: id of the incident
+		:param timestamp: capture time of the frame
+		:param jpeg: encoded frame
+		"""
+		try:
+			self.queue.put_nowait((camera, incident, timestamp, jpeg))
+		except Full:
+			with self.dropped.get_lock():
+				self.dropped.value += 1
+			ClipRecorder.LOGGER.debug('Recorder is busy, frame of ' + camera + ' dropped')
+
+	def open_segment(self, camera: str, incident: str, timestamp: float):
+		"""
+		:param camera: name of the camera
+		:param incident: id of the incident
+		:param timestamp: time of the first frame
+		:return: new ClipSegment
+		"""
+		directory = os.path.join(self.get_directory(), ''.join(c if c.isalnum() else '_' for c in camera))
+		os.makedirs(directory, exist_ok=True)
+		name = time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp)) + '-' + incident[:8] + '.mjpeg'
+		return ClipSegment(camera, incident, os.path.join(directory, name), timestamp)
+
+	def close_segment(self, segment: ClipSegment, index: ClipIndex):
+		"""
+		Closes and indexes the segment, then enforces the size limit
+		:param segment: ClipSegment
+		:param index: ClipIndex
+		"""
+		segment.close()
+		index.add(segment.camera, segment.incident, segment.path, segment.start, segment.end, segment.frames, segment.size)
+		ClipRecorder.LOGGER.info('Clip segment saved: ' + segment.path + ' (' + str(segment.frames) + ' frames)')
+		index.evict(int(self.parameters.get('max_size_mb', ClipRecorder.MAX_SIZE_MB) * 1024 * 1024))
+
+	def write(self, segments: dict, index: ClipIndex, camera: str, incident: str, timestamp: float, jpeg: bytes):
+		"""
+		Appends the frame to the segment of the camera (a new segment is started
+		for a new incident or if the current one is long enough)
+		:param segments: camera name -> open ClipSegment
+		:param index: ClipIndex
+		:param camera: name of the camera
+		:param incident: id of the incident
+		:param timestamp: capture time of the frame
+		:param jpeg: encoded frame
+		"""
+		segment = segments.get(camera)
+		segment_length = self.parameters.get('segment_length', ClipRecorder.SEGMENT_LENGTH)
+		if segment is not None and (segment.incident != incident or timestamp - segment.start >= segment_length):
+			self.close_segment(segments.pop(camera), index)
+			segment = None
+		if segment is None:
+			segment = segments[camera] = self.open_segment(camera, incident, timestamp)
+		segment.write(timestamp, jpeg)
+
+	def close_idle_segments(self, segments: dict, index: ClipIndex, now: float):
+		"""
+		Closes the segments not receiving frames any more (the recording is over)
+		:param segments: camera name -> open ClipSegment
+		:param index: ClipIndex
+		:param now: current time
+		"""
+		for camera in [c for c, s in segments.items() if now - s.updated > ClipRecorder.IDLE_TIMEOUT]:
+			self.close_segment(segments.pop(camera), index)
+
+	def index_orphans(self, index: ClipIndex):
+		"""
+		Indexes the segments left behind by a recorder that could not close them
+		(e.g. power loss), so they are evicted like the others
+		:param index: ClipIndex
+		"""
+		indexed = index.get_paths()
+		for root, _, files in os.walk(self.get_directory()):
+			for name in [f for f in files if f.endswith('.mjpeg')]:
+				path = os.path.join(root, name)
+				if path in indexed:
+					continue
+				ClipRecorder.LOGGER.info('Indexing orphan clip segment: ' + path)
+				mtime = os.path.getmtime(path)
+				incident = os.path.splitext(name)[0].split('-')[-1]
+				index.add(os.path.basename(root), incident, path, mtime, mtime, 0, os.path.getsize(path))
+
+	def run(self, context: ProcessContext):
+		"""
+		Writer loop, runs until the stop event is set. The frames already queued
+		are written then, and every open segment is closed and indexed.
+		:param context: Process context
+		"""
+		ClipRecorder.LOGGER.info('Recording clips into ' + self.get_directory())
+		index = ClipIndex(os.path.join(self.get_directory(), 'clips.db'))
+		index.open()
+		self.index_orphans(index)
+		segments = dict()
+
+		while True:
+			stopping = context.stop_event.is_set()
+			try:
+				if stopping:
+					self.write(segments, index, *self.queue.get_nowait())
+				else:
+					self.write(segments, index, *self.queue.get(timeout=ClipRecorder.IDLE_TIMEOUT))
+			except Empty:
+				if stopping:
+					break
+			except OSError as e:
+				ClipRecorder.LOGGER.error('Cannot write clip: ' + str(e))
+			self.close_idle_segments(segments, index, time.time())
+
+		self.close_idle_segments(segments, index, float('inf'))
+		ClipRecorder.LOGGER.info('Stopped recording')
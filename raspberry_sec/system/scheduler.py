@@ -0,0 +1,153 @@
+import logging
+import time
+from raspberry_sec.interface.consumer import ConsumerContext
+
+
+class ConsumerStats:
+	"""
+	Exponentially smoothed latency and pass-through rate of a Consumer
+	"""
+	EPSILON = 0.01
+
+	def __init__(self, smoothing: float):
+		"""
+		Constructor
+		:param smoothing: weight of the newest measurement (0-1)
+		"""
+		self.smoothing = smoothing
+		self.latency = 0.0
+		self.pass_rate = 1.0
+		self.calls = 0
+
+	def update(self, latency: float, passed: bool):
+		"""
+		Registers a measurement
+		:param latency: in seconds
+		:param passed: True if the consumer left the alert flag set
+		"""
+		if self.calls == 0:
+			self.latency = latency
+			self.pass_rate = 1.0 if passed else 0.0
+		else:
+			self.latency += self.smoothing * (latency - self.latency)
+			self.pass_rate += self.smoothing * ((1.0 if passed else 0.0) - self.pass_rate)
+		self.calls += 1
+
+	def get_rank(self):
+		"""
+		For a chain of independent filters running them in increasing
+		cost / rejection-rate order minimizes the expected cost per sample.
+		:return: rank (lower should run earlier)
+		"""
+		return self.latency / max(1.0 - self.pass_rate, ConsumerStats.EPSILON)
+
+
+class ConsumerScheduler:
+	"""
+	Runs the consumer chain of a Stream and learns the latency and pass-through rate
+	of every consumer. In adaptive mode it reorders the neighbouring gate consumers
+	(see Consumer.is_gate) so that the cheap ones with high rejection rate run first
+	and the expensive ones only see the samples that passed them.
+	Consumers that are not gates keep their configured position, and so do the gates
+	that have not been measured enough. Gates sharing context fields (one reads what
+	the other sets, see Consumer.get_inputs) are never swapped.
+	"""
+	LOGGER = logging.getLogger('ConsumerScheduler')
+	SMOOTHING = 0.05
+	MIN_CALLS = 20
+	REPLAN_INTERVAL = 100
+
+	def __init__(self, consumers: list, adaptive: bool=False,
+				min_calls: int=MIN_CALLS, replan_interval: int=REPLAN_INTERVAL):
+		"""
+		Constructor
+		:param consumers: Consumer-s in configured order
+		:param adaptive: if False the configured order is kept (only statistics are gathered)
+		:param min_calls: measurements needed before a consumer is ranked by its statistics
+		:param replan_interval: number of samples between two reorderings
+		"""
+		self.consumers = consumers
+		self.adaptive = adaptive
+		self.min_calls = min_calls
+		self.replan_interval = replan_interval
+		self.stats = [ConsumerStats(ConsumerScheduler.SMOOTHING) for _ in consumers]
+		self.order = list(range(len(consumers)))
+		self.samples = 0
+
+	@staticmethod
+	def conflicts(consumer1, consumer2):
+		"""
+		:param consumer1: Consumer
+		:param consumer2: Consumer
+		:return: True if the result of one of them depends on whether the other one ran before
+		"""
+		outputs1 = consumer1.get_outputs()
+		outputs2 = consumer2.get_outputs()
+		return bool(consumer1.get_inputs() & outputs2 or consumer2.get_inputs() & outputs1 or outputs1 & outputs2)
+
+	def get_gate_runs(self):
+		"""
+		:return: list of [start, end) index ranges of neighbouring independent gate consumers (in configured order)
+		"""
+		runs = []
+		start = None
+		for index, consumer in enumerate(self.consumers):
+			if consumer.is_gate():
+				# a dependent gate starts a new run, so it stays behind the gates it depends on
+				if start is not None and any(ConsumerScheduler.conflicts(self.consumers[i], consumer) for i in range(start, index)):
+					runs.append((start, index))
+					start = None
+				if start is None:
+					start = index
+			elif start is not None:
+				runs.append((start, index))
+				start = None
+		if start is not None:
+			runs.append((start, len(self.consumers)))
+		return [run for run in runs if run[1] - run[0] > 1]
+
+	def replan(self):
+		"""
+		Reorders the measured gates of the runs by rank, the ones that have not been
+		measured enough stay at their configured position.
+		"""
+		order = list(range(len(self.consumers)))
+		for start, end in self.get_gate_runs():
+			measured = [i for i in range(start, end) if self.stats[i].calls >= self.min_calls]
+			ranked = sorted(measured, key=lambda i: self.stats[i].get_rank())
+			for position, index in zip(measured, ranked):
+				order[position] = index
+
+		if order != self.order:
+			ConsumerScheduler.LOGGER.info('New consumer order: ' + ', '.join([self.consumers[i].get_name() for i in order]))
+			self.order = order
+
+	def get_plan(self):
+		"""
+		:return: Consumer-s in the order they will be called
+		"""
+		return [self.consumers[i] for i in self.order]
+
+	def run(self, context: ConsumerContext):
+		"""
+		Runs the consumers until one of them clears the alert flag
+		:param context: initial context
+		:return: final context
+		"""
+		for index in self.order:
+			if not context.alert:
+				break
+			start = time.perf_counter()
+			context = self.consumers[index].run(context)
+			self.stats[index].update(time.perf_counter() - start, context.alert)
+
+		self.samples += 1
+		if self.samples % self.replan_interval == 0:
+			for index, consumer in enumerate(self.consumers):
+				stats = self.stats[index]
+				ConsumerScheduler.LOGGER.debug(consumer.get_name() + ': ' + str(round(stats.latency * 1000, 2))
+											+ ' ms, pass rate: ' + str(round(stats.pass_rate, 2)))
+			if self.adaptive:
+				self.replan()
+
+		return context
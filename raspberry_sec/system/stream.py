@@ -1,8 +1,13 @@
+import copy
+import json
 import logging
-import re
 import time
-from concurrent.futures import ThreadPoolExecutor
-from itertools import groupby
+from queue import Empty
+from collections import OrderedDict
+from raspberry_sec.system.query import AlertQuery, QuerySyntaxError
+from raspberry_sec.system.scheduler import ConsumerScheduler
+from raspberry_sec.system.outbox import ActionOutbox, ActionDispatcher
+from raspberry_sec.system.incident import Incident, TokenBucket
 from raspberry_sec.system.zonemanager import ZoneManager
 from raspberry_sec.interface.action import ActionMessage
 from raspberry_sec.interface.consumer import ConsumerContext
@@ -14,6 +19,7 @@ class Stream(ProcessReady):
 	Class for storing stream components.
 	"""
 	LOGGER = logging.getLogger('Stream')
+	SAMPLE_TIMEOUT = 1
 
 	def __init__(self, _name: str):
 		"""
@@ -23,7 +29,9 @@ class Stream(ProcessReady):
 		self.name = _name
 		self.producer = None
 		self.consumers = []
-		self.zone_manager = ZoneManager()
+		# reorder the gate consumers based on their measured cost
+		self.adaptive = False
+		self.zone_manager = ZoneManager.get_instance()
 
 	def get_name(self):
 		"""
@@ -65,38 +73,235 @@ class Stream(ProcessReady):
 
 		return True
 
+	def report(self, c_context: ConsumerContext, sc_queue):
+		"""
+		Sends the result of the consumer chain to the StreamController if needed
+		:param c_context: final context of the consumer chain
+		:param sc_queue: queue of the StreamController
+		"""
+		zone = self.producer.get_zone()
+		if c_context.alert and self.zone_manager.is_zone_active(zone):
+			Stream.LOGGER.debug(self.name + ' enqueueing controller message')
+			sc_queue.put(StreamControllerMessage(
+				_alert=c_context.alert,
+				_msg=c_context.alert_data,
+				_sender=self.name,
+				_zone=zone))
+
+	@staticmethod
+	def initialize_consumers(name: str, consumers: list):
+		"""
+		Initializes the consumers eagerly (models are loaded before the first sample).
+		Consumers that fail here are initialized lazily at their first sample.
+		:param name: of the caller (for logging)
+		:param consumers: Consumer-s
+		"""
+		for consumer in consumers:
+			try:
+				start = time.perf_counter()
+				consumer.initialize()
+				Stream.LOGGER.debug(name + ' initialized ' + consumer.get_name() + ' in '
+									+ str(round(time.perf_counter() - start, 2)) + ' s')
+			except Exception as e:
+				Stream.LOGGER.error(name + ' cannot initialize ' + consumer.get_name() + ': ' + str(e))
+
+	@staticmethod
+	def sample_loop(name: str, producer, data_proxy, handler, stop_event):
+		"""
+		Waits for new samples of the producer and hands them over to the handler
+		until the stop event is set.
+		:param name: of the caller (for logging)
+		:param producer: Producer instance
+		:param data_proxy: shared data proxy of the producer
+		:param handler: function taking a ProducerSample
+		:param stop_event: Event telling the loop to finish
+		"""
+		# id of the last processed sample
+		last_seq = 0
+
+		while not stop_event.is_set():
+			try:
+				Stream.LOGGER.debug(name + ' waiting for producer')
+				# the consumers may take longer than the producer needs to overwrite a ring slot
+				sample = producer.get_next(data_proxy, last_seq, Stream.SAMPLE_TIMEOUT, copy=True)
+				if sample is None:
+					Stream.LOGGER.debug(name + ' did not get a new sample')
+					continue
+				last_seq = sample.seq
+
+				Stream.LOGGER.debug(name + ' calling consumers')
+				handler(sample)
+			except Exception as e:
+				Stream.LOGGER.error('Something really bad happened: ' + e.__str__())
+		Stream.LOGGER.info(name + ' stopped')
+
 	def run(self, context: ProcessContext):
 		"""
 		This method runs the stream.
 		:param context: Process context
 		"""
 		self.validate()
+		Stream.initialize_consumers(self.name, self.consumers)
 
 		# for inter-process communication
 		data_proxy = context.get_prop('shared_data_proxy')
 		sc_queue = context.get_prop('sc_queue')
-		
+		scheduler = ConsumerScheduler(self.consumers, self.adaptive)
+
+		def handle(sample):
+			self.report(scheduler.run(ConsumerContext(sample.data, True)), sc_queue)
+
 		# stream main loop
-		while True:
-			try:
-				Stream.LOGGER.debug(self.name + ' calling producer')
-				data = self.producer.get_data(data_proxy)
-				
-				c_context = ConsumerContext(data, True)
-				for consumer in self.consumers:
-					if not c_context.alert:
-						break
-					Stream.LOGGER.debug(self.name + ' calling consumer: ' + consumer.get_name())
-					c_context = consumer.run(c_context)
-
-				if c_context.alert and self.zone_manager.is_zone_active(self.producer.get_zone()):
-					Stream.LOGGER.debug(self.name + ' enqueueing controller message')
-					sc_queue.put(StreamControllerMessage(
-						_alert=c_context.alert,
-						_msg=c_context.alert_data,
-						_sender=self.name))
-			except Exception as e:
-				Stream.LOGGER.error('Something really bad happened: ' + e.__str__())
+		Stream.sample_loop(self.name, self.producer, data_proxy, handle, context.stop_event)
+
+
+class StageNode:
+	"""
+	Node of the consumer tree of a StreamGroup
+	"""
+	def __init__(self, consumer, key):
+		"""
+		Constructor
+		:param consumer: Consumer instance (None for the root)
+		:param key: identifies the stage (class name and parameters)
+		"""
+		self.consumer = consumer
+		self.key = key
+		self.children = []
+		self.streams = []
+
+
+class StreamGroup(ProcessReady):
+	"""
+	Streams that share a producer and start with identical consumers (same class and parameters).
+	Their consumer chains are merged into a tree, so the common prefix runs only once
+	per sample and its result is fanned out to the rest of the chains.
+	The whole group runs in a single process.
+	"""
+	LOGGER = logging.getLogger('StreamGroup')
+
+	def __init__(self, streams: list):
+		"""
+		Constructor
+		:param streams: Stream-s with the same producer
+		"""
+		self.streams = streams
+		self.producer = streams[0].producer
+		self.root = StageNode(None, None)
+		for stream in streams:
+			self.add_stream(stream)
+
+	@staticmethod
+	def get_stage_key(consumer):
+		"""
+		:param consumer: Consumer instance
+		:return: key, equal for the consumers that do exactly the same
+		"""
+		return type(consumer).__name__, json.dumps(consumer.parameters, sort_keys=True)
+
+	@staticmethod
+	def group_streams(streams):
+		"""
+		Groups the streams that can share stages. Adaptive streams reorder their own
+		consumers (see ConsumerScheduler), so they always run alone.
+		:param streams: Stream-s
+		:return: list of lists of Stream-s (a list contains streams sharing the producer and the first stage)
+		"""
+		groups = OrderedDict()
+		alone = []
+		for stream in sorted(streams, key=lambda s: s.get_name()):
+			if stream.adaptive:
+				alone.append([stream])
+				continue
+			first_stage = StreamGroup.get_stage_key(stream.consumers[0]) if stream.consumers else None
+			groups.setdefault((stream.producer, first_stage), []).append(stream)
+		return list(groups.values()) + alone
+
+	def add_stream(self, stream: Stream):
+		"""
+		Merges the consumer chain of the stream into the tree
+		:param stream: Stream instance
+		"""
+		node = self.root
+		for consumer in stream.consumers:
+			key = StreamGroup.get_stage_key(consumer)
+			child = next((c for c in node.children if c.key == key), None)
+			if child is None:
+				child = StageNode(consumer, key)
+				node.children.append(child)
+			node = child
+		node.streams.append(stream)
+
+	def count_stages(self, node: StageNode=None):
+		"""
+		:param node: root of the subtree (root of the tree if None)
+		:return: number of consumers that run per sample at most
+		"""
+		node = node if node else self.root
+		return sum([1 + self.count_stages(child) for child in node.children])
+
+	def get_consumers(self, node: StageNode=None):
+		"""
+		:param node: root of the subtree (root of the tree if None)
+		:return: the consumers of the subtree (each stage once)
+		"""
+		node = node if node else self.root
+		consumers = []
+		for child in node.children:
+			consumers.append(child.consumer)
+			consumers.extend(self.get_consumers(child))
+		return consumers
+
+	def get_name(self):
+		"""
+		:return: name of the group
+		"""
+		return '+'.join([stream.get_name() for stream in self.streams])
+
+	def execute(self, node: StageNode, c_context: ConsumerContext, results: list):
+		"""
+		Runs the subtree on the context
+		:param node: StageNode
+		:param c_context: context coming from the parent stage
+		:param results: list of (Stream, final context) pairs to be extended
+		"""
+		if node.consumer is not None:
+			c_context = node.consumer.run(c_context)
+		if not c_context.alert:
+			return
+
+		for stream in node.streams:
+			results.append((stream, c_context))
+
+		for child in node.children:
+			# every branch works on its own context
+			if node.streams or len(node.children) > 1:
+				child_context = copy.copy(c_context)
+			else:
+				child_context = c_context
+			self.execute(child, child_context, results)
+
+	def run(self, context: ProcessContext):
+		"""
+		This method runs the streams of the group.
+		:param context: Process context
+		"""
+		for stream in self.streams:
+			stream.validate()
+		StreamGroup.LOGGER.info(self.get_name() + ' runs ' + str(self.count_stages()) + ' stages instead of '
+								+ str(sum([len(s.consumers) for s in self.streams])))
+		Stream.initialize_consumers(self.get_name(), self.get_consumers())
+
+		data_proxy = context.get_prop('shared_data_proxy')
+		sc_queue = context.get_prop('sc_queue')
+
+		def handle(sample):
+			results = []
+			self.execute(self.root, ConsumerContext(sample.data, True), results)
+			for stream, c_context in results:
+				stream.report(c_context, sc_queue)
+
+		Stream.sample_loop(self.get_name(), self.producer, data_proxy, handle, context.stop_event)
 
 
 class StreamControllerMessage:
@@ -104,16 +309,18 @@ class StreamControllerMessage:
 	Class for managing notifications in case of alerts.
 	@see raspberry_sec.interface.action.Action
 	"""
-	def __init__(self, _alert: bool, _msg, _sender: str):
+	def __init__(self, _alert: bool, _msg, _sender: str, _zone: str=None):
 		"""
 		Constructor
 		:param _alert: True or False
 		:param _msg: content of the alert
 		:param _sender: name of the stream that sent this message
+		:param _zone: zone of the producer of the stream
 		"""
 		self.alert = _alert
 		self.msg = _msg
 		self.sender = _sender
+		self.zone = _zone
 		
 
 class StreamController(ProcessReady):
@@ -121,16 +328,75 @@ class StreamController(ProcessReady):
 	Class for handling StreamControllerMessage-s
 	"""
 	LOGGER = logging.getLogger('StreamController')
-	PLACEHOLDER_PATTERN = '@.*?@'
+	# maximum seconds between two checks of the stop event
+	STOP_CHECK_INTERVAL = 1
 
 	def __init__(self):
 		"""
 		Constructor
 		"""
 		self.action = None
+		self.compiled_query = None
 		self.query = 'False'
 		self.polling_interval = 3
 		self.message_limit = 100
+		# seconds a stream alert stays asserted for the query (defaults to polling_interval)
+		self.alert_window = 3
+		# seconds to wait (and coalesce further alerts) between the query becoming True and firing
+		# (defaults to polling_interval, so there is at most one firing per polling interval)
+		self.debounce = 3
+		# database of the durable alert outbox (None means ActionOutbox.DEFAULT_PATH)
+		self.outbox_path = None
+		# maximum number of parallel fire calls of the action
+		self.action_concurrency = 2
+		# seconds without alerts that close an incident, alerts of an open incident
+		# are not notified again (0 means every firing is a separate incident)
+		self.incident_timeout = 0
+		# seconds a stream / zone is muted after it took part in a notification
+		self.stream_suppression = dict()
+		self.zone_suppression = dict()
+		# maximum number of notifications per hour (0 means unlimited) and the allowed burst
+		self.max_action_rate = 0
+		self.action_burst = 1
+		# ClipRecorder triggered by the notified incidents (set by the PCASystem)
+		self.recorder = None
+
+		# runtime state
+		self.alert_times = dict()
+		self.pending = []
+		self.fire_at = None
+		self.incident = None
+		self.suppressed = dict()
+		self.bucket = None
+
+	@property
+	def query(self):
+		"""
+		:return: the alert query as configured
+		"""
+		return self.compiled_query.text
+
+	@query.setter
+	def query(self, query: str):
+		"""
+		Compiles the query once, an invalid query never alerts
+		:param query: logical expression over @STREAM@ placeholders
+		"""
+		self.compiled_query = StreamController.compile_query(query)
+
+	@staticmethod
+	def compile_query(query: str):
+		"""
+		:param query: logical expression
+		:return: AlertQuery (it evaluates to False if the query is invalid)
+		"""
+		try:
+			return AlertQuery(query)
+		except QuerySyntaxError as e:
+			StreamController.LOGGER.error('Could not compile the query: ' + query + ' - ' + str(e))
+			compiled = AlertQuery('False')
+			compiled.text = query
+			return compiled
 
 	@staticmethod
 	def evaluate_query(query: str):
@@ -139,68 +405,210 @@ class StreamController(ProcessReady):
 		:param query: logical expression
 		:return: True or False
 		"""
-		try:
-			StreamController.LOGGER.debug('Evaluating query: ' + query)
-			return eval(query)
-		except Exception:
-			StreamController.LOGGER.error('Could not evaluate the query: ' + query)
-			return False
+		StreamController.LOGGER.debug('Evaluating query: ' + query)
+		return StreamController.compile_query(query).evaluate(0, [])
 
-	def decide_alert(self, messages: list):
+	def get_state(self, senders, now: float):
+		"""
+		Builds the input of the compiled query
+		:param senders: iterable of (stream name, time of its last alert)
+		:param now: current (monotonic) time
+		:return: bitset of the alerting streams and list of alert times
 		"""
-		This method decides based on a list of messages
-		whether to alert or not. For that it puts together a logical
-		expression that it also evaluates afterwards.
+		compiled = self.compiled_query
+		active = 0
+		times = [None] * len(compiled.streams)
+		for sender, alert_time in senders:
+			index = compiled.get_index(sender)
+			if index is None:
+				continue
+			times[index] = alert_time
+			if now - alert_time <= self.alert_window:
+				active |= 1 << index
+		return active, times
+
+	def evaluate_state(self, now: float):
+		"""
+		Evaluates the compiled query over the current state of the streams
+		:param now: current (monotonic) time
+		:return: True or False
+		"""
+		active, times = self.get_state(self.alert_times.items(), now)
+		return self.compiled_query.evaluate(active, times)
+
+	def is_suppressed(self, msg: StreamControllerMessage, now: float):
+		"""
+		:param msg: StreamControllerMessage
+		:param now: current (monotonic) time
+		:return: True if the stream or the zone of the message is muted
+		"""
+		return self.suppressed.get(('stream', msg.sender), 0) > now \
+			or (msg.zone is not None and self.suppressed.get(('zone', msg.zone), 0) > now)
+
+	def suppress(self, messages: list, now: float):
+		"""
+		Mutes the streams and zones of the notified alerts (if they have a suppression window)
+		:param messages: StreamControllerMessage-s
+		:param now: current (monotonic) time
+		"""
+		for msg in messages:
+			if msg.sender in self.stream_suppression:
+				self.suppressed[('stream', msg.sender)] = now + self.stream_suppression[msg.sender]
+			if msg.zone in self.zone_suppression:
+				self.suppressed[('zone', msg.zone)] = now + self.zone_suppression[msg.zone]
+		self.suppressed = {key: until for key, until in self.suppressed.items() if until > now}
+
+	def get_bucket(self, now: float):
+		"""
+		:param now: current (monotonic) time
+		:return: TokenBucket limiting the notifications or None if there is no limit
+		"""
+		if self.max_action_rate <= 0:
+			return None
+		if self.bucket is None:
+			self.bucket = TokenBucket(self.max_action_rate / 3600, max(1, self.action_burst), now)
+		return self.bucket
+
+	def close_incident(self, now: float):
+		"""
+		Closes the notified incident if no alert arrived within incident_timeout
+		:param now: current (monotonic) time
+		"""
+		incident = self.incident
+		if incident is not None and incident.notified and now - incident.end >= self.incident_timeout:
+			StreamController.LOGGER.info(incident.get_summary() + ' - closed after ' + str(round(incident.get_duration(), 1))
+										+ ' seconds, ' + str(incident.alerts) + ' alerts')
+			self.incident = None
+
+	def update_state(self, messages: list, now: float):
+		"""
+		Registers the alerts and evaluates the query if the state of any stream changed.
+		Once the query is True an incident is opened and firing is scheduled after the
+		debounce period, alerts arriving meanwhile are coalesced into the same notification.
+		Alerts arriving after the notification are counted into the incident until it closes.
+		Alerts of suppressed streams and zones are dropped.
 		:param messages: list of StreamControllerMessage-s
-		:return: decision (True/False) and list of ActionMessage-s
+		:param now: current (monotonic) time
 		"""
-		query = self.query
-		action_messages = []
+		self.close_incident(now)
 
-		# iterating through every alert message
-		for sender, msg_iter in groupby(messages, lambda m: m.sender):
-			msg_list = list(msg_iter)
-			StreamController.LOGGER.debug(sender + ' sent ' + str(len(msg_list)) + ' messages')
+		# forget alerts that can no longer be part of a notification
+		if self.fire_at is None:
+			self.pending = [(t, m) for t, m in self.pending if now - t <= self.alert_window]
+			horizon = max(self.alert_window, self.compiled_query.horizon)
+			for sender in [s for s, t in self.alert_times.items() if now - t > horizon]:
+				del self.alert_times[sender]
 
-			sc_messages = [msg for msg in msg_list if msg.alert]
-			if sc_messages:
-				StreamController.LOGGER.debug(sender + ' reported ' + str(len(sc_messages)) + ' alerts')
+		changed = False
+		for msg in messages:
+			if not msg.alert:
+				continue
+			if self.incident is not None:
+				self.incident.add(msg.sender, msg.zone, now)
+				if self.incident.notified:
+					continue
+			elif self.is_suppressed(msg, now):
+				StreamController.LOGGER.debug('Alert of ' + msg.sender + ' is suppressed')
+				continue
+			self.alert_times[msg.sender] = now
+			self.pending.append((now, msg))
+			changed = True
 
-				action_messages += [ActionMessage(scm.msg) for scm in sc_messages]
-				query = query.replace('@' + sender.upper() + '@', 'True')
-			else:
-				query = query.replace('@' + sender.upper() + '@', 'False')
+		if changed and self.fire_at is None and self.evaluate_state(now):
+			StreamController.LOGGER.debug('Query is True, firing in ' + str(self.debounce) + ' seconds')
+			self.incident = Incident(self.pending[0][0])
+			for t, msg in self.pending:
+				self.incident.add(msg.sender, msg.zone, t)
+			self.fire_at = now + self.debounce
+
+	def collect_action_messages(self, now: float):
+		"""
+		Hands over the coalesced alerts of the incident if the debounce period is over
+		(and the action rate allows it) and resets the state
+		:param now: current (monotonic) time
+		:return: list of ActionMessage-s (empty if it is not time to fire)
+		"""
+		if self.fire_at is None or now < self.fire_at:
+			return []
 
-		# making sure no placeholder remains in query
-		query = re.sub(pattern=StreamController.PLACEHOLDER_PATTERN, repl='False', string=query)
+		bucket = self.get_bucket(now)
+		if bucket is not None and not bucket.take(now):
+			# alerts keep being coalesced until the next notification is allowed
+			self.fire_at = now + bucket.get_wait_time(now)
+			StreamController.LOGGER.warning('Action rate limit reached, firing in ' + str(round(self.fire_at - now, 1)) + ' seconds')
+			return []
 
-		return StreamController.evaluate_query(query), action_messages
+		incident = self.incident
+		action_messages = [ActionMessage(m.msg, incident.id) for _, m in self.pending]
+		if self.incident_timeout > 0:
+			action_messages.insert(0, ActionMessage(incident.get_summary(), incident.id))
+		incident.notified = True
+		self.suppress([m for _, m in self.pending], now)
+
+		self.alert_times.clear()
+		self.pending = []
+		self.fire_at = None
+		return action_messages
+
+	def get_timeout(self, now: float):
+		"""
+		:param now: current (monotonic) time
+		:return: seconds until the next deadline or None if there is nothing to wait for
+		"""
+		if self.fire_at is not None:
+			return max(0, self.fire_at - now)
+		if self.incident is not None and self.incident_timeout > 0:
+			return max(0, self.incident.end + self.incident_timeout - now)
+		return None
+
+	def fetch_messages(self, message_queue, timeout):
+		"""
+		Blocks until a message arrives or the deadline passes,
+		then drains what is already in the queue (at most message_limit messages).
+		:param message_queue: queue of StreamControllerMessage-s
+		:param timeout: in seconds, None means waiting forever
+		:return: list of StreamControllerMessage-s
+		"""
+		messages = []
+		try:
+			messages.append(message_queue.get(timeout=timeout))
+			while len(messages) < self.message_limit:
+				messages.append(message_queue.get_nowait())
+		except Empty:
+			pass
+		return messages
 
 	def run(self, context: ProcessContext):
 		"""
-		This method polls the queue for new messages
-		and takes care of the action firing mechanism.
+		This method waits for new messages and takes care of the action firing mechanism.
+		The query is evaluated as soon as a stream reports an alert.
 		:param context: Process context
 		"""
 		message_queue = context.get_prop('message_queue')
 
-		# iterate through messages in queuone
-		with ThreadPoolExecutor(max_workers=4) as executor:
-			while True:
-				StreamController.LOGGER.info('Checking message queue')
-				messages = []
-				count = 0
+		# alerts are stored durably and fired on a background thread
+		outbox = ActionOutbox(self.outbox_path) if self.outbox_path else ActionOutbox()
+		dispatcher = ActionDispatcher(outbox, self.action, self.action_concurrency)
+		dispatcher.start()
+
+		while not context.stop_event.is_set():
+			timeout = self.get_timeout(time.monotonic())
+			timeout = StreamController.STOP_CHECK_INTERVAL if timeout is None else min(timeout, StreamController.STOP_CHECK_INTERVAL)
+			messages = self.fetch_messages(message_queue, timeout)
+			StreamController.LOGGER.debug('Received ' + str(len(messages)) + ' messages')
 
-				# fetch messages
-				while not message_queue.empty() and count <= self.message_limit:
-					messages.append(message_queue.get(block=False))
-					count += 1
+			now = time.monotonic()
+			self.update_state(messages, now)
+			action_messages = self.collect_action_messages(now)
 
-				# process messages
-				alert, action_messages = self.decide_alert(messages)
+			# alert
+			if action_messages:
+				dispatcher.submit(action_messages)
 
-				# alert
-				if alert:
-					executor.submit(self.action.fire, action_messages)
+			# record the incident, the recording is extended while its alerts keep coming
+			if self.recorder is not None and self.incident is not None and self.incident.notified \
+					and (action_messages or any(msg.alert for msg in messages)):
+				self.recorder.trigger(self.incident.id)
 
-				time.sleep(self.polling_interval)
+		# the alerts not fired yet stay in the outbox for the next run
+		StreamController.LOGGER.info('Stopped')
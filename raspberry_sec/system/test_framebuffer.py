@@ -0,0 +1,133 @@
+import time
+import threading
+import unittest
+import multiprocessing as mp
+import numpy as np
+from raspberry_sec.system.framebuffer import SharedFrameRing, SharedFrameDataProxy
+
+
+class TestSharedFrameRingMethods(unittest.TestCase):
+
+    def test_read_returns_none_when_empty(self):
+        # Given
+        ring = SharedFrameRing(slot_size=16, slots=2)
+
+        # When
+        sample = ring.read()
+
+        # Then
+        self.assertIsNone(sample)
+
+    def test_read_returns_latest_frame(self):
+        # Given
+        ring = SharedFrameRing(slot_size=4 * 3 * 3, slots=3)
+        frame1 = np.zeros((4, 3, 3), dtype=np.uint8)
+        frame2 = np.arange(36, dtype=np.uint8).reshape((4, 3, 3))
+
+        # When
+        ring.write(frame1)
+        seq = ring.write(frame2)
+        frame = ring.read().data
+
+        # Then
+        self.assertEqual(2, seq)
+        self.assertEqual(frame2.shape, frame.shape)
+        self.assertTrue(np.array_equal(frame2, frame))
+
+    def test_read_slot_returns_none_when_overwritten(self):
+        # Given
+        ring = SharedFrameRing(slot_size=8, slots=2)
+
+        # When
+        for i in range(3):
+            ring.write(np.full((2, 2), i, dtype=np.uint16))
+
+        # Then
+        self.assertIsNone(ring.read_slot(1))
+        self.assertEqual(2, ring.read_slot(3).data[0, 0])
+
+    def test_write_throws_exception_when_frame_too_big(self):
+        # Given
+        ring = SharedFrameRing(slot_size=8, slots=2)
+
+        # Then
+        self.assertRaises(ValueError, ring.write, np.zeros((3, 3), dtype=np.uint8))
+
+
+    def test_wait_next_returns_none_when_timeout(self):
+        # Given
+        ring = SharedFrameRing(slot_size=4, slots=2)
+        ring.write(np.zeros(4, dtype=np.uint8))
+
+        # When
+        sample = ring.wait_next(after_seq=1, timeout=0.01)
+
+        # Then
+        self.assertIsNone(sample)
+
+    def test_wait_next_returns_newer_frame(self):
+        # Given
+        ring = SharedFrameRing(slot_size=4, slots=2)
+        ring.write(np.zeros(4, dtype=np.uint8))
+        ring.write(np.ones(4, dtype=np.uint8))
+
+        # When
+        sample = ring.wait_next(after_seq=1, timeout=0.01)
+
+        # Then
+        self.assertEqual(2, sample.seq)
+        self.assertEqual(4, sample.data.sum())
+        self.assertIsNotNone(sample.timestamp)
+
+    def test_write_returns_when_waiting_reader_was_terminated(self):
+        # Given
+        ring = SharedFrameRing(slot_size=4, slots=2)
+        reader = mp.get_context('fork').Process(target=ring.wait_next, args=(0, 30))
+        reader.start()
+        time.sleep(0.2)
+        reader.terminate()
+        reader.join()
+
+        # When
+        writer = threading.Thread(target=ring.write, args=(np.ones(4, dtype=np.uint8), ), daemon=True)
+        writer.start()
+        writer.join(5)
+
+        # Then
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(1, ring.wait_next(after_seq=0, timeout=0.01).seq)
+
+
+class TestSharedFrameDataProxyMethods(unittest.TestCase):
+
+    def test_get_data_returns_copy(self):
+        # Given
+        proxy = SharedFrameDataProxy(slot_size=6, slots=2)
+        proxy.set_data(np.ones((2, 3), dtype=np.uint8))
+
+        # When
+        data = proxy.get_data()
+        for value in range(2, 5):
+            proxy.set_data(np.full((2, 3), value, dtype=np.uint8))
+
+        # Then
+        self.assertTrue(data.flags['OWNDATA'])
+        self.assertEqual(6, data.sum())
+
+    def test_get_next_copy_survives_overwrite(self):
+        # Given
+        proxy = SharedFrameDataProxy(slot_size=6, slots=2)
+        proxy.set_data(np.ones((2, 3), dtype=np.uint8))
+
+        # When
+        sample = proxy.get_next(after_seq=0, timeout=0.01, copy=True)
+        for value in range(2, 5):
+            proxy.set_data(np.full((2, 3), value, dtype=np.uint8))
+
+        # Then
+        self.assertTrue(sample.data.flags['OWNDATA'])
+        self.assertEqual(6, sample.data.sum())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import numpy as np
+from raspberry_sec.system.framecache import FrameCache
+from raspberry_sec.interface.consumer import ConsumerContext
+
+
+class TestFrameCacheMethods(unittest.TestCase):
+
+    def setUp(self):
+        image = np.zeros((40, 60, 3), dtype=np.uint8)
+        image[10:30, 20:40] = (255, 128, 0)
+        self.context = ConsumerContext(image, True)
+
+    def test_get_original(self):
+        # When
+        image = FrameCache.get(self.context)
+
+        # Then
+        self.assertIs(self.context.data, image)
+
+    def test_get_same_size_is_original(self):
+        # When
+        image = FrameCache.get(self.context, size=(60, 40))
+
+        # Then
+        self.assertIs(self.context.data, image)
+
+    def test_get_derivatives(self):
+        # When
+        small = FrameCache.get(self.context, size=(30, 20))
+        gray = FrameCache.get(self.context, size=(30, 20), gray=True)
+        blurred = FrameCache.get(self.context, size=(30, 20), gray=True, blur=5)
+
+        # Then
+        self.assertEqual((20, 30, 3), small.shape)
+        self.assertEqual((20, 30), gray.shape)
+        self.assertEqual((20, 30), blurred.shape)
+
+    def test_get_hits_by_size_gray_blur(self):
+        # Given
+        keys = [((30, 20), False, 0), ((30, 20), True, 0), ((30, 20), True, 5), (None, True, 0)]
+        first = {key: FrameCache.get(self.context, *key) for key in keys}
+
+        # When
+        second = {key: FrameCache.get(self.context, *key) for key in keys}
+
+        # Then
+        for key in keys:
+            self.assertIs(first[key], second[key])
+        self.assertTrue(set(keys) <= set(self.context.cache.keys()))
+
+    def test_get_reuses_intermediate(self):
+        # Given
+        gray = FrameCache.get(self.context, size=(30, 20), gray=True)
+
+        # When
+        FrameCache.get(self.context, size=(30, 20), gray=True, blur=5)
+
+        # Then
+        self.assertIs(gray, self.context.cache[((30, 20), True, 0)][1])
+
+    def test_get_recomputes_after_data_replaced(self):
+        # Given
+        small = FrameCache.get(self.context, size=(30, 20))
+        self.context.data = np.full((40, 60, 3), 255, dtype=np.uint8)
+
+        # When
+        image = FrameCache.get(self.context, size=(30, 20))
+
+        # Then
+        self.assertIsNot(small, image)
+        self.assertTrue((image == 255).all())
+
+    def test_get_gray_source(self):
+        # Given
+        self.context.data = np.zeros((40, 60), dtype=np.uint8)
+
+        # When
+        gray = FrameCache.get(self.context, gray=True)
+
+        # Then
+        self.assertIs(self.context.data, gray)
@@ -0,0 +1,162 @@
+import os
+import time
+import tempfile
+import threading
+import unittest
+from concurrent.futures import Future
+from raspberry_sec.system.outbox import ActionOutbox, ActionDispatcher
+from raspberry_sec.interface.action import Action, ActionMessage
+
+
+class FlakyAction(Action):
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+        self.fired = []
+        self.event = threading.Event()
+
+    def get_name(self):
+        return 'FlakyAction'
+
+    def fire(self, msg: list):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError('Network is down')
+        self.fired.append([m.data for m in msg])
+        self.event.set()
+
+
+class PendingAction(Action):
+
+    def __init__(self):
+        super().__init__()
+        self.futures = []
+
+    def get_name(self):
+        return 'PendingAction'
+
+    def fire(self, msg: list):
+        future = Future()
+        self.futures.append(future)
+        return future
+
+
+class TestActionOutboxMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'outbox.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_enqueue_is_idempotent(self):
+        # Given
+        outbox = ActionOutbox(self.path)
+        outbox.open()
+
+        # When
+        outbox.enqueue('Email', [ActionMessage('A')], key='alert1', now=0)
+        outbox.enqueue('Email', [ActionMessage('B')], key='alert1', now=0)
+        claimed = outbox.claim('Email', 10, now=0)
+
+        # Then
+        self.assertEqual(1, len(claimed))
+        self.assertEqual('alert1', claimed[0][0])
+        self.assertEqual(['A'], [m.data for m in claimed[0][1]])
+        self.assertEqual('alert1', claimed[0][1][0].key)
+
+    def test_claim_respects_limit_and_action(self):
+        # Given
+        outbox = ActionOutbox(self.path)
+        outbox.open()
+        for i in range(3):
+            outbox.enqueue('Email', [ActionMessage(i)], now=0)
+        outbox.enqueue('Sms', [ActionMessage('x')], now=0)
+
+        # When
+        first = outbox.claim('Email', 2, now=0)
+        second = outbox.claim('Email', 2, now=0)
+
+        # Then
+        self.assertEqual(2, len(first))
+        self.assertEqual(1, len(second))
+        self.assertEqual(ActionOutbox.SENDING, outbox.get_state(first[0][0]))
+
+    def test_fail_backs_off_exponentially_and_gives_up(self):
+        # Given
+        outbox = ActionOutbox(self.path, max_attempts=3, base_delay=10)
+        outbox.open()
+        key = outbox.enqueue('Email', [ActionMessage('A')], now=0)
+        outbox.claim('Email', 1, now=0)
+
+        # When
+        retried = outbox.fail(key, 'error', now=0)
+
+        # Then
+        self.assertTrue(retried)
+        self.assertEqual([], outbox.claim('Email', 1, now=9))
+        self.assertEqual(1, len(outbox.claim('Email', 1, now=10)))
+        self.assertTrue(outbox.fail(key, 'error', now=10))
+        self.assertEqual([], outbox.claim('Email', 1, now=29))
+        self.assertEqual(1, len(outbox.claim('Email', 1, now=30)))
+        self.assertFalse(outbox.fail(key, 'error', now=30))
+        self.assertEqual(ActionOutbox.FAILED, outbox.get_state(key))
+
+    def test_open_recovers_interrupted_alerts(self):
+        # Given
+        outbox = ActionOutbox(self.path)
+        outbox.open()
+        key = outbox.enqueue('Email', [ActionMessage('A')], now=0)
+        outbox.claim('Email', 1, now=0)
+
+        # When
+        reopened = ActionOutbox(self.path)
+        reopened.open()
+
+        # Then
+        self.assertEqual(ActionOutbox.PENDING, reopened.get_state(key))
+        self.assertEqual(1, len(reopened.claim('Email', 1, now=0)))
+
+
+class TestActionDispatcherMethods(unittest.TestCase):
+
+    def test_dispatcher_retries_failed_alert(self):
+        # Given
+        outbox = ActionOutbox(':memory:', base_delay=0.05)
+        action = FlakyAction(failures=2)
+        dispatcher = ActionDispatcher(outbox, action, concurrency=1)
+        dispatcher.start()
+
+        # When
+        key = dispatcher.submit([ActionMessage('A'), ActionMessage('B')])
+
+        # Then
+        self.assertTrue(action.event.wait(5))
+        self.assertEqual([['A', 'B']], action.fired)
+        for _ in range(50):
+            if outbox.get_state(key) == ActionOutbox.DONE:
+                break
+            time.sleep(0.05)
+        self.assertEqual(ActionOutbox.DONE, outbox.get_state(key))
+
+    def test_dispatcher_does_not_retry_alert_in_flight(self):
+        # Given
+        outbox = ActionOutbox(':memory:', base_delay=0)
+        action = PendingAction()
+        dispatcher = ActionDispatcher(outbox, action, concurrency=2)
+        dispatcher.start()
+
+        # When
+        key = dispatcher.submit([ActionMessage('A')])
+        time.sleep(0.2)
+        dispatcher.submit([ActionMessage('B')])
+        time.sleep(0.2)
+        state = outbox.get_state(key)
+        action.futures[0].set_result(True)
+
+        # Then
+        self.assertEqual(ActionOutbox.SENDING, state)
+        self.assertEqual(2, len(action.futures))
+        self.assertEqual(ActionOutbox.DONE, outbox.get_state(key))
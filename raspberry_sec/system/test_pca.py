@@ -1,6 +1,45 @@
+import os
+import sys
+import time
+import tempfile
 import unittest
-from raspberry_sec.system.pca import PCASystem, PCALoader
+import multiprocessing as mp
+from raspberry_sec.system.pca import PCASystem, PCASystemDiff, PCALoader
 from raspberry_sec.system.stream import Stream, StreamController
+from raspberry_sec.interface.consumer import Consumer
+from raspberry_sec.interface.producer import Producer
+from raspberry_sec.interface.action import Action
+
+
+class NamedProducer(Producer):
+
+    def __init__(self, name: str, parameters: dict):
+        super().__init__(parameters)
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+
+def wait_for_stop(event):
+    event.wait(30)
+
+
+def create_system(camera_device: int, threshold: int, query: str):
+    pca = PCASystem()
+    camera = NamedProducer('CameraProducer', {'device': camera_device})
+    microphone = NamedProducer('MicrophoneProducer', {'device': 'hw:1'})
+    stream1 = Stream('STREAM1')
+    stream1.producer = camera
+    stream1.consumers = [Consumer({'threshold': threshold})]
+    stream2 = Stream('STREAM2')
+    stream2.producer = microphone
+    stream2.consumers = [Consumer({'threshold': 1})]
+    pca.streams = {stream1, stream2}
+    pca.stream_controller = StreamController()
+    pca.stream_controller.query = query
+    pca.stream_controller.action = Action({'to_addr': 'a@b.c'})
+    return pca
 
 
 class TestPCALoaderMethods(unittest.TestCase):
@@ -45,6 +84,47 @@ class TestPCALoaderMethods(unittest.TestCase):
         self.assertTrue(modules.__contains__(package + '.test3.producer.Test3Producer'))
         self.assertTrue(modules.__contains__(package + '.test4.action.Test4Action'))
 
+    def test_build_manifest_does_not_import_components(self):
+        # Given
+        module = PCALoader.module_package + '.nnrecognizer.consumer'
+        imported = module in sys.modules
+
+        # When
+        manifest = PCALoader.build_manifest()
+
+        # Then
+        self.assertEqual([module + '.NnrecognizerConsumer', 'consumer'], manifest['NnrecognizerConsumer'])
+        self.assertEqual(imported, module in sys.modules)
+
+    def test_get_manifest_uses_cache_file(self):
+        # Given
+        directory = tempfile.TemporaryDirectory()
+        path = os.path.join(directory.name, 'manifest.json')
+        PCALoader.manifest = None
+
+        # When
+        built = PCALoader.get_manifest(path)
+        PCALoader.manifest = None
+        cached = PCALoader.get_manifest(path)
+
+        # Then
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(built, cached)
+        directory.cleanup()
+
+    def test_get_class_imports_on_demand(self):
+        # Given
+        loader = PCALoader()
+
+        # When
+        action_class = loader.get_class('action', 'EmailAction')
+
+        # Then
+        self.assertEqual('EmailAction', action_class.__name__)
+        self.assertIs(action_class, loader.get_actions()['EmailAction'])
+        self.assertRaises(KeyError, loader.get_class, 'consumer', 'EmailAction')
+        self.assertRaises(KeyError, loader.get_class, 'action', 'UnknownAction')
+
 
 class TestPCASystemMethods(unittest.TestCase):
 
@@ -78,6 +158,134 @@ class TestPCASystemMethods(unittest.TestCase):
         # Then
         self.assertTrue(result)
 
+    def test_get_services_returns_shared_service_once(self):
+        # Given
+        service = object()
+
+        class ServiceConsumer(Consumer):
+            def get_services(self):
+                return [service]
+
+        pca = PCASystem()
+        stream1 = Stream('STREAM1')
+        stream1.consumers = [ServiceConsumer(), Consumer()]
+        stream2 = Stream('STREAM2')
+        stream2.consumers = [ServiceConsumer()]
+        pca.streams = {stream1, stream2}
+
+        # When
+        services = pca.get_services()
+
+        # Then
+        self.assertEqual([service], services)
+
+    def test_get_preload_leaves_out_fork_unsafe_modules(self):
+        # Given
+        pca = PCASystem()
+        pca.preload = ['numpy', 'keras.models', 'tensorflow', 'raspberry_sec.system.stream']
+
+        # When
+        preload = pca.get_preload()
+
+        # Then
+        self.assertEqual(['numpy', 'raspberry_sec.system.stream'], preload)
+
+    def test_get_mp_context_uses_start_method(self):
+        # Given
+        pca = PCASystem()
+        default = PCASystem()
+        pca.start_method = 'spawn'
+
+        # When
+        context = pca.get_mp_context()
+
+        # Then
+        self.assertEqual('spawn', context.get_start_method())
+        self.assertIsNone(default.get_mp_context())
+
+    def test_stop_process_lets_process_finish(self):
+        # Given
+        event = mp.Event()
+        proc = mp.Process(target=wait_for_stop, args=(event, ))
+        proc.start()
+
+        # When
+        stopped = PCASystem.stop_process(proc, event)
+
+        # Then
+        self.assertTrue(stopped)
+        self.assertEqual(0, proc.exitcode)
+
+    def test_stop_process_terminates_stuck_process(self):
+        # Given
+        proc = mp.Process(target=time.sleep, args=(30, ))
+        proc.start()
+        timeout = PCASystem.STOP_TIMEOUT
+        PCASystem.STOP_TIMEOUT = 0.1
+
+        # When
+        try:
+            stopped = PCASystem.stop_process(proc, mp.Event())
+        finally:
+            PCASystem.STOP_TIMEOUT = timeout
+
+        # Then
+        self.assertFalse(stopped)
+        self.assertFalse(proc.is_alive())
+        self.assertIsNotNone(proc.exitcode)
+
+
+class TestPCASystemDiffMethods(unittest.TestCase):
+
+    def test_diff_is_empty_for_same_configuration(self):
+        # Given
+        old = create_system(0, 10, '@STREAM1@')
+        new = create_system(0, 10, '@STREAM1@')
+
+        # When
+        diff = PCASystemDiff(old, new)
+
+        # Then
+        self.assertTrue(diff.is_empty())
+
+    def test_diff_restarts_only_changed_stream(self):
+        # Given
+        old = create_system(0, 10, '@STREAM1@')
+        new = create_system(0, 20, '@STREAM1@')
+
+        # When
+        diff = PCASystemDiff(old, new)
+
+        # Then
+        self.assertEqual({'STREAM1'}, diff.units)
+        self.assertEqual(set(), diff.producers)
+        self.assertFalse(diff.controller)
+
+    def test_diff_restarts_streams_of_changed_producer(self):
+        # Given
+        old = create_system(0, 10, '@STREAM1@')
+        new = create_system(1, 10, '@STREAM1@ or @STREAM2@')
+
+        # When
+        diff = PCASystemDiff(old, new)
+
+        # Then
+        self.assertEqual({'CameraProducer'}, diff.producers)
+        self.assertEqual({'STREAM1'}, diff.units)
+        self.assertTrue(diff.controller)
+
+    def test_can_reload_rejects_new_producer_type(self):
+        # Given
+        old = create_system(0, 10, '@STREAM1@')
+        new = create_system(0, 10, '@STREAM1@')
+        stream3 = Stream('STREAM3')
+        stream3.producer = NamedProducer('OtherProducer', {})
+        new.streams.add(stream3)
+
+        # Then
+        self.assertTrue(old.can_reload(create_system(1, 10, 'False')))
+        self.assertFalse(old.can_reload(new))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from raspberry_sec.system.query import AlertQuery, QuerySyntaxError
+
+
+class TestAlertQueryMethods(unittest.TestCase):
+
+    def test_streams_get_bit_indexes(self):
+        # Given
+        query = AlertQuery('@STREAM1@ and (@stream2@ or not @STREAM1@)')
+
+        # Then
+        self.assertEqual(['STREAM1', 'STREAM2'], query.streams)
+        self.assertEqual(1, query.get_index('Stream2'))
+        self.assertIsNone(query.get_index('STREAM3'))
+
+    def test_evaluate_returns_correct_result(self):
+        # Given
+        query = AlertQuery('@STREAM1@ and (@STREAM2@ or not @STREAM3@) ')
+
+        # When
+        result1 = query.evaluate(0b011, [0, 0, None])
+        result2 = query.evaluate(0b101, [0, None, 0])
+        result3 = query.evaluate(0b001, [0, None, None])
+
+        # Then
+        self.assertTrue(result1)
+        self.assertFalse(result2)
+        self.assertTrue(result3)
+
+    def test_evaluate_within(self):
+        # Given
+        query = AlertQuery('@STREAM1@ within 10s of @STREAM2@')
+
+        # When
+        result1 = query.evaluate(0b01, [100, 92])
+        result2 = query.evaluate(0b01, [100, 85])
+        result3 = query.evaluate(0b00, [100, 92])
+
+        # Then
+        self.assertTrue(result1)
+        self.assertFalse(result2)
+        self.assertFalse(result3)
+        self.assertEqual(10, query.horizon)
+
+    def test_invalid_query_throws_exception(self):
+        # Then
+        self.assertRaises(QuerySyntaxError, AlertQuery, '@STREAM1@ and')
+        self.assertRaises(QuerySyntaxError, AlertQuery, '(@STREAM1@')
+        self.assertRaises(QuerySyntaxError, AlertQuery, '__import__("os")')
+        self.assertRaises(QuerySyntaxError, AlertQuery, '@STREAM1@ within of @STREAM2@')
+
+
+if __name__ == '__main__':
+    unittest.main()
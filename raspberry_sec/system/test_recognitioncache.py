@@ -0,0 +1,100 @@
+import unittest
+import numpy as np
+from raspberry_sec.system.recognitioncache import RecognitionCache
+from raspberry_sec.interface.consumer import ConsumerContext
+
+
+class TestRecognitionCacheMethods(unittest.TestCase):
+
+    def test_get_keys_uses_track_ids(self):
+        # Given
+        faces = [np.zeros((10, 10)), np.zeros((10, 10))]
+        context = ConsumerContext(faces, True)
+        context.region_ids = [3, 7]
+
+        # When
+        keys = RecognitionCache.get_keys(context, faces)
+
+        # Then
+        self.assertEqual([('track', 3), ('track', 7)], keys)
+
+    def test_get_hash_similar_faces(self):
+        # Given
+        face = np.tile(np.arange(64, dtype=np.uint8) * 4, (64, 1))
+        noisy = face.copy()
+        noisy[10, 10] = 0
+        mirrored = face[:, ::-1]
+
+        # When
+        face_hash = RecognitionCache.get_hash(face)
+
+        # Then
+        self.assertEqual(face_hash, RecognitionCache.get_hash(noisy))
+        self.assertGreater(bin(face_hash ^ RecognitionCache.get_hash(mirrored)).count('1'), 6)
+
+    def test_get_expires(self):
+        # Given
+        cache = RecognitionCache(ttl=2)
+
+        # When
+        cache.put(('track', 1), 'Alice', now=10)
+
+        # Then
+        self.assertEqual('Alice', cache.get(('track', 1), now=11))
+        self.assertIsNone(cache.get(('track', 1), now=12.5))
+        self.assertEqual(0, len(cache.entries))
+
+    def test_get_close_hash(self):
+        # Given
+        cache = RecognitionCache(ttl=2, max_distance=2)
+
+        # When
+        cache.put(('hash', 0b1011), 'Bob', now=0)
+
+        # Then
+        self.assertEqual('Bob', cache.get(('hash', 0b1000), now=1))
+        self.assertIsNone(cache.get(('hash', 0b0100), now=1))
+
+    def test_put_evicts_least_recently_used(self):
+        # Given
+        cache = RecognitionCache(ttl=10, capacity=2)
+        cache.put(('track', 1), 'A', now=0)
+        cache.put(('track', 2), 'B', now=0)
+
+        # When
+        cache.get(('track', 1), now=1)
+        cache.put(('track', 3), 'C', now=1)
+
+        # Then
+        self.assertEqual('A', cache.get(('track', 1), now=1))
+        self.assertIsNone(cache.get(('track', 2), now=1))
+
+    def test_lookup_recognizes_missing_only(self):
+        # Given
+        cache = RecognitionCache(ttl=10)
+        cache.put(('track', 1), 'A', now=0)
+        calls = []
+
+        def recognize(missing):
+            calls.append(missing)
+            return ['X' for _ in missing]
+
+        # When
+        verdicts = cache.lookup([('track', 1), ('track', 2)], recognize, now=1)
+        again = cache.lookup([('track', 1), ('track', 2)], recognize, now=2)
+
+        # Then
+        self.assertEqual(['A', 'X'], verdicts)
+        self.assertEqual(['A', 'X'], again)
+        self.assertEqual([[1]], calls)
+
+    def test_disabled(self):
+        # Given
+        cache = RecognitionCache(ttl=0)
+
+        # When
+        verdicts = cache.lookup([('track', 1)], lambda missing: ['X'], now=0)
+
+        # Then
+        self.assertEqual(['X'], verdicts)
+        self.assertIsNone(cache.get(('track', 1), now=0))
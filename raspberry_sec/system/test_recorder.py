@@ -0,0 +1,134 @@
+import os
+import time
+import tempfile
+import threading
+import unittest
+from raspberry_sec.system.recorder import ClipIndex, ClipRecorder
+from raspberry_sec.system.util import ProcessContext
+
+
+class TestClipIndexMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_file(self, name: str, size: int):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as file:
+            file.write(b'x' * size)
+        return path
+
+    def test_evict_deletes_oldest_segments(self):
+        # Given
+        index = ClipIndex(':memory:')
+        index.open()
+        for i in range(3):
+            index.add('CAM', 'incident', self.create_file(str(i), 100), start=i, end=i + 1, frames=1, size=100)
+
+        # When
+        evicted = index.evict(max_size=150)
+
+        # Then
+        self.assertEqual(2, evicted)
+        self.assertEqual(100, index.get_total_size())
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, '0')))
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, '2')))
+
+
+class TestClipRecorderMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_buffer_sends_pre_roll_when_triggered(self):
+        # Given
+        recorder = ClipRecorder({'directory': self.directory.name, 'pre_roll': 2, 'post_roll': 3})
+        clip_buffer = recorder.create_buffer('CAM')
+        for t in range(5):
+            clip_buffer.add(t, b'frame' + bytes([t]))
+
+        # When
+        recorder.trigger('incident1', now=5)
+        clip_buffer.add(5, b'frame5')
+        clip_buffer.add(9, b'frame9')
+        frames = [recorder.queue.get(timeout=1) for _ in range(4)]
+
+        # Then
+        self.assertEqual([2, 3, 4, 5], [f[2] for f in frames])
+        self.assertEqual({'incident1'}, set(f[1] for f in frames))
+        self.assertEqual(1, len(clip_buffer.ring))
+
+    def test_write_splits_segments_and_indexes_them(self):
+        # Given
+        recorder = ClipRecorder({'directory': self.directory.name, 'segment_length': 10})
+        index = ClipIndex(':memory:')
+        index.open()
+        segments = dict()
+
+        # When
+        for t in range(15):
+            recorder.write(segments, index, 'CAM', 'incident1', 1000 + t, b'jpeg')
+        recorder.write(segments, index, 'CAM', 'incident2', 1015, b'jpeg')
+        recorder.close_idle_segments(segments, index, now=float('inf'))
+
+        # Then
+        clips = index.get_clips()
+        self.assertEqual([1, 5, 10], sorted(clip['frames'] for clip in clips))
+        self.assertEqual(['incident1'] * 2, [clip['incident'] for clip in index.get_clips('incident1')])
+        self.assertEqual(0, len(segments))
+        for clip in clips:
+            self.assertEqual(clip['size'], os.path.getsize(clip['path']))
+
+    def test_run_indexes_open_segments_when_stopped(self):
+        # Given
+        recorder = ClipRecorder({'directory': self.directory.name})
+        stop_event = threading.Event()
+        context = ProcessContext(log_queue=None, stop_event=stop_event)
+        thread = threading.Thread(target=recorder.run, args=(context, ), daemon=True)
+        thread.start()
+        for t in range(3):
+            recorder.submit('CAM', 'incident1', time.time() + t, b'jpeg')
+
+        # When
+        for _ in range(100):
+            if sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(self.directory.name)
+                   for f in files if f.endswith('.mjpeg')) == 12:
+                break
+            time.sleep(0.02)
+        stop_event.set()
+        thread.join(5)
+        index = ClipIndex(os.path.join(self.directory.name, 'clips.db'))
+        index.open()
+
+        # Then
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([3], [clip['frames'] for clip in index.get_clips('incident1')])
+
+    def test_index_orphans_adds_unindexed_segments(self):
+        # Given
+        recorder = ClipRecorder({'directory': self.directory.name})
+        index = ClipIndex(':memory:')
+        index.open()
+        segment = recorder.open_segment('CAM', 'abcdef1234', 1000)
+        segment.write(1000, b'jpeg')
+        segment.close()
+
+        # When
+        recorder.index_orphans(index)
+        recorder.index_orphans(index)
+
+        # Then
+        clips = index.get_clips()
+        self.assertEqual(1, len(clips))
+        self.assertEqual('abcdef12', clips[0]['incident'])
+        self.assertEqual(4, index.get_total_size())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+from raspberry_sec.system.scheduler import ConsumerScheduler, ConsumerStats
+from raspberry_sec.interface.consumer import Consumer, ConsumerContext
+
+
+class FakeConsumer(Consumer):
+
+    def __init__(self, name: str, gate: bool, passes: bool, inputs: set=frozenset(), outputs: set=frozenset()):
+        super().__init__()
+        self.name = name
+        self.gate = gate
+        self.passes = passes
+        self.inputs = set(inputs)
+        self.outputs = set(outputs)
+        self.calls = 0
+
+    def get_name(self):
+        return self.name
+
+    def is_gate(self):
+        return self.gate
+
+    def get_inputs(self):
+        return self.inputs
+
+    def get_outputs(self):
+        return self.outputs
+
+    def run(self, context: ConsumerContext):
+        self.calls += 1
+        context.alert = self.passes
+        return context
+
+
+class TestConsumerStatsMethods(unittest.TestCase):
+
+    def test_get_rank_prefers_cheap_and_selective(self):
+        # Given
+        cheap = ConsumerStats(0.5)
+        expensive = ConsumerStats(0.5)
+
+        # When
+        cheap.update(0.001, False)
+        expensive.update(0.1, False)
+
+        # Then
+        self.assertLess(cheap.get_rank(), expensive.get_rank())
+
+
+class TestConsumerSchedulerMethods(unittest.TestCase):
+
+    def test_run_stops_when_alert_is_cleared(self):
+        # Given
+        first = FakeConsumer('FIRST', False, False)
+        second = FakeConsumer('SECOND', False, True)
+        scheduler = ConsumerScheduler([first, second])
+
+        # When
+        context = scheduler.run(ConsumerContext(None, True))
+
+        # Then
+        self.assertFalse(context.alert)
+        self.assertEqual(0, second.calls)
+
+    def test_replan_only_reorders_gates(self):
+        # Given
+        gate1 = FakeConsumer('GATE1', True, True)
+        gate2 = FakeConsumer('GATE2', True, True)
+        other = FakeConsumer('OTHER', False, True)
+        gate3 = FakeConsumer('GATE3', True, True)
+        scheduler = ConsumerScheduler([gate1, gate2, other, gate3], adaptive=True, min_calls=1)
+        scheduler.stats[0].update(0.5, True)
+        scheduler.stats[1].update(0.01, False)
+        scheduler.stats[3].update(0.01, False)
+
+        # When
+        scheduler.replan()
+
+        # Then
+        self.assertEqual([gate2, gate1, other, gate3], scheduler.get_plan())
+
+    def test_replan_keeps_unmeasured_gates_in_place(self):
+        # Given
+        gate1 = FakeConsumer('GATE1', True, True)
+        gate2 = FakeConsumer('GATE2', True, True)
+        gate3 = FakeConsumer('GATE3', True, True)
+        scheduler = ConsumerScheduler([gate1, gate2, gate3], adaptive=True, min_calls=5)
+        scheduler.stats[0].update(0.5, True)
+        scheduler.stats[2].update(0.01, False)
+        for stats in (scheduler.stats[0], scheduler.stats[2]):
+            stats.calls = 5
+
+        # When
+        scheduler.replan()
+
+        # Then
+        self.assertEqual([gate3, gate2, gate1], scheduler.get_plan())
+
+    def test_replan_never_moves_gate_before_its_dependency(self):
+        # Given
+        motion = FakeConsumer('MOTION', True, True, outputs={'regions'})
+        body = FakeConsumer('BODY', True, True, inputs={'regions'})
+        other = FakeConsumer('OTHER', True, True)
+        scheduler = ConsumerScheduler([motion, body, other], adaptive=True, min_calls=1)
+        scheduler.stats[0].update(0.5, True)
+        scheduler.stats[1].update(0.01, False)
+        scheduler.stats[2].update(0.001, False)
+
+        # When
+        scheduler.replan()
+
+        # Then
+        self.assertEqual([(1, 3)], scheduler.get_gate_runs())
+        self.assertEqual([motion, other, body], scheduler.get_plan())
+
+if __name__ == '__main__':
+    unittest.main()
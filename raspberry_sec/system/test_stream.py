@@ -1,7 +1,34 @@
+import threading
 import unittest
-from raspberry_sec.system.stream import Stream, StreamController, StreamControllerMessage
-from raspberry_sec.interface.producer import Producer, Type
-from raspberry_sec.interface.consumer import Consumer
+from queue import Queue
+from raspberry_sec.system.stream import Stream, StreamGroup, StreamController, StreamControllerMessage
+from raspberry_sec.interface.producer import Producer, ProducerDataProxy, Type
+from raspberry_sec.interface.consumer import Consumer, ConsumerContext
+from raspberry_sec.interface.action import Action
+from raspberry_sec.system.util import ProcessContext
+
+
+class CountingConsumer(Consumer):
+
+    def __init__(self, parameters: dict):
+        super().__init__(parameters)
+        self.calls = 0
+
+    def get_name(self):
+        return 'CountingConsumer'
+
+    def run(self, context: ConsumerContext):
+        self.calls += 1
+        context.alert_data = self.parameters['name']
+        context.alert = self.parameters['alert']
+        return context
+
+
+def create_stream(name: str, producer: Producer, consumer_names: list):
+    stream = Stream(name)
+    stream.producer = producer
+    stream.consumers = [CountingConsumer({'name': n, 'alert': n != 'STOP'}) for n in consumer_names]
+    return stream
 
 
 class TestStreamMethods(unittest.TestCase):
@@ -49,6 +76,63 @@ class TestStreamMethods(unittest.TestCase):
         # Then
         self.assertRaises(AttributeError, stream.validate)
 
+    def test_initialize_consumers_continues_after_failure(self):
+        # Given
+        initialized = []
+
+        class FailingConsumer(CountingConsumer):
+            def initialize(self):
+                raise RuntimeError('Cannot load model')
+
+        class InitializedConsumer(CountingConsumer):
+            def initialize(self):
+                initialized.append(self.parameters['name'])
+
+        consumers = [FailingConsumer({'name': 'A'}), InitializedConsumer({'name': 'B'})]
+
+        # When
+        Stream.initialize_consumers('STREAM', consumers)
+
+        # Then
+        self.assertEqual(['B'], initialized)
+
+    def test_sample_loop_returns_when_stop_event_is_set(self):
+        # Given
+        proxy = ProducerDataProxy()
+        proxy.set_data('DATA')
+        stop_event = threading.Event()
+        samples = []
+
+        def handle(sample):
+            samples.append(sample.data)
+            stop_event.set()
+
+        # When
+        Stream.sample_loop('STREAM', Producer(), proxy, handle, stop_event)
+
+        # Then
+        self.assertEqual(['DATA'], samples)
+
+    def test_sample_loop_requests_copies(self):
+        # Given
+        proxy = ProducerDataProxy()
+        proxy.set_data('DATA')
+        producer = Producer()
+        stop_event = threading.Event()
+        copies = []
+
+        def get_next(data_proxy, after_seq, timeout, copy=False):
+            copies.append(copy)
+            return data_proxy.get_next(after_seq, timeout, copy)
+
+        producer.get_next = get_next
+
+        # When
+        Stream.sample_loop('STREAM', producer, proxy, lambda sample: stop_event.set(), stop_event)
+
+        # Then
+        self.assertEqual([True], copies)
+
     def test_validate_returns_true(self):
         # Given
         stream = Stream('STREAM')
@@ -65,6 +149,99 @@ class TestStreamMethods(unittest.TestCase):
         self.assertTrue(result)
 
 
+class TestStreamGroupMethods(unittest.TestCase):
+
+    def test_group_streams(self):
+        # Given
+        producer = Producer()
+        streams = [
+            create_stream('STREAM1', producer, ['MOTION', 'BODY']),
+            create_stream('STREAM2', producer, ['MOTION', 'FACE']),
+            create_stream('STREAM3', producer, ['FACE'])
+        ]
+
+        # When
+        groups = StreamGroup.group_streams(streams)
+
+        # Then
+        self.assertEqual(2, len(groups))
+        self.assertEqual(['STREAM1', 'STREAM2'], [s.get_name() for s in groups[0]])
+
+    def test_group_streams_leaves_adaptive_stream_alone(self):
+        # Given
+        producer = Producer()
+        streams = [
+            create_stream('STREAM1', producer, ['MOTION', 'BODY']),
+            create_stream('STREAM2', producer, ['MOTION', 'FACE'])
+        ]
+        streams[0].adaptive = True
+
+        # When
+        groups = StreamGroup.group_streams(streams)
+
+        # Then
+        self.assertEqual([['STREAM2'], ['STREAM1']], [[s.get_name() for s in group] for group in groups])
+
+    def test_execute_runs_shared_prefix_once(self):
+        # Given
+        producer = Producer()
+        stream1 = create_stream('STREAM1', producer, ['MOTION', 'BODY'])
+        stream2 = create_stream('STREAM2', producer, ['MOTION', 'FACE', 'STOP'])
+        group = StreamGroup([stream1, stream2])
+        results = []
+
+        # When
+        group.execute(group.root, ConsumerContext(None, True), results)
+
+        # Then
+        self.assertEqual(4, group.count_stages())
+        self.assertEqual(1, stream1.consumers[0].calls)
+        self.assertEqual(0, stream2.consumers[0].calls)
+        self.assertEqual(1, len(results))
+        self.assertEqual(stream1, results[0][0])
+        self.assertEqual('BODY', results[0][1].alert_data)
+
+    def test_get_consumers_lists_each_stage_once(self):
+        # Given
+        producer = Producer()
+        stream1 = create_stream('STREAM1', producer, ['MOTION', 'BODY'])
+        stream2 = create_stream('STREAM2', producer, ['MOTION', 'FACE'])
+        group = StreamGroup([stream1, stream2])
+
+        # When
+        consumers = group.get_consumers()
+
+        # Then
+        self.assertEqual(['MOTION', 'BODY', 'FACE'], [c.parameters['name'] for c in consumers])
+
+
+class TestProducerDataProxyMethods(unittest.TestCase):
+
+    def test_get_next_returns_none_when_no_new_data(self):
+        # Given
+        proxy = ProducerDataProxy()
+        proxy.set_data('DATA')
+
+        # When
+        sample = proxy.get_next(after_seq=1, timeout=0.01)
+
+        # Then
+        self.assertIsNone(sample)
+
+    def test_get_next_returns_latest_sample(self):
+        # Given
+        proxy = ProducerDataProxy()
+        proxy.set_data('DATA1')
+        proxy.set_data('DATA2')
+
+        # When
+        sample = proxy.get_next(after_seq=1, timeout=0.01)
+
+        # Then
+        self.assertEqual(2, sample.seq)
+        self.assertEqual('DATA2', sample.data)
+
+
 class TestStreamControllerMethods(unittest.TestCase):
 
     def test_evaluate_query_returns_correct_result(self):
@@ -90,7 +267,7 @@ class TestStreamControllerMethods(unittest.TestCase):
         # Then
         self.assertFalse(result)
 
-    def test_decide_alert_returns_true_and_two_action_messages(self):
+    def test_update_state_fires_when_query_is_true(self):
         # Given
         controller = StreamController()
         controller.query = '@STREAM1@ and @STREAM2@'
@@ -100,13 +277,13 @@ class TestStreamControllerMethods(unittest.TestCase):
         ]
 
         # When
-        result, action_msgs = controller.decide_alert(messages)
+        controller.update_state(messages, now=0)
+        action_msgs = controller.collect_action_messages(now=controller.polling_interval)
 
         # Then
-        self.assertTrue(result)
         self.assertEqual(2, len(action_msgs))
 
-    def test_decide_alert_returns_false_and_no_action_messages(self):
+    def test_update_state_does_not_fire_without_alerts(self):
         # Given
         controller = StreamController()
         controller.query = '@STREAM1@ and @STREAM2@'
@@ -116,12 +293,166 @@ class TestStreamControllerMethods(unittest.TestCase):
         ]
 
         # When
-        result, action_msgs = controller.decide_alert(messages)
+        controller.update_state(messages, now=0)
+        action_msgs = controller.collect_action_messages(now=controller.polling_interval)
 
         # Then
-        self.assertFalse(result)
+        self.assertIsNone(controller.get_timeout(now=0))
         self.assertEqual(0, len(action_msgs))
 
+    def test_default_debounce_fires_once_per_polling_interval(self):
+        # Given
+        controller = StreamController()
+        controller.query = '@STREAM1@'
+        firings = 0
+
+        # When
+        for tick in range(20):
+            now = tick * 0.5
+            controller.update_state([StreamControllerMessage(_alert=True, _msg='MSG', _sender='STREAM1')], now=now)
+            if controller.collect_action_messages(now=now):
+                firings += 1
+
+        # Then (at 3 and 6.5 seconds)
+        self.assertEqual(2, firings)
+
+    def test_update_state_schedules_firing_after_debounce(self):
+        # Given
+        controller = StreamController()
+        controller.query = '@STREAM1@ and @STREAM2@'
+        controller.debounce = 1
+        messages = [
+            StreamControllerMessage(_alert=True, _msg='MSG', _sender='STREAM1'),
+            StreamControllerMessage(_alert=True, _msg='MSG', _sender='STREAM2')
+        ]
+
+        # When
+        controller.update_state(messages, now=10)
+        early_msgs = controller.collect_action_messages(now=10.5)
+        controller.update_state([StreamControllerMessage(_alert=True, _msg='MSG', _sender='STREAM1')], now=10.8)
+        action_msgs = controller.collect_action_messages(now=11)
+
+        # Then
+        self.assertEqual(0, len(early_msgs))
+        self.assertEqual(3, len(action_msgs))
+        self.assertIsNone(controller.get_timeout(now=11))
+
+    def test_update_state_ignores_expired_alerts(self):
+        # Given
+        controller = StreamController()
+        controller.query = '@STREAM1@ and @STREAM2@'
+        controller.alert_window = 3
+
+        # When
+        controller.update_state([StreamControllerMessage(_alert=True, _msg='MSG', _sender='STREAM1')], now=0)
+        controller.update_state([StreamControllerMessage(_alert=True, _msg='MSG', _sender='STREAM2')], now=5)
+
+        # Then
+        self.assertIsNone(controller.get_timeout(now=5))
+        self.assertEqual(0, len(controller.collect_action_messages(now=5)))
+
+    def test_incident_coalesces_alerts_into_one_notification(self):
+        # Given
+        controller = StreamController()
+        controller.debounce = 0
+        controller.query = '@STREAM1@'
+        controller.incident_timeout = 5
+
+        # When
+        controller.update_state([StreamControllerMessage(_alert=True, _msg='MSG', _sender='STREAM1')], now=0)
+        first = controller.collect_action_messages(now=0)
+        for now in range(1, 10):
+            controller.update_state([StreamControllerMessage(_alert=True, _msg='MSG', _sender='STREAM1')], now=now)
+            self.assertEqual(0, len(controller.collect_action_messages(now=now)))
+        incident = controller.incident
+        controller.update_state([], now=15)
+
+        # Then
+        self.assertEqual(2, len(first))
+        self.assertEqual(first[0].key, first[1].key)
+        self.assertEqual(10, incident.alerts)
+        self.assertEqual(9, incident.get_duration())
+        self.assertIsNone(controller.incident)
+
+    def test_suppression_windows_mute_streams_and_zones(self):
+        # Given
+        controller = StreamController()
+        controller.debounce = 0
+        controller.query = '@STREAM1@ or @STREAM2@'
+        controller.stream_suppression = {'STREAM1': 60}
+        controller.zone_suppression = {'Garage': 30}
+        controller.update_state([StreamControllerMessage(_alert=True, _msg='MSG', _sender='STREAM1', _zone='Garage')], now=0)
+        controller.collect_action_messages(now=0)
+
+        # When
+        stream2 = StreamControllerMessage(_alert=True, _msg='MSG', _sender='STREAM2', _zone='Garage')
+        controller.update_state([stream2], now=10)
+        muted = controller.collect_action_messages(now=10)
+        controller.update_state([stream2], now=31)
+        unmuted = controller.collect_action_messages(now=31)
+
+        # Then
+        self.assertEqual(0, len(muted))
+        self.assertEqual(1, len(unmuted))
+        self.assertTrue(controller.is_suppressed(
+            StreamControllerMessage(_alert=True, _msg='MSG', _sender='STREAM1'), now=59))
+
+    def test_max_action_rate_delays_notifications(self):
+        # Given
+        controller = StreamController()
+        controller.debounce = 0
+        controller.query = '@STREAM1@'
+        controller.max_action_rate = 60
+        controller.update_state([StreamControllerMessage(_alert=True, _msg='MSG', _sender='STREAM1')], now=0)
+        controller.collect_action_messages(now=0)
+
+        # When
+        controller.update_state([StreamControllerMessage(_alert=True, _msg='A', _sender='STREAM1')], now=1)
+        limited = controller.collect_action_messages(now=1)
+        timeout = controller.get_timeout(now=1)
+        controller.update_state([StreamControllerMessage(_alert=True, _msg='B', _sender='STREAM1')], now=30)
+        delayed = controller.collect_action_messages(now=60)
+
+        # Then
+        self.assertEqual(0, len(limited))
+        self.assertAlmostEqual(59, timeout)
+        self.assertEqual(['A', 'B'], [m.data for m in delayed])
+
+    def test_fetch_messages_drains_queue(self):
+        # Given
+        controller = StreamController()
+        controller.message_limit = 2
+        queue = Queue()
+        for i in range(3):
+            queue.put(StreamControllerMessage(_alert=True, _msg='MSG', _sender='STREAM' + str(i)))
+
+        # When
+        messages = controller.fetch_messages(queue, timeout=0.01)
+        rest = controller.fetch_messages(queue, timeout=0.01)
+        empty = controller.fetch_messages(queue, timeout=0.01)
+
+        # Then
+        self.assertEqual(2, len(messages))
+        self.assertEqual(1, len(rest))
+        self.assertEqual(0, len(empty))
+
+    def test_run_returns_when_stop_event_is_set(self):
+        # Given
+        controller = StreamController()
+        controller.action = Action({})
+        controller.outbox_path = ':memory:'
+        stop_event = threading.Event()
+        context = ProcessContext(log_queue=None, stop_event=stop_event, message_queue=Queue())
+        thread = threading.Thread(target=controller.run, args=(context, ), daemon=True)
+        thread.start()
+
+        # When
+        stop_event.set()
+        thread.join(5)
+
+        # Then
+        self.assertFalse(thread.is_alive())
+
 
 if __name__ == '__main__':
     unittest.main()
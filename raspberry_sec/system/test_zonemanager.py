@@ -0,0 +1,134 @@
+import os
+import json
+import shutil
+import tempfile
+import time
+import unittest
+from raspberry_sec.system.zonemanager import ZoneManager, ZoneTable
+
+
+class TestZoneManagerMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.directory, 'pca_system.json')
+        with open(self.config_path, 'w') as file:
+            json.dump({'stream_controller': {'query': 'False', 'zones': {'Garage': True, 'Kitchen': False}}}, file)
+        self.zone_managers = []
+
+    def tearDown(self):
+        # the watcher threads of the owner instances must not be saving into it any more
+        for zone_manager in self.zone_managers:
+            zone_manager.close()
+        shutil.rmtree(self.directory)
+
+    def create_zone_manager(self, table: ZoneTable=None):
+        zone_manager = ZoneManager(self.config_path, table)
+        self.zone_managers.append(zone_manager)
+        return zone_manager
+
+    def test_is_zone_active(self):
+        # Given
+        zone_manager = self.create_zone_manager()
+
+        # Then
+        self.assertTrue(zone_manager.is_zone_active('Garage'))
+        self.assertFalse(zone_manager.is_zone_active('Kitchen'))
+        self.assertFalse(zone_manager.is_zone_active('Attic'))
+
+    def test_changes_are_visible_through_shared_table(self):
+        # Given
+        table = ZoneTable()
+        zone_manager1 = self.create_zone_manager(table)
+        zone_manager2 = self.create_zone_manager(table)
+        zone_manager2.is_zone_active('Kitchen')
+
+        # When
+        zone_manager1.toggle_zone('Kitchen')
+        zone_manager1.add_zone('Attic')
+        zone_manager1.delete_zone('Garage')
+
+        # Then
+        self.assertEqual({'Kitchen': True, 'Attic': False}, zone_manager2.get_zones())
+
+    def test_owner_saves_changes_when_table_loaded_by_other_process(self):
+        # Given
+        owner = self.create_zone_manager()
+        child = self.create_zone_manager(owner.table)
+        child.initialize()
+
+        # When
+        owner.toggle_zone('Kitchen')
+        for _ in range(100):
+            with open(self.config_path, 'r') as file:
+                zones = json.load(file)['stream_controller']['zones']
+            if zones['Kitchen']:
+                break
+            time.sleep(0.02)
+
+        # Then
+        self.assertIsNotNone(owner.watcher)
+        self.assertEqual({'Garage': True, 'Kitchen': True}, zones)
+
+    def test_flush_saves_zones_into_config(self):
+        # Given
+        zone_manager = self.create_zone_manager()
+        zone_manager.set_zones({'Garage': False})
+
+        # When
+        zone_manager.flush()
+        with open(self.config_path, 'r') as file:
+            data = json.load(file)
+
+        # Then
+        self.assertEqual({'Garage': False}, data['stream_controller']['zones'])
+        self.assertEqual('False', data['stream_controller']['query'])
+
+    def test_close_stops_watcher(self):
+        # Given
+        zone_manager = self.create_zone_manager()
+        zone_manager.initialize()
+        watcher = zone_manager.watcher
+
+        # When
+        zone_manager.close()
+
+        # Then
+        self.assertFalse(watcher.is_alive())
+        self.assertIsNone(zone_manager.watcher)
+
+    def test_wait_for_change(self):
+        # Given
+        zone_manager = self.create_zone_manager()
+        zone_manager.initialize()
+        generation = zone_manager.table.get_generation()
+
+        # When
+        unchanged = zone_manager.table.wait_for_change(generation, timeout=0.01)
+        zone_manager.toggle_zone('Garage')
+        changed = zone_manager.table.wait_for_change(generation, timeout=0.01)
+
+        # Then
+        self.assertFalse(unchanged)
+        self.assertTrue(changed)
+
+    def test_wait_for_change_sees_write_in_progress_complete(self):
+        # Given
+        table = ZoneTable()
+        table.write({'Garage': True})
+        # a write has started: the generation is odd
+        table.generation.value += 1
+        generation = table.get_generation()
+
+        # When
+        unchanged = table.wait_for_change(generation, timeout=0.01)
+        table.generation.value += 1
+        changed = table.wait_for_change(generation, timeout=0.01)
+
+        # Then
+        self.assertFalse(unchanged)
+        self.assertTrue(changed)
+
+
+if __name__ == '__main__':
+    unittest.main()
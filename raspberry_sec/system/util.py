@@ -87,15 +87,17 @@ class ProcessContext:
 		return self.kwargs[name]
 
 	@staticmethod
-	def create_process(target, name, args):
+	def create_process(target, name, args, mp_context=None):
 		"""
 		This method takes care of Process creation
 		:param target: for the new process
 		:param name: of the new process
 		:param args: arguments
+		:param mp_context: multiprocessing context (start method) to use, None means the default one
 		:return: newly created Process
 		"""
-		return Process(
+		process_class = mp_context.Process if mp_context else Process
+		return process_class(
 			target=target,
 			name=name,
 			args=args
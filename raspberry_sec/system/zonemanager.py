@@ -1,10 +1,101 @@
+import ctypes
+import time
 import logging
 import os, sys, json
+from threading import Thread, Event, Lock
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray, RawValue
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
-class ZoneManager:
 
-	LOGGER = logging.getLogger('ZoneManager') 		
+class ZoneTable:
+	"""
+	Shared memory table holding the zones (JSON encoded).
+	Writers serialize on a lock, readers are lock-free: the generation
+	counter is odd while a write is in progress (seqlock). Changes are
+	detected by polling the generation, so writers never wait for readers.
+	"""
+	CAPACITY = 8192
+	READ_RETRIES = 100
+	POLL_INTERVAL = 0.05
+
+	def __init__(self, capacity: int=CAPACITY):
+		"""
+		Constructor
+		:param capacity: size of the buffer in bytes
+		"""
+		self.buffer = RawArray(ctypes.c_char, capacity)
+		self.length = RawValue(ctypes.c_int, 0)
+		self.generation = RawValue(ctypes.c_ulonglong, 0)
+		self.lock = multiprocessing.Lock()
+
+	def get_generation(self):
+		"""
+		:return: current generation (0 means the table has not been loaded yet)
+		"""
+		return self.generation.value
+
+	def read(self):
+		"""
+		Lock-free read
+		:return: generation and the zones (dict)
+		"""
+		for _ in range(ZoneTable.READ_RETRIES):
+			generation = self.generation.value
+			if generation & 1:
+				continue
+			content = self.buffer[:self.length.value]
+			if self.generation.value == generation:
+				return generation, json.loads(content.decode('utf-8')) if content else dict()
+		raise RuntimeError('Could not read a consistent zone table')
+
+	def write(self, zones: dict):
+		"""
+		Stores the zones, the caller must hold the lock
+		:param zones: dictionary of zone name - active pairs
+		:return: new generation
+		"""
+		content = json.dumps(zones, sort_keys=True).encode('utf-8')
+		if len(content) > len(self.buffer):
+			raise ValueError('Zones do not fit into the table (' + str(len(content)) + ' bytes)')
+
+		self.generation.value += 1
+		self.buffer[:len(content)] = content
+		self.length.value = len(content)
+		self.generation.value += 1
+		return self.generation.value
+
+	def wait_for_change(self, generation: int, timeout: float=None):
+		"""
+		Blocks until the table changes, i.e. a write other than the one of the
+		caller's generation completes
+		:param generation: the last generation the caller knows about
+		(odd if it was read while a write was in progress)
+		:param timeout: in seconds (None means no timeout)
+		:return: True if the table has changed
+		"""
+		deadline = None if timeout is None else time.monotonic() + timeout
+		while True:
+			current = self.generation.value
+			if current != generation and not current & 1:
+				return True
+			if deadline is not None and time.monotonic() >= deadline:
+				return False
+			time.sleep(ZoneTable.POLL_INTERVAL)
+
+
+class ZoneManager:
+	"""
+	Manages the zones of the system. Zones live in a shared in-memory table,
+	so the stream processes can check them on every alert without touching the disk.
+	Listeners are notified about changes no matter which process made them.
+	The instance that created the table (the owner) persists every change to the
+	config file on a background thread (write + atomic rename), so processes that
+	get terminated never leave a half-written config behind.
+	"""
+	LOGGER = logging.getLogger('ZoneManager')
+	# seconds between two checks of the closed flag by the watcher
+	WATCH_INTERVAL = 0.2
 
 	@staticmethod
 	def get_abs_path(file: str):
@@ -15,115 +106,220 @@ class ZoneManager:
 
 	CONFIG_PATH = get_abs_path.__func__('../../config/prod/pca_system.json')
 
+	INSTANCE = None
+
+	def __init__(self, config_path: str=CONFIG_PATH, table: ZoneTable=None):
+		"""
+		Constructor
+		:param config_path: JSON config the zones are loaded from and persisted into
+		:param table: shared table (a new one is created if not given)
+		"""
+		self.config_path = config_path
+		self.owner = table is None
+		self.table = table if table else ZoneTable()
+		self.generation = -1
+		self.zones = dict()
+		self.listeners = []
+		self.watcher = None
+		self.closed = Event()
+		# the watcher thread and the callers of flush write the same files
+		self.flush_lock = Lock()
+
+	def __getstate__(self):
+		"""
+		Only the shared table and the config path travel to other processes
+		:return: state to be pickled
+		"""
+		return {'config_path': self.config_path, 'table': self.table}
+
+	def __setstate__(self, state):
+		"""
+		The unpickled instance becomes the shared instance of the new process
+		:param state: pickled state
+		"""
+		self.__init__(state['config_path'], state['table'])
+		if ZoneManager.INSTANCE is None:
+			ZoneManager.INSTANCE = self
+
+	@staticmethod
+	def get_instance():
+		"""
+		:return: the ZoneManager shared by every component of the process (and its children)
+		"""
+		if ZoneManager.INSTANCE is None:
+			ZoneManager.INSTANCE = ZoneManager()
+		return ZoneManager.INSTANCE
+
+	def read_config(self):
+		"""
+		:return: the zones stored in the config file
+		"""
+		with open(self.config_path, 'r') as file:
+			data = json.load(file)
+		return data['stream_controller'].get('zones', dict())
+
 	def initialize(self):
 		"""
-		Function, that initialize the zone manager module
-		:param _zones: the zones coming from the html code
+		Loads the zones from the config file into the shared table (only if not loaded yet).
+		The owner starts persisting the changes even if another process loaded the table.
 		"""
-		ZoneManager.LOGGER.info('Initializing ZoneManager...')
-		with open(ZoneManager.CONFIG_PATH, 'r') as file:
-			config = file.read()
+		if not self.table.get_generation():
+			with self.table.lock:
+				if not self.table.get_generation():
+					ZoneManager.LOGGER.info('Initializing ZoneManager...')
+					self.table.write(self.read_config())
+					ZoneManager.LOGGER.info('ZoneManager inizialized')
 
-		data = json.loads(config)
-		stream_controller = data['stream_controller']
-		zones = stream_controller['zones'] 
+		if self.owner and self.save not in self.listeners:
+			self.add_listener(self.save)
 
-		if zones:
-			ZoneManager.LOGGER.info('ZoneManager inizialized')
-		else:
-			ZoneManager.LOGGER.info('Error initializing ZoneManager')
+	def reload(self):
+		"""
+		Reloads the zones from the config file (e.g. after the config was edited)
+		"""
+		with self.table.lock:
+			self.table.write(self.read_config())
 
-	def set_zones(self,zones: str):
+	def refresh(self):
 		"""
-		Save the JSON config with the new zones
-		:param zones: the new version of zones
+		Updates the local copy of the zones if the shared table has changed
 		"""
-		ZoneManager.LOGGER.info('Setting up new zones')
-		with open(ZoneManager.CONFIG_PATH, 'r') as file:
-			config = file.read()
+		self.initialize()
+		if self.table.get_generation() != self.generation:
+			self.generation, self.zones = self.table.read()
 
-		data = json.loads(config)
-		data['stream_controller']['zones'] = zones
+	def update(self, modifier):
+		"""
+		Modifies the zones atomically
+		:param modifier: function taking and modifying the zones dictionary
+		"""
+		self.initialize()
+		with self.table.lock:
+			_, zones = self.table.read()
+			modifier(zones)
+			self.table.write(zones)
 
-		with open(ZoneManager.CONFIG_PATH, 'w+') as file:
-			json.dump(fp=file, obj=data, indent=4, sort_keys=True)
+	def save(self, zones: dict):
+		"""
+		Listener of the owner instance, persists the changes
+		:param zones: not used, flush always writes the latest version
+		"""
+		try:
+			self.flush()
+		except Exception as e:
+			ZoneManager.LOGGER.error('Cannot save zones: ' + str(e))
 
-	def get_zones(self):
+	def flush(self):
 		"""
-		Function returns avaiable zones in the system
-		return: dictionary of zones
+		Writes the current zones into the config file (write to a temporary file + rename)
 		"""
-		ZoneManager.LOGGER.info('Getting zone informations')
-		with open(ZoneManager.CONFIG_PATH, 'r') as file:
-			config = file.read()
+		with self.flush_lock:
+			_, zones = self.table.read()
+			with open(self.config_path, 'r') as file:
+				data = json.load(file)
+			data['stream_controller']['zones'] = zones
 
-		data = json.loads(config)
-		stream_controller = data['stream_controller']
-		zones = stream_controller['zones']
-		return zones
+			tmp_path = self.config_path + '.tmp'
+			with open(tmp_path, 'w') as file:
+				json.dump(fp=file, obj=data, indent=4, sort_keys=True)
+			os.replace(tmp_path, self.config_path)
 
-	def add_zone(self,zone: str):
+	def add_listener(self, listener):
 		"""
-		Add new zone
-		Save into the JSON config
+		Registers a function to be called (with the new zones) when any process changes them
+		:param listener: function object
 		"""
-		with open(ZoneManager.CONFIG_PATH, 'r') as file:
-			config = file.read()
+		self.listeners.append(listener)
+		if self.watcher is None:
+			self.watcher = Thread(target=self.watch, name='ZoneWatcher', daemon=True)
+			self.watcher.start()
 
-		data = json.loads(config)
-		data['stream_controller']['zones'][zone] = False
+	def close(self):
+		"""
+		Stops the watcher thread, the listeners are not notified any more
+		"""
+		self.closed.set()
+		if self.watcher is not None:
+			self.watcher.join()
+			self.watcher = None
 
-		with open(ZoneManager.CONFIG_PATH, 'w+') as file:
-			json.dump(fp=file, obj=data, indent=4, sort_keys=True)
+	def watch(self):
+		"""
+		Notifies the listeners about changes of the shared table until the instance is closed
+		"""
+		# even generation, the changes of a write in progress are not missed
+		generation, _ = self.table.read()
+		while not self.closed.is_set():
+			if self.table.wait_for_change(generation, ZoneManager.WATCH_INTERVAL):
+				generation, zones = self.table.read()
+				for listener in self.listeners:
+					try:
+						listener(zones)
+					except Exception as e:
+						ZoneManager.LOGGER.error('Zone listener failed: ' + str(e))
 
-	def delete_zone(self,zone: str):
+	def set_zones(self, zones: dict):
 		"""
-		Deleting zone
-		Save into the JSON config
+		Replaces the zones
+		:param zones: the new version of zones
 		"""
-		with open(ZoneManager.CONFIG_PATH, 'r') as file:
-			config = file.read()
+		def replace(current):
+			current.clear()
+			current.update(zones)
 
-		data = json.loads(config)
-		del data['stream_controller']['zones'][zone]
+		ZoneManager.LOGGER.info('Setting up new zones')
+		self.update(replace)
 
-		with open(ZoneManager.CONFIG_PATH, 'w+') as file:
-			json.dump(fp=file, obj=data, indent=4, sort_keys=True)	
+	def get_zones(self):
+		"""
+		Function returns avaiable zones in the system
+		return: dictionary of zones
+		"""
+		self.refresh()
+		return dict(self.zones)
 
-	def is_zone_active(self,zone: str):
+	def add_zone(self, zone: str):
 		"""
-		Function for deciding whether the zone is active or not
-		:param zone: zone, from which we want to know whether active or not
+		Adds a new (inactive) zone
+		:param zone: name of the zone
 		"""
-		with open(ZoneManager.CONFIG_PATH, 'r') as file:
-			config = file.read()
+		def add(current):
+			current[zone] = False
 
-		data = json.loads(config)
-		zones = data['stream_controller']['zones'] 
+		ZoneManager.LOGGER.info('Adding zone ' + zone)
+		self.update(add)
 
-		for key, value in zones.items():
-			if key == zone and zones[key] == True:
-				ZoneManager.LOGGER.info(zone + ' is active')
-				return True
-		ZoneManager.LOGGER.info(zone + ' is inactive, not alert')
-		return False
+	def delete_zone(self, zone: str):
+		"""
+		Deletes the zone
+		:param zone: name of the zone
+		"""
+		def delete(current):
+			current.pop(zone, None)
 
+		ZoneManager.LOGGER.info('Deleting zone ' + zone)
+		self.update(delete)
 
-	def toggle_zone(self,zone: str):
+	def is_zone_active(self, zone: str):
+		"""
+		Function for deciding whether the zone is active or not
+		:param zone: zone, from which we want to know whether active or not
+		"""
+		self.refresh()
+		if self.zones.get(zone) is True:
+			ZoneManager.LOGGER.debug(zone + ' is active')
+			return True
+		ZoneManager.LOGGER.debug(str(zone) + ' is inactive, not alert')
+		return False
+
+	def toggle_zone(self, zone: str):
 		"""
 		Function for toggle zone activity
 		:param zone: the actual zone what we want to activate or deactivate
 		"""
-		with open(ZoneManager.CONFIG_PATH, 'r') as file:
-			config = file.read()
-
-		data = json.loads(config)
-		zones = data['stream_controller']['zones']
-
-		for key, value in zones.items():
-				if key == zone:
-					zones[key] = not value
-					ZoneManager.LOGGER.info('Toggle ' + key + ' activity')
-					self.set_zones(zones)
-	
+		def toggle(current):
+			if zone in current:
+				current[zone] = not current[zone]
+				ZoneManager.LOGGER.info('Toggle ' + zone + ' activity')
 
+		self.update(toggle)
@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+import cv2
+from tornado.ioloop import IOLoop
+
+
+class FeedHub:
+    """
+    Live feed of a camera producer shared by every viewer.
+    A worker thread waits for the new frames, encodes each of them once to JPEG
+    and the IOLoop pushes the same bytes to every subscriber (websockets, MJPEG streams).
+    A subscriber still busy with the previous frame skips the new one,
+    so slow clients never make frames pile up in memory.
+    """
+    LOGGER = logging.getLogger('FeedHub')
+    TIMEOUT = 1
+    QUALITY = 70
+    SCALE = 0.5
+
+    HUBS = dict()
+
+    def __init__(self, producer, data_proxy, quality: int=QUALITY, scale: float=SCALE):
+        """
+        Constructor
+        :param producer: camera Producer
+        :param data_proxy: shared data proxy of the producer
+        :param quality: JPEG quality (0-100)
+        :param scale: resize factor of the frames
+        """
+        self.producer = producer
+        self.data_proxy = data_proxy
+        self.quality = quality
+        self.scale = scale
+        self.io_loop = IOLoop.current()
+        # subscriber -> Future of the frame being sent to it (None if idle)
+        self.subscribers = dict()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.dropped = 0
+
+    @staticmethod
+    def get_hub(producer, data_proxy, quality: int=QUALITY, scale: float=SCALE):
+        """
+        Must be called on the IOLoop thread
+        :param producer: camera Producer
+        :param data_proxy: shared data proxy of the producer
+        :param quality: JPEG quality (0-100)
+        :param scale: resize factor of the frames
+        :return: the hub of the producer (a new one if the PCA was restarted meanwhile)
+        """
+        name = producer.get_name()
+        hub = FeedHub.HUBS.get(name)
+        if hub is None or hub.data_proxy is not data_proxy:
+            hub = FeedHub.HUBS[name] = FeedHub(producer, data_proxy, quality, scale)
+        return hub
+
+    def subscribe(self, subscriber):
+        """
+        Starts sending the frames to the subscriber
+        :param subscriber: object with a send_frame(jpeg) method returning a Future
+        """
+        with self.lock:
+            self.subscribers[subscriber] = None
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.encode_loop, name='FeedHub', daemon=True)
+                self.thread.start()
+
+    def unsubscribe(self, subscriber):
+        """
+        :param subscriber: see subscribe
+        """
+        with self.lock:
+            self.subscribers.pop(subscriber, None)
+
+    def encode(self, img):
+        """
+        :param img: numpy array
+        :return: JPEG bytes
+        """
+        if self.scale != 1:
+            img = cv2.resize(img, (0, 0), fx=self.scale, fy=self.scale)
+        return cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self.quality])[1].tobytes()
+
+    def encode_loop(self):
+        """
+        Worker thread, runs while there are subscribers
+        """
+        FeedHub.LOGGER.info('Starting feed of ' + self.producer.get_name())
+        seq = 0
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    break
+            try:
+                sample = self.producer.get_next(self.data_proxy, seq, FeedHub.TIMEOUT, copy=True)
+                if sample is None or sample.data is None:
+                    continue
+                seq = sample.seq
+                self.io_loop.add_callback(self.publish, self.encode(sample.data))
+            except Exception as e:
+                # e.g. the PCA is being stopped, the viewers have to select the feed again
+                FeedHub.LOGGER.error('Feed of ' + self.producer.get_name() + ' failed: ' + str(e))
+                time.sleep(FeedHub.TIMEOUT)
+        FeedHub.LOGGER.info('Stopping feed of ' + self.producer.get_name())
+
+    def publish(self, jpeg: bytes):
+        """
+        Sends the frame to the subscribers (runs on the IOLoop)
+        :param jpeg: encoded frame
+        """
+        self.frames += 1
+        for subscriber, pending in list(self.subscribers.items()):
+            if pending is not None and not pending.done():
+                self.dropped += 1
+                continue
+            try:
+                future = subscriber.send_frame(jpeg)
+                # failures show up at the next frame, the result is retrieved here to keep the log clean
+                future.add_done_callback(lambda f: f.exception())
+                self.subscribers[subscriber] = future
+            except Exception as e:
+                FeedHub.LOGGER.info('Dropping feed subscriber: ' + str(e))
+                self.unsubscribe(subscriber)
@@ -2,14 +2,17 @@ from tornado.ioloop import IOLoop
 from tornado.httpserver import HTTPServer
 from tornado.web import Application, RequestHandler, authenticated
 from tornado.websocket import WebSocketHandler
+from tornado.locks import Event, Lock
+from tornado import gen
+from concurrent.futures import ThreadPoolExecutor
 import multiprocessing as mp
 import os, sys, logging, uuid, base64, json
-import cv2
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 from raspberry_sec.system.zonemanager import ZoneManager
 from raspberry_sec.system.main import PCARuntime, LogRuntime
 from raspberry_sec.system.util import ProcessReady
 from raspberry_sec.interface.producer import Type
+from raspberry_sec.ui.feed import FeedHub
 import raspberry_sec.ui.util as secutil
 
 
@@ -17,9 +20,14 @@ class BaseHandler(RequestHandler):
 
     PCA_RUNTIME = 'pca'
 
+    PCA_STATE = 'pca_state'
+
     LOG_RUNTIME = 'log'
 
-    ZONEMANAGER = ZoneManager()
+    # blocking work (password hashing, file IO, PCA start/stop) runs here instead of the IOLoop
+    EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+    ZONEMANAGER = ZoneManager.get_instance()
 
     @staticmethod
     def get_abs_path(file: str):
@@ -34,7 +42,7 @@ class BaseHandler(RequestHandler):
 
     def initialize(self, shared_data):
         self.shared_data = shared_data
-        self.zone_manager = ZoneManager()
+        self.zone_manager = BaseHandler.ZONEMANAGER
 
     def get_log_runtime(self):
         """
@@ -57,6 +65,41 @@ class BaseHandler(RequestHandler):
     def set_pca_runtime(self, value):
         self.shared_data[BaseHandler.PCA_RUNTIME] = value
 
+    def get_pca_state(self):
+        """
+        :return: lifecycle state of the PCA (see ControlHandler)
+        """
+        return self.shared_data.get(BaseHandler.PCA_STATE, ControlHandler.OFFLINE)
+
+    def set_pca_state(self, value: str):
+        self.shared_data[BaseHandler.PCA_STATE] = value
+
+    def run_blocking(self, fn, *args):
+        """
+        Runs the function on the executor, the IOLoop keeps serving the other clients meanwhile
+        :param fn: blocking function
+        :param args: arguments of fn
+        :return: Future of the result (to be yielded in a coroutine)
+        """
+        return BaseHandler.EXECUTOR.submit(fn, *args)
+
+    def get_feed_hub(self, name: str):
+        """
+        :param name: name of the camera producer
+        :return: None or the FeedHub of the producer
+        """
+        runtime = self.get_pca_runtime()
+        if not runtime:
+            return None
+        producers = [p for p in runtime.pca_system.producer_set if p.get_name() == name and Type.CAMERA == p.get_type()]
+        if not producers or producers[0] not in runtime.pca_system.prod_to_proxy:
+            return None
+        return FeedHub.get_hub(
+            producers[0],
+            runtime.pca_system.prod_to_proxy[producers[0]],
+            quality=self.settings.get('feed_quality', FeedHub.QUALITY),
+            scale=self.settings.get('feed_scale', FeedHub.SCALE))
+
     def get_current_user(self):
         """
         Returns secure cookie content
@@ -81,18 +124,43 @@ class ConfigureHandler(BaseHandler):
 
     LOGGER = logging.getLogger('ConfigureHandler')
 
+    @staticmethod
+    def read_config():
+        """
+        :return: content of the config file
+        """
+        with open(BaseHandler.CONFIG_PATH, 'r') as file:
+            return file.read()
+
+    def write_config(self, new_config: str, runtime: PCARuntime):
+        """
+        Saves the config file, reloads the zones from it and applies it to the running PCA
+        (only the changed components are restarted)
+        :param new_config: content of the config file
+        :param runtime: None or the running PCARuntime
+        """
+        with open(BaseHandler.CONFIG_PATH, 'w') as file:
+            file.write(new_config)
+        try:
+            self.zone_manager.reload()
+        except Exception as e:
+            ConfigureHandler.LOGGER.warning('Cannot reload zones: ' + str(e))
+        if runtime:
+            runtime.reload(PCARuntime.load_pca(BaseHandler.CONFIG_PATH))
+
     @authenticated
+    @gen.coroutine
     def get(self):
         """
         Returns the configure.html template
         """
         ConfigureHandler.LOGGER.info('Handling GET message')
-        with open(BaseHandler.CONFIG_PATH, 'r') as file:
-            config = file.read()
+        config = yield self.run_blocking(ConfigureHandler.read_config)
 
         self.render('configure.html', configuration=config)
 
     @authenticated
+    @gen.coroutine
     def post(self):
         """
         Saves the configuration
@@ -102,9 +170,13 @@ class ConfigureHandler(BaseHandler):
 
         new_config = self.get_argument('cfg_content')
         if new_config:
-            with open(BaseHandler.CONFIG_PATH, 'w') as file:
-                file.write(new_config)
-            self.write('Success')
+            runtime = self.get_pca_runtime() if ControlHandler.ONLINE == self.get_pca_state() else None
+            try:
+                yield self.run_blocking(self.write_config, new_config, runtime)
+                self.write('Success')
+            except Exception as e:
+                ConfigureHandler.LOGGER.error('Cannot apply configuration: ' + str(e))
+                self.write('Error: ' + str(e))
         else:
             self.write('Error')
 
@@ -113,43 +185,81 @@ class ControlHandler(BaseHandler):
 
     LOGGER = logging.getLogger('ControlHandler')
 
+    # lifecycle states of the PCA
+    OFFLINE = 'Offline'
+    STARTING = 'Starting'
+    ONLINE = 'Online'
+    STOPPING = 'Stopping'
+    ERROR = 'Error'
+
+    # one start/stop at a time
+    LIFECYCLE_LOCK = Lock()
+
     def status(self):
         """
         Builds the dictionary the template engine will use for filling the html
         """
         status = dict()
-        if self.get_pca_runtime():
-            status['text'] = 'Online'
-            status['start'] = 'disabled'
-            status['stop'] = ''
-        else:
-            status['text'] = 'Offline'
-            status['start'] = ''
-            status['stop'] = 'disabled'
+        state = self.get_pca_state()
+        status['text'] = state
+        # a running PCA can be armed again with other zones
+        status['start'] = 'disabled' if state in (ControlHandler.STARTING, ControlHandler.STOPPING) else ''
+        status['stop'] = '' if state in (ControlHandler.ONLINE, ControlHandler.ERROR) else 'disabled'
         return status
 
-    def stop_pca(self):
+    @staticmethod
+    def stop_pca(runtime: PCARuntime):
         """
-        Stops the service if still running
+        Stops the service (waits for its processes)
+        :param runtime: PCARuntime
         """
         ControlHandler.LOGGER.info('Stopping PCA')
-        runtime = self.get_pca_runtime()
-        if runtime:
-            runtime.stop()
-            self.set_pca_runtime(None)
+        runtime.stop()
 
-    def start_pca(self):
+    @staticmethod
+    def start_pca(log_queue):
         """
-        Starts the service
+        Loads the configuration and starts the service
+        :param log_queue: logging queue of the UI
+        :return: the running PCARuntime
         """
         ControlHandler.LOGGER.info('Starting PCA')
 
-        pca_runtime = PCARuntime(
-            self.get_log_runtime().log_queue,
-            PCARuntime.load_pca(BaseHandler.CONFIG_PATH))
-
-        self.set_pca_runtime(pca_runtime)
+        pca_runtime = PCARuntime(log_queue, PCARuntime.load_pca(BaseHandler.CONFIG_PATH))
         pca_runtime.start()
+        return pca_runtime
+
+    @gen.coroutine
+    def change_lifecycle(self, on: bool, zones: dict):
+        """
+        Stops or starts the PCA on the executor, the state can be polled meanwhile.
+        Arming zones of a running PCA does not restart it (the zones are shared live).
+        :param on: True for starting, False for stopping
+        :param zones: zones to be armed (if on)
+        """
+        with (yield ControlHandler.LIFECYCLE_LOCK.acquire()):
+            try:
+                runtime = self.get_pca_runtime()
+                if on and runtime and runtime.pca_thread.is_alive():
+                    yield self.run_blocking(self.zone_manager.set_zones, zones)
+                    self.set_pca_state(ControlHandler.ONLINE)
+                    return
+
+                if runtime:
+                    self.set_pca_state(ControlHandler.STOPPING)
+                    yield self.run_blocking(ControlHandler.stop_pca, runtime)
+                    self.set_pca_runtime(None)
+                self.set_pca_state(ControlHandler.OFFLINE)
+
+                if on:
+                    self.set_pca_state(ControlHandler.STARTING)
+                    runtime = yield self.run_blocking(ControlHandler.start_pca, self.get_log_runtime().log_queue)
+                    self.set_pca_runtime(runtime)
+                    yield self.run_blocking(self.zone_manager.set_zones, zones)
+                    self.set_pca_state(ControlHandler.ONLINE)
+            except Exception as e:
+                ControlHandler.LOGGER.error('PCA lifecycle change failed: ' + str(e))
+                self.set_pca_state(ControlHandler.ERROR)
 
     @authenticated
     def get(self):
@@ -163,41 +273,49 @@ class ControlHandler(BaseHandler):
     @authenticated
     def post(self):
         """
-        Controls the PCA system
+        Controls the PCA system, the change happens in the background (see ControlStatusHandler)
         """
         ControlHandler.LOGGER.info('Handling POST message')
         self.set_header('Content-Type', 'text/plain')
 
-        on = 'true' == self.get_argument('on')       
-        zones = self.get_argument('zone')
-        zone_manager = ZoneManager()
-        if on:
-            self.stop_pca()
-            self.start_pca()
-            runtime = self.get_pca_runtime()
-            zone_manager.set_zones(json.loads(zones))
- 
-        else:
-            self.stop_pca()
+        on = 'true' == self.get_argument('on')
+        zones = json.loads(self.get_argument('zone')) if on else None
+        self.set_pca_state(ControlHandler.STARTING if on else ControlHandler.STOPPING)
+        IOLoop.current().spawn_callback(self.change_lifecycle, on, zones)
+        self.write(self.get_pca_state())
+
+
+class ControlStatusHandler(BaseHandler):
+
+    LOGGER = logging.getLogger('ControlStatusHandler')
+
+    @authenticated
+    def get(self):
+        """
+        Returns the lifecycle state of the PCA (polled by the control page)
+        """
+        state = self.get_pca_state()
+        self.write({
+            'state': state,
+            'busy': state in (ControlHandler.STARTING, ControlHandler.STOPPING)
+        })
 
 class ZonesHandler(BaseHandler):
 
     LOGGER = logging.getLogger('ZonesHandler')
 
     @authenticated
+    @gen.coroutine
     def get(self):
         """
         Returns zones from JSON config
         """
         ZonesHandler.LOGGER.info('Handling GET message')
-        
-        with open(BaseHandler.CONFIG_PATH, 'r') as file:
-            config = file.read()
-
-        data = json.loads(config)
-        self.write(data['stream_controller']['zones'])
+        zones = yield self.run_blocking(self.zone_manager.get_zones)
+        self.write(zones)
 
     @authenticated
+    @gen.coroutine
     def post(self):
         """
         Add new zone to JSON config
@@ -205,10 +323,11 @@ class ZonesHandler(BaseHandler):
         ZonesHandler.LOGGER.info('Handling POST message')
         
         new_zone = self.get_argument('zone') 
-        BaseHandler.ZONEMANAGER.add_zone(new_zone)
+        yield self.run_blocking(BaseHandler.ZONEMANAGER.add_zone, new_zone)
 
 
     @authenticated
+    @gen.coroutine
     def delete(self, zone):
         """
         Deleting existing zone
@@ -216,13 +335,14 @@ class ZonesHandler(BaseHandler):
         ZonesHandler.LOGGER.info('Handling DELETE message')
 
         deleted_zone = self.get_argument('zone') 
-        BaseHandler.ZONEMANAGER.delete_zone(deleted_zone)
+        yield self.run_blocking(BaseHandler.ZONEMANAGER.delete_zone, deleted_zone)
 
 class ZoneHandler(BaseHandler):
 
     LOGGER = logging.getLogger('ZoneHandler')
 
     @authenticated
+    @gen.coroutine
     def post(self):
         """
         Deleting existing zone
@@ -230,7 +350,7 @@ class ZoneHandler(BaseHandler):
         ZoneHandler.LOGGER.info('Handling DELETE message')
 
         deleted_zone = self.get_argument('zone')
-        BaseHandler.ZONEMANAGER.delete_zone(deleted_zone)
+        yield self.run_blocking(BaseHandler.ZONEMANAGER.delete_zone, deleted_zone)
 
 class FeedHandler(BaseHandler):
 
@@ -266,6 +386,7 @@ class FeedWebSocketHandler(WebSocketHandler, BaseHandler):
         On opening a websocket
         """
         FeedWebSocketHandler.LOGGER.info('Opening web-socket')
+        self.hub = None
         auth = self.current_user
         if auth:
             FeedWebSocketHandler.LOGGER.info('Authenticated')
@@ -273,37 +394,78 @@ class FeedWebSocketHandler(WebSocketHandler, BaseHandler):
             FeedWebSocketHandler.LOGGER.warn('Not Authenticated')
             self.close()
 
-    def img_to_str(self, img):
+    def send_frame(self, jpeg: bytes):
         """
-        Converts the numpy ndarray into a HTML compatible png src
-        :param img: numpy array
-        :return: HTML compatible img src
+        Called by the FeedHub
+        :param jpeg: encoded frame
+        :return: Future resolved when the frame is sent
         """
-        resized = cv2.resize(img, (0, 0), fx=0.5, fy=0.5)
-        png_encoded = cv2.imencode('.png', resized)[1]
-        b64_encoded = base64.b64encode(png_encoded.tostring())
-        final_format = b64_encoded.decode('utf-8')
-        return '<img class="img-responsive center-block" src="data:image/png;base64,' + final_format + '">'
+        return self.write_message(jpeg, binary=True)
 
     def on_message(self, message):
         """
-        On incoming message this method fetches an image from the given producer and sends it back
+        Subscribes to the feed of the given producer, the frames are pushed as binary JPEG messages
         :param message: name of the producer
         """
         FeedWebSocketHandler.LOGGER.info('Handling web-socket message')
-        selected = message
-        runtime = self.get_pca_runtime()
+        if self.hub:
+            self.hub.unsubscribe(self)
 
-        if not runtime or not [p for p in runtime.pca_system.producer_set if p.get_name() == selected]:
-            self.write_message('ERROR')
+        self.hub = self.get_feed_hub(message)
+        if self.hub:
+            self.hub.subscribe(self)
         else:
-            producer = [p for p in runtime.pca_system.producer_set if p.get_name() == selected][0]
-            proxy = runtime.pca_system.prod_to_proxy[producer]
-            self.write_message(self.img_to_str(proxy.get_data()))
+            self.write_message('ERROR')
 
     def on_close(self):
         FeedWebSocketHandler.LOGGER.info('Closing web-socket')
-        pass
+        if getattr(self, 'hub', None):
+            self.hub.unsubscribe(self)
+
+
+class FeedMJPEGHandler(BaseHandler):
+
+    LOGGER = logging.getLogger('FeedMJPEGHandler')
+
+    BOUNDARY = 'frame'
+
+    def send_frame(self, jpeg: bytes):
+        """
+        Called by the FeedHub
+        :param jpeg: encoded frame
+        :return: Future resolved when the frame is flushed
+        """
+        self.write(('--' + FeedMJPEGHandler.BOUNDARY + '\r\nContent-Type: image/jpeg\r\nContent-Length: '
+                    + str(len(jpeg)) + '\r\n\r\n').encode())
+        self.write(jpeg)
+        self.write(b'\r\n')
+        return self.flush()
+
+    @authenticated
+    @gen.coroutine
+    def get(self, producer):
+        """
+        Streams the feed of the producer as multipart JPEG (e.g. for an img tag)
+        :param producer: name of the producer
+        """
+        FeedMJPEGHandler.LOGGER.info('Handling GET message')
+        hub = self.get_feed_hub(producer)
+        if not hub:
+            self.send_error(404)
+            return
+
+        self.closed = Event()
+        self.set_header('Content-Type', 'multipart/x-mixed-replace; boundary=' + FeedMJPEGHandler.BOUNDARY)
+        self.set_header('Cache-Control', 'no-cache')
+        hub.subscribe(self)
+        try:
+            yield self.closed.wait()
+        finally:
+            hub.unsubscribe(self)
+
+    def on_connection_close(self):
+        if getattr(self, 'closed', None):
+            self.closed.set()
 
 
 class AboutHandler(BaseHandler):
@@ -350,12 +512,14 @@ class LoginHandler(BaseHandler):
         LoginHandler.LOGGER.info('Handling DELETE message')
         self.clear_cookie('admin')
 
+    @gen.coroutine
     def post(self):
         """
-        Authenticates the user
+        Authenticates the user (scrypt runs on the executor)
         """
         LoginHandler.LOGGER.info('Handling POST message')
-        if self.check_credential(self.get_argument('password')):
+        valid = yield self.run_blocking(self.check_credential, self.get_argument('password'))
+        if valid:
             self.set_secure_cookie('admin', 'AUTH')
             self.redirect(url=self.get_argument('next', u'/'))
         else:
@@ -376,7 +540,9 @@ def make_app(log_runtime: LogRuntime):
         'static_path': 'static',
         'login_url': '/login',
         'cookie_secret': base64.b64encode(uuid.uuid4().bytes + uuid.uuid4().bytes + uuid.uuid4().bytes),
-        'xsrf_cookies': False
+        'xsrf_cookies': False,
+        'feed_quality': FeedHub.QUALITY,
+        'feed_scale': FeedHub.SCALE
     }
 
     # Endpoints
@@ -384,10 +550,12 @@ def make_app(log_runtime: LogRuntime):
         (r'/', MainHandler, config),
         (r'/configure', ConfigureHandler, config),
         (r'/control', ControlHandler, config),
+        (r'/control/status', ControlStatusHandler, config),
         (r'/zones', ZonesHandler, config),
         (r'/zones/.*', ZoneHandler, config),
         (r'/feed', FeedHandler, config),
         (r'/feed/websocket', FeedWebSocketHandler, config),
+        (r'/feed/mjpeg/(.*)', FeedMJPEGHandler, config),
         (r'/about', AboutHandler, config),
         (r'/login', LoginHandler, config)],
         **settings
@@ -9,11 +9,26 @@ $('.dropdown-menu li a').click(function() {
     var selected = $(this).text();
     $('#feed_dropdown:first-child').html(selected + ' <span class="caret"></span>');
 
+    if(window.feedSocket)
+        window.feedSocket.close();
+
+    // the server pushes binary JPEG frames
     var ws = new WebSocket('wss://' + location.host + '/feed/websocket');
+    ws.binaryType = 'blob';
+    window.feedSocket = ws;
+
+    $('#feed_content').html('<img class="img-responsive center-block" id="feed_img">');
+    var frameUrl = null;
 
     ws.onmessage = function(content) {
-       $('#feed_content').html(content.data);
-       setTimeout(() => ws.send(selected), 1000);
+        if(typeof content.data === 'string') {
+            $('#feed_content').html(content.data);
+            return;
+        }
+        if(frameUrl)
+            URL.revokeObjectURL(frameUrl);
+        frameUrl = URL.createObjectURL(content.data);
+        $('#feed_img').attr('src', frameUrl);
     };
 
     ws.onopen = function(e) {
@@ -50,11 +65,23 @@ function ctrlButtonSend(onStr, zone) {
         },
         url : 'control',
         success : function(data){
-            location.reload();
+            $('#ctrl_start, #ctrl_stop').prop('disabled', true);
+            pollCtrlStatus();
         }
     });
 }
 
+// the PCA starts/stops in the background, the page is reloaded when it is done
+function pollCtrlStatus() {
+    $.getJSON('control/status', function(data) {
+        $('#ctrl_status').text(data.state);
+        if(data.busy)
+            setTimeout(pollCtrlStatus, 1000);
+        else
+            location.reload();
+    });
+}
+
 function onDeleteZone(zone) {
 	$.ajax({
 	    url: '/zones/' + zone,